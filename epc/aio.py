@@ -0,0 +1,322 @@
+# Copyright (C) 2012-  Takafumi Arakaki
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+EPC server and client running on an :mod:`asyncio` event loop.
+
+This module requires Python 3.7 or later.  Unlike :mod:`epc.server`
+and :mod:`epc.client`, no thread is used: every connection is a task
+and every ``call`` request is run in its own task, so that many calls
+can be in flight at the same time.  Registered functions may be
+coroutine functions (``async def``) or return any other awaitable or
+a :class:`concurrent.futures.Future`.
+
+"""
+
+import asyncio
+import inspect
+from concurrent import futures
+
+from .core import EPCCore
+from .server import EPCServer, EPCClientManager
+from .metrics import clock
+from .handler import EPCHandler, EPCCallManager, EPCClosed, \
+    encode_message, future_callbacks, _call_state
+
+
+class AsyncEPCHandler(EPCHandler):
+
+    """
+    :class:`EPCHandler` for a connection made of asyncio streams.
+
+    Use :meth:`call` and :meth:`methods` to call the peer.  They are
+    coroutines returning the reply.  A ``cancel`` message from the
+    peer cancels the task running the call.  :meth:`call_sync` and
+    :meth:`methods_sync` must not be used as they block the event
+    loop.
+
+    """
+
+    chunksize = 1 << 16
+    """
+    Maximum number of bytes fed to the decoder at once.
+    """
+
+    def __init__(self, reader, writer, server):
+        # `BaseRequestHandler.__init__` runs everything synchronously
+        # so it is not called here.  See `handle` instead.
+        self.reader = reader
+        self.writer = writer
+        self.server = server
+        self.client_address = writer.get_extra_info('peername')
+        self.callmanager = EPCCallManager()
+        self._tasks = set()
+        self._calls = {}
+        self._measured = {}
+
+    async def handle(self):
+        """
+        Read and handle messages until the connection is closed.
+        """
+        self.server.add_client(self)
+        try:
+            while True:
+                try:
+                    decoder = await self._read_message()
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                self._handle(decoder)
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+            self.writer.close()
+            self.server.remove_client(self)
+
+    async def _read_message(self):
+        head = await self.reader.readexactly(6)
+        rest = int(head, 16)
+        decoder = self._new_decoder()
+        while rest > 0:
+            data = await self.reader.read(min(rest, self.chunksize))
+            if not data:
+                raise asyncio.IncompleteReadError(data, rest)
+            decoder.feed(data)
+            rest -= len(data)
+        return decoder
+
+    def _send(self, *args):
+        if self.writer.transport.is_closing():
+            raise EPCClosed
+        hooks = self.server.hooks
+        if not (hooks.frame_encoded or hooks.frame_written or self._measured):
+            self.writer.write(encode_message(*args))
+            return
+        started = clock()
+        try:
+            data = encode_message(*args)
+        except Exception:
+            self._finish_reply(args, error=True)
+            raise
+        self._finish_reply(args, nbytes=len(data))
+        hooks.fire('frame_encoded', self, args[0], args[1], len(data),
+                   clock() - started)
+        self.writer.write(data)
+        hooks.fire('frame_written', self, len(data))
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _handle_call(self, uid, meth, args):
+        received = getattr(_call_state, 'received', None)
+        task = self._calls[uid] = self._spawn(
+            self._handle_call_async(uid, meth, args, received))
+        task.add_done_callback(lambda _: self._calls.pop(uid, None))
+
+    def _handle_cancel(self, uid):
+        task = self._calls.pop(uid, None)
+        if task is not None:
+            task.cancel()
+
+    async def _handle_call_async(self, uid, meth, args, received=None):
+        try:
+            _call_state.received = received
+            try:
+                reply = EPCHandler._handle_call(self, uid, meth, args)
+            finally:
+                _call_state.received = None
+            if isinstance(reply[2], futures.Future):
+                reply[2] = await asyncio.wrap_future(reply[2])
+            elif inspect.isawaitable(reply[2]):
+                reply[2] = await reply[2]
+            self._send(*reply)
+            await self.writer.drain()
+        except asyncio.CancelledError:
+            self._finish_call(uid)
+            raise
+        except Exception as err:
+            self._finish_call(uid, error=True)
+            self._handle_exception(err, uid)
+
+    async def call(self, name, args=[]):
+        """
+        Call remote method `name` with `args` and return its result.
+
+        An error in the remote method is raised as
+        :class:`ReturnError` or :class:`EPCError`.  Use
+        :func:`asyncio.wait_for` to set timeout.  When this coroutine
+        is cancelled (e.g., on timeout), the call is cancelled by
+        :meth:`cancel <EPCHandler.cancel>`.
+
+        """
+        future = asyncio.get_event_loop().create_future()
+        uid = self.callmanager.call(
+            self, name, args, **future_callbacks(future))
+        return await self._wait_reply(future, uid)
+
+    async def methods(self):
+        """
+        Request info of callable remote methods.
+        """
+        future = asyncio.get_event_loop().create_future()
+        uid = self.callmanager.methods(self, **future_callbacks(future))
+        return await self._wait_reply(future, uid)
+
+    async def _wait_reply(self, future, uid):
+        try:
+            return await future
+        except asyncio.CancelledError:
+            self.cancel(uid)
+            raise
+
+
+class AsyncEPCServer(EPCClientManager, EPCCore):
+
+    """
+    EPC server built on :func:`asyncio.start_server`.
+
+    ::
+
+        server = AsyncEPCServer(('localhost', 0))
+
+        @server.register_function
+        async def echo(*a):
+            return a
+
+        async def main():
+            await server.start()
+            server.print_port()
+            await server.serve_forever()
+
+        asyncio.run(main())
+
+    Connected clients are available as :class:`AsyncEPCHandler`
+    objects in :attr:`clients <EPCClientManager.clients>`.
+
+    """
+
+    def __init__(self, server_address=('localhost', 0),
+                 debugger=None, log_traceback=False):
+        EPCClientManager.__init__(self)
+        EPCCore.__init__(self, debugger, log_traceback)
+        self.server_address = server_address
+        self._server = None
+
+    async def start(self):
+        """
+        Start listening on :attr:`server_address`.
+
+        The actual address (with the port chosen by the OS if port 0
+        is given) is stored in :attr:`server_address`.
+
+        """
+        (host, port) = self.server_address
+        self._server = await asyncio.start_server(self._accept, host, port)
+        self.server_address = self._server.sockets[0].getsockname()[:2]
+        self.logger.debug(
+            "AsyncEPCServer is started: server_address = %r",
+            self.server_address)
+        return self
+
+    async def _accept(self, reader, writer):
+        await AsyncEPCHandler(reader, writer, self).handle()
+
+    async def serve_forever(self):
+        """
+        Serve until :meth:`close` is called.
+        """
+        if self._server is None:
+            await self.start()
+        try:
+            await self._server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    def close(self):
+        """
+        Stop listening and close connections to all clients.
+        """
+        if self._server is not None:
+            self._server.close()
+        for handler in list(self.clients):
+            handler.writer.close()
+        self.shutdown_executors()
+
+    async def wait_closed(self):
+        """
+        Wait until :meth:`close` has stopped the server and every
+        connection to the clients.
+        """
+        if self._server is not None:
+            await self._server.wait_closed()
+        while self.clients:
+            await asyncio.sleep(0.01)
+
+    print_port = EPCServer.print_port
+
+
+class AsyncEPCClient(EPCCore):
+
+    """
+    EPC client built on :func:`asyncio.open_connection`.
+
+    ::
+
+        client = AsyncEPCClient()
+        await client.connect(('localhost', 9999))
+        print(await client.call('echo', [111, 222, 333]))
+        await client.close()
+
+    Like :class:`epc.client.EPCClient`, functions registered by
+    :meth:`register_function` can be called from the server.
+
+    .. method:: call
+
+       Alias of :meth:`AsyncEPCHandler.call`.
+
+    .. method:: methods
+
+       Alias of :meth:`AsyncEPCHandler.methods`.
+
+    """
+
+    def __init__(self, debugger=None, log_traceback=False):
+        EPCCore.__init__(self, debugger, log_traceback)
+        self.handler = None
+
+    async def connect(self, address):
+        """
+        Connect to the server at ``(host, port)`` `address`.
+        """
+        (reader, writer) = await asyncio.open_connection(*address)
+        self.handler = AsyncEPCHandler(reader, writer, self)
+        self.call = self.handler.call
+        self.methods = self.handler.methods
+        self.handler_task = asyncio.ensure_future(self.handler.handle())
+        return self
+
+    async def close(self):
+        """Close connection."""
+        if self.handler is None:
+            return
+        self.handler.writer.close()
+        await self.handler_task
+
+    def _ignore(*_):
+        """"Do nothing method for `EPCHandler`."""
+    add_client = _ignore
+    remove_client = _ignore
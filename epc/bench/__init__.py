@@ -0,0 +1,411 @@
+# Copyright (C) 2012-  Takafumi Arakaki
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of round trips between :class:`epc.client.EPCClient` and
+the EPC servers.
+
+Run it as::
+
+    python -m epc.bench --json result.json
+    python -m epc.bench --baseline result.json
+
+For each combination of server class, payload shape, payload size
+and concurrency, clients call ``echo`` with the payload for a while
+and the throughput and the 50th and 99th percentiles of the round
+trip time are reported.  Concurrency is the number of threads calling
+at the same time.  Each thread has its own connection, except for
+servers handling one connection at a time (:class:`EPCServer` and
+:class:`UnixEPCServer`), whose threads share one connection.
+
+With ``--json``, results are saved in a machine-readable form.  With
+``--baseline``, results are compared with saved ones and the command
+fails if any of them regressed by more than ``--threshold``.
+
+The same can be done from Python by :func:`run` and :func:`compare`.
+
+"""
+
+import os
+import sys
+import json
+import math
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+from ..client import EPCClient
+from ..server import EPCServer, ThreadingEPCServer, UnixEPCServer, \
+    ThreadingUnixEPCServer, PreforkEPCServer
+from ..utils import newthread
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+DEEP_LEVELS = 32
+
+
+def make_payload(shape, size):
+    """
+    Make a payload of `shape` with about `size` characters or items.
+
+    >>> make_payload('string', 3)
+    'xxx'
+    >>> make_payload('ints', 3)
+    [0, 1, 2]
+    >>> make_payload('unicode', 4) == u'\\u65e5\\u672c\\u8a9e\\u65e5'
+    True
+    >>> len(make_payload('deep', 64))
+    2
+
+    """
+    if shape == 'string':
+        return 'x' * size
+    elif shape == 'unicode':
+        text = u'\u65e5\u672c\u8a9e'
+        return (text * (size // len(text) + 1))[:size]
+    elif shape == 'ints':
+        return [i % 100 for i in range(size)]
+    elif shape == 'deep':
+        payload = []
+        for i in range(max(1, size // DEEP_LEVELS)):
+            item = i
+            for _ in range(DEEP_LEVELS):
+                item = [item]
+            payload.append(item)
+        return payload
+    raise ValueError('Unknown payload shape: {0}'.format(shape))
+
+
+PAYLOADS = ('string', 'unicode', 'ints', 'deep')
+"""
+Names of the payload shapes for :func:`make_payload`.
+"""
+
+
+def _serve_in_thread(server):
+    server.register_function(echo)
+    server.daemon_threads = True
+    thread = newthread(target=server.serve_forever)
+    thread.start()
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+        thread.join()
+    return stop
+
+
+def _make_tcp(server_class, **kwds):
+    def start():
+        server = server_class(('localhost', 0), **kwds)
+        return (server.server_address, _serve_in_thread(server))
+    return start
+
+
+def _make_unix(server_class):
+    def start():
+        tempdir = tempfile.mkdtemp()
+        server = server_class(os.path.join(tempdir, 'epc.sock'))
+        stop = _serve_in_thread(server)
+
+        def cleanup():
+            stop()
+            shutil.rmtree(tempdir)
+        return (server.server_address, cleanup)
+    return start
+
+
+def _start_async():
+    # Imported here as `epc.aio` is not importable before Python 3.7.
+    import asyncio
+    from ..aio import AsyncEPCServer
+    loop = asyncio.new_event_loop()
+    thread = newthread(target=loop.run_forever)
+    thread.daemon = True
+    thread.start()
+    server = AsyncEPCServer(('localhost', 0))
+    server.register_function(echo)
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+
+    def stop():
+        loop.call_soon_threadsafe(server.close)
+        asyncio.run_coroutine_threadsafe(server.wait_closed(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+    return (server.server_address, stop)
+
+
+SERVERS = {
+    'EPCServer': (_make_tcp(EPCServer), False),
+    'ThreadingEPCServer': (_make_tcp(ThreadingEPCServer), True),
+    'UnixEPCServer': (_make_unix(UnixEPCServer), False),
+    'ThreadingUnixEPCServer': (_make_unix(ThreadingUnixEPCServer), True),
+    'PreforkEPCServer': (_make_tcp(PreforkEPCServer, workers=2), True),
+    'AsyncEPCServer': (_start_async, True),
+}
+"""
+Servers to benchmark.  A value is a pair of a function which starts
+serving ``echo`` and returns ``(address, stop)``, and whether the
+server can serve several connections at once.
+"""
+
+
+def available_servers():
+    """
+    Return names in :data:`SERVERS` which work on this platform.
+    """
+    names = ['EPCServer', 'ThreadingEPCServer']
+    if hasattr(socket, 'AF_UNIX'):
+        names.extend(['UnixEPCServer', 'ThreadingUnixEPCServer'])
+    if hasattr(os, 'fork'):
+        names.append('PreforkEPCServer')
+    if sys.version_info >= (3, 7):
+        names.append('AsyncEPCServer')
+    return names
+
+
+def echo(*args):
+    return args
+
+
+def percentile(sorted_values, q):
+    """
+    Return the `q`-th percentile (0 to 100) of sorted values.
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 99)
+    4
+
+    """
+    index = int(math.ceil(q / 100.0 * len(sorted_values))) - 1
+    return sorted_values[min(max(index, 0), len(sorted_values) - 1)]
+
+
+def measure(server_name, shape, size, concurrency, duration):
+    """
+    Run one benchmark and return its result as a dictionary.
+
+    The keys are ``server``, ``payload``, ``size``, ``concurrency``,
+    ``calls``, ``throughput`` (calls per second) and ``p50_us`` and
+    ``p99_us`` (round trip time in microseconds).
+
+    """
+    (start_server, concurrent) = SERVERS[server_name]
+    (address, stop_server) = start_server()
+    args = [make_payload(shape, size)]
+    clients = []
+    timings = [[] for _ in range(concurrency)]
+    errors = []
+    try:
+        for _ in range(concurrency if concurrent else 1):
+            clients.append(_connect(address))
+        for client in clients:
+            client.call_sync('echo', args, timeout=10)  # warm up
+        start = threading.Event()
+        deadline = []
+
+        def run(i):
+            client = clients[i % len(clients)]
+            append = timings[i].append
+            start.wait()
+            try:
+                while True:
+                    t0 = _clock()
+                    client.call_sync('echo', args, timeout=10)
+                    t1 = _clock()
+                    append(t1 - t0)
+                    if t1 >= deadline[0]:
+                        break
+            except Exception as err:
+                errors.append(err)
+
+        threads = [newthread(target=run, args=(i,))
+                   for i in range(concurrency)]
+        for t in threads:
+            t.start()
+        began = _clock()
+        deadline.append(began + duration)
+        start.set()
+        for t in threads:
+            t.join()
+        elapsed = _clock() - began
+    finally:
+        for client in clients:
+            _disconnect(client)
+        stop_server()
+    if errors:
+        raise errors[0]
+    latencies = sorted(t for ts in timings for t in ts)
+    return dict(
+        server=server_name,
+        payload=shape,
+        size=size,
+        concurrency=concurrency,
+        calls=len(latencies),
+        throughput=len(latencies) / elapsed,
+        p50_us=percentile(latencies, 50) * 1e6,
+        p99_us=percentile(latencies, 99) * 1e6,
+    )
+
+
+def _connect(address, retries=50):
+    # A worker of `PreforkEPCServer` may not accept connections yet.
+    for _ in range(retries):
+        try:
+            return EPCClient(address)
+        except (OSError, socket.error):
+            time.sleep(0.05)
+    return EPCClient(address)
+
+
+def _disconnect(client):
+    # `EPCClient.close` does not close the socket.  Shut it down so
+    # that `EPCServer`, which serves in the thread running
+    # `serve_forever`, stops serving this connection.
+    client.close()
+    try:
+        client.socket.shutdown(socket.SHUT_RDWR)
+    except (OSError, socket.error):
+        pass
+    client.socket.close()
+
+
+def run(servers=None, payloads=PAYLOADS, sizes=(10, 1000, 100000),
+        concurrency=(1, 4), duration=1.0, callback=None):
+    """
+    Run :func:`measure` for all combinations and return the results.
+
+    `servers` defaults to :func:`available_servers`.  `callback`, if
+    given, is called with each result as soon as it is measured.
+
+    """
+    if servers is None:
+        servers = available_servers()
+    results = []
+    for server_name in servers:
+        for shape in payloads:
+            for size in sizes:
+                for n in concurrency:
+                    result = measure(server_name, shape, size, n, duration)
+                    if callback is not None:
+                        callback(result)
+                    results.append(result)
+    return results
+
+
+def result_key(result):
+    return (result['server'], result['payload'], result['size'],
+            result['concurrency'])
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Compare `results` with `baseline` results.
+
+    Return a list of ``(result, base, reasons)`` for regressed
+    results, where `reasons` is a list of strings.  A result regresses
+    if its throughput is lower, or its p99 latency is higher, than the
+    baseline by more than `threshold` (a fraction).  Results which are
+    not in `baseline` are ignored.
+
+    >>> base = dict(server='s', payload='p', size=1, concurrency=1,
+    ...             throughput=1000.0, p50_us=10.0, p99_us=20.0)
+    >>> slow = dict(base, throughput=800.0)
+    >>> [reasons for (_, _, reasons) in compare([slow], [base])]
+    [['throughput 800.0/s < 1000.0/s']]
+    >>> compare([dict(base, p99_us=21.0)], [base])
+    []
+
+    """
+    baseline = dict((result_key(b), b) for b in baseline)
+    regressions = []
+    for result in results:
+        base = baseline.get(result_key(result))
+        if base is None:
+            continue
+        reasons = []
+        if result['throughput'] < base['throughput'] * (1 - threshold):
+            reasons.append('throughput {0:.1f}/s < {1:.1f}/s'.format(
+                result['throughput'], base['throughput']))
+        if result['p99_us'] > base['p99_us'] * (1 + threshold):
+            reasons.append('p99 {0:.1f}us > {1:.1f}us'.format(
+                result['p99_us'], base['p99_us']))
+        if reasons:
+            regressions.append((result, base, reasons))
+    return regressions
+
+
+def format_result(result):
+    """
+    Format `result` of :func:`measure` as a line of a table.
+    """
+    return ('{server:24} {payload:8} {size:>7} {concurrency:>3}'
+            '  {throughput:10.1f}/s  p50 {p50_us:9.1f}us'
+            '  p99 {p99_us:9.1f}us').format(**result)
+
+
+def main(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__)
+    parser.add_argument(
+        '--servers', nargs='+', choices=sorted(SERVERS),
+        help='server classes to benchmark.  '
+        'Default is all classes available on this platform.')
+    parser.add_argument(
+        '--payloads', nargs='+', choices=PAYLOADS, default=list(PAYLOADS))
+    parser.add_argument(
+        '--sizes', nargs='+', type=int, default=[10, 1000, 100000])
+    parser.add_argument(
+        '--concurrency', nargs='+', type=int, default=[1, 4])
+    parser.add_argument(
+        '--duration', type=float, default=1.0,
+        help='seconds to run each benchmark')
+    parser.add_argument(
+        '--json', metavar='PATH',
+        help='save results as JSON in PATH.  "-" means stdout.')
+    parser.add_argument(
+        '--baseline', metavar='PATH',
+        help='compare results with the JSON saved by --json')
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='allowed regression from the baseline as a fraction')
+    ns = parser.parse_args(args)
+
+    out = sys.stderr if ns.json == '-' else sys.stdout
+    results = run(ns.servers, ns.payloads, ns.sizes, ns.concurrency,
+                  ns.duration,
+                  callback=lambda r: out.write(format_result(r) + '\n'))
+    if ns.json:
+        data = dict(python=sys.version.split()[0], results=results)
+        if ns.json == '-':
+            json.dump(data, sys.stdout, indent=1, sort_keys=True)
+        else:
+            with open(ns.json, 'w') as file:
+                json.dump(data, file, indent=1, sort_keys=True)
+    if ns.baseline:
+        with open(ns.baseline) as file:
+            baseline = json.load(file)['results']
+        regressions = compare(results, baseline, ns.threshold)
+        for (result, _, reasons) in regressions:
+            out.write('REGRESSION {0}: {1}\n'.format(
+                ' '.join(map(str, result_key(result))), ', '.join(reasons)))
+        if regressions:
+            sys.exit(1)
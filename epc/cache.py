@@ -0,0 +1,335 @@
+# Copyright (C) 2012-  Takafumi Arakaki
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Result caches for registered functions.
+
+A cache is given to :meth:`register_function
+<epc.core.EPCDispatcher.register_function>` by the `cache` option::
+
+    @server.register_function(cache=LRU(maxsize=1024, ttl=60))
+    def lookup(symbol):
+        ...
+
+Results are stored as encoded S-expressions
+(:class:`epc.codec.EncodedSexp`), so that a hit is sent without
+encoding the result again.  Entries are keyed by the function name and
+the encoded arguments.
+
+:class:`LRU` lives in memory.  :class:`PersistentCache` stores results
+in a SQLite database, so that they survive restarts of the server.
+
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .codec import EncodedSexp
+
+_clock = getattr(time, 'monotonic', time.time)
+_wallclock = time.time
+
+
+class LRU(object):
+
+    """
+    In-memory cache evicting the least recently used entries.
+
+    :type  maxsize: int or None
+    :arg   maxsize: Maximum number of entries.  None means no limit.
+    :type      ttl: float or None
+    :arg       ttl: Seconds an entry is valid for.  None means forever.
+
+    >>> cache = LRU(maxsize=2)
+    >>> cache.set('f', b'(1)', b'1')
+    >>> cache.set('f', b'(2)', b'4')
+    >>> cache.get('f', b'(1)') == b'1'
+    True
+    >>> cache.set('f', b'(3)', b'9')  # evicts (2)
+    >>> cache.get('f', b'(2)') is None
+    True
+    >>> sorted(cache.stats().items())         #doctest: +NORMALIZE_WHITESPACE
+    [('evictions', 1), ('expired', 0), ('hits', 1), ('maxsize', 2),
+     ('misses', 1), ('size', 2)]
+
+    An instance can be shared by several functions.
+
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = dict(hits=0, misses=0, evictions=0, expired=0)
+
+    def get(self, name, key):
+        """
+        Return the value for `key` of function `name` or None.
+        """
+        with self._lock:
+            try:
+                (value, expires) = self._data.pop((name, key))
+            except KeyError:
+                self._counters['misses'] += 1
+                return None
+            if expires is not None and expires <= _clock():
+                self._counters['expired'] += 1
+                self._counters['misses'] += 1
+                return None
+            self._data[(name, key)] = (value, expires)  # most recent
+            self._counters['hits'] += 1
+            return value
+
+    def set(self, name, key, value):
+        """
+        Store `value` for `key` of function `name`.
+        """
+        expires = None if self.ttl is None else _clock() + self.ttl
+        with self._lock:
+            self._data.pop((name, key), None)
+            self._data[(name, key)] = (value, expires)
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self._counters['evictions'] += 1
+
+    def invalidate(self, name=None, key=None):
+        """
+        Remove entries and return the number of removed entries.
+
+        All entries of function `name` are removed if `key` is None.
+        All entries are removed if `name` is None too.
+
+        """
+        with self._lock:
+            if name is None:
+                removed = len(self._data)
+                self._data.clear()
+            elif key is not None:
+                removed = int(self._data.pop((name, key), None) is not None)
+            else:
+                keys = [k for k in self._data if k[0] == name]
+                for k in keys:
+                    del self._data[k]
+                removed = len(keys)
+        return removed
+
+    def stats(self):
+        """
+        Return a dictionary of cache statistics.
+
+        ``hits`` and ``misses`` count lookups; an ``expired`` entry is
+        counted as a miss too.  ``evictions`` counts entries removed
+        to keep ``size`` under ``maxsize``.
+
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update(size=len(self._data), maxsize=self.maxsize)
+        return stats
+
+
+class PersistentCache(object):
+
+    """
+    Cache stored in a SQLite database file.
+
+    :type     path: str
+    :arg      path: Path to the database file.  It is created if it
+                    does not exist.
+    :type  version: str or None
+    :arg   version: Version of the cached functions.  Entries stored
+                    with a different version are removed when the
+                    cache is opened, so bump it when results change.
+    :type  maxsize: int or None
+    :arg   maxsize: Maximum number of entries.  The least recently
+                    used entries are evicted.  None means no limit.
+    :type      ttl: float or None
+    :arg       ttl: Seconds an entry is valid for.  None means forever.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'cache.sqlite')
+    >>> cache = PersistentCache(path, version='1')
+    >>> cache.set('f', b'(1)', b'1')
+    >>> cache.close()
+    >>> PersistentCache(path, version='1').get('f', b'(1)') == b'1'
+    True
+    >>> PersistentCache(path, version='2').get('f', b'(1)') is None
+    True
+
+    The database may be shared by several processes, e.g., workers of
+    :class:`epc.server.PreforkEPCServer`.  A forked process opens its
+    own connection on the first use.
+
+    """
+
+    evict_batch = 0.1
+    """
+    Fraction of `maxsize` evicted at once when the cache is full, so
+    that the entries are not counted again on every :meth:`set`.
+    """
+
+    def __init__(self, path, version=None, maxsize=10000, ttl=None):
+        self.path = path
+        self.version = '' if version is None else str(version)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+        self._size = None  # estimated number of entries; see `_evict`
+        self._counters = dict(hits=0, misses=0, evictions=0, expired=0)
+        with self._lock:
+            db = self._connect()
+            db.execute('DELETE FROM entries WHERE version != ?',
+                       (self.version,))
+
+    def _connect(self):
+        if self._db is not None and self._pid == os.getpid():
+            return self._db
+        import sqlite3
+        db = sqlite3.connect(self.path, timeout=5, isolation_level=None,
+                             check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            ' name TEXT, key BLOB, version TEXT, value BLOB,'
+            ' atime REAL, expires REAL,'
+            ' PRIMARY KEY (name, key, version))')
+        db.execute(
+            'CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime)')
+        self._db = db
+        self._pid = os.getpid()
+        self._size = None
+        return db
+
+    def get(self, name, key):
+        """
+        Return the value for `key` of function `name` or None.
+        """
+        now = _wallclock()
+        where = (name, _blob(key), self.version)
+        with self._lock:
+            db = self._connect()
+            row = db.execute(
+                'SELECT value, expires FROM entries'
+                ' WHERE name = ? AND key = ? AND version = ?',
+                where).fetchone()
+            if row is None:
+                self._counters['misses'] += 1
+                return None
+            (value, expires) = row
+            if expires is not None and expires <= now:
+                db.execute('DELETE FROM entries'
+                           ' WHERE name = ? AND key = ? AND version = ?',
+                           where)
+                self._counters['expired'] += 1
+                self._counters['misses'] += 1
+                return None
+            db.execute('UPDATE entries SET atime = ?'
+                       ' WHERE name = ? AND key = ? AND version = ?',
+                       (now,) + where)
+            self._counters['hits'] += 1
+        return EncodedSexp(value)
+
+    def set(self, name, key, value):
+        """
+        Store `value` for `key` of function `name`.
+        """
+        now = _wallclock()
+        expires = None if self.ttl is None else now + self.ttl
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                'INSERT OR REPLACE INTO entries'
+                ' (name, key, version, value, atime, expires)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (name, _blob(key), self.version, _blob(value), now, expires))
+            if self.maxsize is not None:
+                self._evict(db)
+
+    def _evict(self, db):
+        # Counting the entries scans the table, so it is done only
+        # when the estimate says the cache may be full.  Every `set`
+        # is counted as a new entry, which over-estimates replaced
+        # ones; entries set by other processes are found when this
+        # process counts next time.
+        if self._size is not None:
+            self._size += 1
+            if self._size <= self.maxsize:
+                return
+        (size,) = db.execute('SELECT COUNT(*) FROM entries').fetchone()
+        excess = size - self.maxsize
+        if excess > 0:
+            excess += int(self.maxsize * self.evict_batch)
+            evicted = db.execute(
+                'DELETE FROM entries WHERE rowid IN'
+                ' (SELECT rowid FROM entries ORDER BY atime LIMIT ?)',
+                (excess,)).rowcount
+            self._counters['evictions'] += evicted
+            size -= evicted
+        self._size = size
+
+    def invalidate(self, name=None, key=None):
+        """
+        Remove entries and return the number of removed entries.
+
+        All entries of function `name` are removed if `key` is None.
+        All entries are removed if `name` is None too.
+
+        """
+        if name is None:
+            (sql, params) = ('', ())
+        elif key is None:
+            (sql, params) = (' WHERE name = ?', (name,))
+        else:
+            (sql, params) = (' WHERE name = ? AND key = ?',
+                             (name, _blob(key)))
+        with self._lock:
+            return self._connect().execute(
+                'DELETE FROM entries' + sql, params).rowcount
+
+    def stats(self):
+        """
+        Return a dictionary of cache statistics.
+
+        The keys are the same as :meth:`LRU.stats`.  Counters are for
+        this process only, while ``size`` is of the database.
+
+        """
+        with self._lock:
+            (size,) = self._connect().execute(
+                'SELECT COUNT(*) FROM entries').fetchone()
+            stats = dict(self._counters)
+        stats.update(size=size, maxsize=self.maxsize)
+        return stats
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        with self._lock:
+            if self._db is not None and self._pid == os.getpid():
+                self._db.close()
+            self._db = None
+
+
+def _blob(data):
+    # sqlite3 stores `bytes` (`buffer` in Python 2) as BLOB.
+    return memoryview(data).tobytes() if bytes is not str else buffer(data)
@@ -14,8 +14,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from .py3compat import Queue
-from .utils import ThreadedIterator, newthread
+from .py3compat import Queue, string_types
+from .utils import ThreadedIterator, ThreadPool, newthread
 from .core import EPCCore
 from .handler import ThreadingEPCHandler
 
@@ -85,12 +85,36 @@ class EPCClient(EPCCore):
 
        Alias of :meth:`epc.server.EPCHandler.methods_sync`.
 
+    .. method:: call_many
+
+       Alias of :meth:`epc.server.EPCHandler.call_many`.
+
+    .. method:: cancel
+
+       Alias of :meth:`epc.server.EPCHandler.cancel`.
+
+    .. method:: call_future
+
+       Alias of :meth:`epc.server.EPCHandler.call_future`.
+
+    .. method:: methods_future
+
+       Alias of :meth:`epc.server.EPCHandler.methods_future`.
+
+    Requests from the server are executed by a pool of worker
+    threads.  See :class:`epc.server.ThreadingEPCServer` for the
+    meaning of `max_workers`, `max_queue` and `min_workers`.
+
     """
 
     thread_daemon = True
 
     def __init__(self, socket_or_address=None,
-                 debugger=None, log_traceback=False):
+                 debugger=None, log_traceback=False,
+                 max_workers=64, max_queue=0, min_workers=0):
+        self.worker_pool = ThreadPool(max_workers=max_workers,
+                                      max_queue=max_queue,
+                                      min_workers=min_workers)
         if socket_or_address is not None:
             self.connect(socket_or_address)
         EPCCore.__init__(self, debugger, log_traceback)
@@ -99,15 +123,21 @@ class EPCClient(EPCCore):
         """
         Connect to server and start serving registered functions.
 
-        :type socket_or_address: tuple or socket object
+        :type socket_or_address: tuple, str or socket object
         :arg  socket_or_address: A ``(host, port)`` pair to be passed
-                                 to `socket.create_connection`, or
+                                 to `socket.create_connection`, a path
+                                 to a Unix domain socket (see
+                                 :class:`epc.server.UnixEPCServer`), or
                                  a socket object.
 
         """
         if isinstance(socket_or_address, tuple):
             import socket
             self.socket = socket.create_connection(socket_or_address)
+        elif isinstance(socket_or_address, string_types):
+            import socket
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(socket_or_address)
         else:
             self.socket = socket_or_address
 
@@ -119,6 +149,10 @@ class EPCClient(EPCCore):
         self.call_sync = self.handler.call_sync
         self.methods = self.handler.methods
         self.methods_sync = self.handler.methods_sync
+        self.call_many = self.handler.call_many
+        self.cancel = self.handler.cancel
+        self.call_future = self.handler.call_future
+        self.methods_future = self.handler.methods_future
 
         self.handler_thread = newthread(self, target=self.handler.start)
         self.handler_thread.daemon = self.thread_daemon
@@ -132,6 +166,8 @@ class EPCClient(EPCCore):
         except AttributeError:
             # Do not fail to close even if the client is never used.
             pass
+        self.worker_pool.shutdown()
+        self.shutdown_executors()
 
     def _ignore(*_):
         """"Do nothing method for `EPCHandler`."""
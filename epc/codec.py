@@ -0,0 +1,455 @@
+# Copyright (C) 2012-  Takafumi Arakaki
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+S-expression codec working directly on UTF-8 bytes.
+
+The result is the same as :func:`sexpdata.loads` on the decoded
+string, but the input can be given chunk by chunk as it is read from
+the socket.
+
+"""
+
+import re
+import codecs
+
+import sexpdata
+from sexpdata import Symbol, String, Quoted, \
+    ExpectClosingBracket, ExpectNothing, ExpectSExp
+
+_WS = br' \t\n\r\x0b\x0c'
+_TOKEN_RE = re.compile(br'''
+    [''' + _WS + br''']*
+    (?:
+      (?P<open>[(\[])
+    | (?P<close>[)\]])
+    | (?P<int>[-+]?[0-9]+)(?![^''' + _WS + br'''()\[\]";])
+    | (?P<string>"[^"\\]*")
+    | (?P<strbegin>")
+    | (?P<quote>')
+    | (?P<comment>;)
+    | (?P<atom>
+        (?:[^''' + _WS + br'''()\[\]";'\\]|\\.|\\\Z)
+        (?:[^''' + _WS + br'''()\[\]";\\]|\\.|\\\Z)*)
+    )''', re.VERBOSE | re.DOTALL)
+_STRING_SPECIAL_RE = re.compile(br'["\\]')
+_NEWLINE_RE = re.compile(br'\n')
+_ATOM_ESCAPE_RE = re.compile(r'\\(.)', re.DOTALL)
+
+_CLOSER = {b'(': b')', b'[': b']'}
+_STRING_ESCAPES = dict(
+    (c.encode(), String.unquote('\\' + c))
+    for c in '\\"bfnrt' if String.unquote('\\' + c) != '\\' + c)
+
+
+def _unquote_symbol(match):
+    return Symbol.unquote(match.group(0))
+
+
+def _atom(token):
+    if '\\' in token:
+        token = _ATOM_ESCAPE_RE.sub(_unquote_symbol, token)
+    if token == 'nil':
+        return []
+    if token == 't':
+        return True
+    try:
+        return int(token)
+    except ValueError:
+        try:
+            return float(token)
+        except ValueError:
+            return Symbol(token)
+
+
+class IncrementalDecoder(object):
+
+    """
+    Decode one s-expression from UTF-8 encoded chunks.
+
+    Chunks given to :meth:`feed` are parsed immediately, so that no
+    copy of the whole input is kept.  Chunks can be any bytes-like
+    object, including a :class:`memoryview` of a buffer which is
+    reused after :meth:`feed` returns.
+
+    >>> decoder = IncrementalDecoder()
+    >>> decoder.feed(b'(return 1 ("ab')
+    >>> decoder.feed(b'c" 2.5 nil))')
+    >>> decoder.close() == [Symbol('return'), 1, ['abc', 2.5, []]]
+    True
+
+    Parse errors are raised by :meth:`close`, after the whole input
+    is consumed.
+
+    """
+
+    def __init__(self):
+        self._stack = [[]]
+        self._openers = [None]
+        self._quotes = [0]
+        self._carry = None
+        self._string = None
+        self._utf8 = None
+        self._escape = False
+        self._comment = False
+        self._error = None
+        self.nbytes = 0
+        """Number of bytes fed so far."""
+
+    def feed(self, data):
+        """
+        Parse a chunk of bytes.
+        """
+        self.nbytes += len(data)
+        if self._error is None:
+            try:
+                self._feed(data, False)
+            except Exception as err:
+                self._error = err
+
+    def close(self):
+        """
+        Finish parsing and return the decoded object.
+        """
+        if self._error is None:
+            try:
+                self._feed(b'', True)
+                if self._string is not None:
+                    raise ExpectClosingBracket(None, '"')
+                if len(self._stack) > 1:
+                    raise ExpectClosingBracket(
+                        None, _CLOSER[self._openers[-1]].decode())
+                if self._quotes[0]:
+                    raise ExpectSExp(self.nbytes)
+                top = self._stack[0]
+                if len(top) != 1:
+                    raise ValueError(
+                        'Expected one s-expression; got {0}'.format(len(top)))
+                return top[0]
+            except Exception as err:
+                self._error = err
+        raise self._error
+
+    def _push(self, value):
+        quotes = self._quotes[-1]
+        if quotes:
+            for _ in range(quotes):
+                value = Quoted(value)
+            self._quotes[-1] = 0
+        self._stack[-1].append(value)
+
+    def _feed(self, data, final):
+        if self._carry is not None:
+            data = self._carry + bytes(data)
+            self._carry = None
+        pos = 0
+        end = len(data)
+        match_token = _TOKEN_RE.match
+        while pos < end:
+            if self._string is not None:
+                pos = self._feed_string(data, pos, end)
+                continue
+            if self._comment:
+                m = _NEWLINE_RE.search(data, pos)
+                if m is None:
+                    break
+                self._comment = False
+                pos = m.end()
+                continue
+            m = match_token(data, pos)
+            if m is None:
+                break  # only whitespace is left
+            kind = m.lastgroup
+            pos = m.end()
+            if kind == 'int' or kind == 'atom':
+                if pos == end and not final:
+                    self._carry = m.group(kind)
+                    break
+                if kind == 'int':
+                    self._push(int(m.group(kind)))
+                else:
+                    self._push(_atom(m.group(kind).decode('utf-8')))
+            elif kind == 'string':
+                self._push(m.group(kind)[1:-1].decode('utf-8'))
+            elif kind == 'open':
+                self._stack.append([])
+                self._openers.append(bytes(data[pos - 1:pos]))
+                self._quotes.append(0)
+            elif kind == 'close':
+                self._close_bracket(data, pos)
+            elif kind == 'strbegin':
+                self._string = []
+                self._utf8 = codecs.getincrementaldecoder('utf-8')()
+            elif kind == 'quote':
+                self._quotes[-1] += 1
+            else:  # comment
+                self._comment = True
+
+    def _close_bracket(self, data, pos):
+        got = bytes(data[pos - 1:pos])
+        if len(self._stack) == 1:
+            raise ExpectNothing(bytes(data[pos - 1:]).decode('utf-8'))
+        if self._quotes[-1]:
+            raise ExpectSExp(self.nbytes)
+        opener = self._openers.pop()
+        self._quotes.pop()
+        value = self._stack.pop()
+        closer = _CLOSER[opener]
+        if got != closer:
+            raise ExpectClosingBracket(got.decode(), closer.decode())
+        if opener != b'(':
+            value = sexpdata.bracket(value, opener.decode())
+        self._push(value)
+
+    def _feed_string(self, data, pos, end):
+        parts = self._string
+        decode = self._utf8.decode
+        if self._escape:
+            self._escape = False
+            pos = self._unescape(parts, data, pos)
+        search = _STRING_SPECIAL_RE.search
+        while True:
+            m = search(data, pos)
+            if m is None:
+                parts.append(decode(data[pos:end]))
+                return end
+            start = m.start()
+            if start > pos:
+                parts.append(decode(data[pos:start]))
+            if m.group() == b'"':
+                parts.append(decode(b'', True))
+                self._string = self._utf8 = None
+                self._push(''.join(parts))
+                return start + 1
+            if start + 1 == end:
+                self._escape = True
+                return end
+            pos = self._unescape(parts, data, start + 1)
+
+    @staticmethod
+    def _unescape(parts, data, pos):
+        # `pos` points to the character next to a backslash.
+        char = _STRING_ESCAPES.get(bytes(data[pos:pos + 1]))
+        if char is None:
+            parts.append('\\')
+            return pos
+        parts.append(char)
+        return pos + 1
+
+
+def encode_frame(obj):
+    """
+    Encode `obj` as an EPC frame (length header, s-expression, newline).
+
+    The result is the same as ``encode_string(sexpdata.dumps(obj))``,
+    but common types (int, float, bool, None, str, bytes, list, tuple,
+    dict, :class:`sexpdata.Symbol` and :class:`sexpdata.String`) are
+    written as UTF-8 directly into one :class:`bytearray`, and the
+    6-digit length header is filled in at the end.  Other objects are
+    serialized by :func:`sexpdata.dumps`.  Bytes are written as a
+    UTF-8 string.
+
+    >>> (encode_frame([Symbol('return'), 1, ['a', 2.5, None]]) ==
+    ...  b'000018(return 1 ("a" 2.5 ()))\\n')
+    True
+
+    """
+    buf = bytearray(b'000000')
+    _encode(buf, obj)
+    buf += b'\n'
+    buf[:6] = '{0:06x}'.format(len(buf) - 6).encode()
+    return buf
+
+
+class EncodedSexp(bytes):
+
+    """
+    UTF-8 encoded S-expression written as-is by :func:`encode_frame`.
+
+    Use it to send a value encoded beforehand (e.g., cached) without
+    encoding it again.
+
+    >>> (encode_frame([Symbol('return'), 1, EncodedSexp(b'(1 2)')]) ==
+    ...  b'000011(return 1 (1 2))\\n')
+    True
+
+    """
+
+
+def encode_sexp(obj):
+    """
+    Encode `obj` as UTF-8 S-expression without the frame header.
+
+    >>> encode_sexp([1, 'a']) == EncodedSexp(b'(1 "a")')
+    True
+
+    """
+    buf = bytearray()
+    _encode(buf, obj)
+    return EncodedSexp(buf)
+
+
+class _ScatterBuffer(bytearray):
+
+    # A frame buffer which does not copy large strings.  They are
+    # recorded in `inserts` as ``(offset, data)`` pairs instead.
+
+    threshold = 1 << 16
+
+
+def encode_frame_buffers(obj, threshold=1 << 16):
+    """
+    Like :func:`encode_frame`, but return a list of buffers.
+
+    UTF-8 data of strings which are at least `threshold` bytes long
+    are not copied into the frame buffer but returned as separate
+    buffers, so that the frame can be written with a vectored write
+    such as `socket.sendmsg`.
+
+    >>> buffers = encode_frame_buffers(['x' * 8, 'y'], threshold=8)
+    >>> [bytes(b) for b in buffers] == [b'000011("', b'xxxxxxxx', b'" "y")\\n']
+    True
+
+    """
+    buf = _ScatterBuffer(b'000000')
+    buf.threshold = threshold
+    buf.inserts = inserts = []
+    _encode(buf, obj)
+    buf += b'\n'
+    length = len(buf) - 6 + sum(len(data) for (_, data) in inserts)
+    buf[:6] = '{0:06x}'.format(length).encode()
+    if not inserts:
+        return [buf]
+    view = memoryview(buf)
+    buffers = []
+    start = 0
+    for (offset, data) in inserts:
+        buffers.append(view[start:offset])
+        buffers.append(data)
+        start = offset
+    buffers.append(view[start:])
+    return buffers
+
+
+def _encode(buf, obj):
+    encoder = _ENCODERS.get(type(obj))
+    if encoder is None:
+        buf += sexpdata.dumps(obj).encode('utf-8')
+    else:
+        encoder(buf, obj)
+
+
+def _encode_int(buf, obj):
+    buf += str(obj).encode()
+
+
+def _encode_float(buf, obj):
+    buf += repr(obj).encode()
+
+
+def _encode_bool(buf, obj):
+    buf += b't' if obj else b'()'
+
+
+def _encode_none(buf, obj):
+    buf += b'()'
+
+
+_STRING_QUOTE_RE = re.compile('[\\\\"\b\f\n\r\t]')
+_SYMBOL_QUOTE_RE = re.compile('[\\\\\'`"()\\[\\] ,?;#]')
+
+
+def _encode_str(buf, obj):
+    if _STRING_QUOTE_RE.search(obj):
+        obj = String.quote(obj)
+    _encode_str_data(buf, obj.encode('utf-8'))
+
+
+def _encode_str_data(buf, data):
+    buf += b'"'
+    if type(buf) is _ScatterBuffer and len(data) >= buf.threshold:
+        buf.inserts.append((len(buf), data))
+    else:
+        buf += data
+    buf += b'"'
+
+
+def _encode_bytes(buf, obj):
+    text = obj.decode('utf-8')
+    if _STRING_QUOTE_RE.search(text):
+        _encode_str(buf, text)
+    else:
+        _encode_str_data(buf, obj)
+
+
+def _encode_encoded(buf, obj):
+    buf += obj
+
+
+def _encode_symbol(buf, obj):
+    if _SYMBOL_QUOTE_RE.search(obj):
+        obj = Symbol.quote(obj)
+    buf += obj.encode('utf-8')
+
+
+def _encode_list(buf, obj):
+    if not obj:
+        buf += b'()'
+        return
+    buf += b'('
+    encoders = _ENCODERS
+    for item in obj:
+        encoder = encoders.get(type(item))
+        if encoder is None:
+            buf += sexpdata.dumps(item).encode('utf-8')
+        else:
+            encoder(buf, item)
+        buf += b' '
+    buf[-1] = 0x29  # replace the last space with ")"
+
+
+def _encode_dict(buf, obj):
+    if not obj:
+        buf += b'()'
+        return
+    for key in obj:
+        if type(key) is not _text_type:
+            buf += sexpdata.dumps(obj).encode('utf-8')
+            return
+    buf += b'('
+    for (key, value) in obj.items():
+        _encode_symbol(buf, ':' + key)
+        buf += b' '
+        _encode(buf, value)
+        buf += b' '
+    buf[-1] = 0x29
+
+
+_text_type = type(u'')
+_ENCODERS = {
+    int: _encode_int,
+    float: _encode_float,
+    bool: _encode_bool,
+    type(None): _encode_none,
+    _text_type: _encode_str,
+    String: _encode_str,
+    Symbol: _encode_symbol,
+    list: _encode_list,
+    tuple: _encode_list,
+    dict: _encode_dict,
+    EncodedSexp: _encode_encoded,
+}
+if bytes is not str:
+    _ENCODERS[bytes] = _encode_bytes
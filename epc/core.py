@@ -14,8 +14,15 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import inspect
 import logging
-from .py3compat import SimpleXMLRPCServer
+import threading
+from .py3compat import SimpleXMLRPCServer, futures, require_futures
+from .utils import MicroBatcher, freeze
+from .codec import encode_sexp
+from .metrics import Metrics
+from .hooks import Hooks
+from sexpdata import Symbol, String
 
 _logger = logging.getLogger(__name__)
 
@@ -27,9 +34,20 @@ class EPCDispatcher:
 
     # see also: SimpleXMLRPCServer.SimpleXMLRPCDispatcher
 
+    function_options = frozenset(
+        ['executor', 'batch', 'max_batch', 'max_wait_ms', 'single_flight',
+         'cache'])
+    """
+    Names of keyword arguments accepted by :meth:`register_function`.
+    """
+
     def __init__(self):
         self.funcs = {}
+        self.func_options = {}
         self.instance = None
+        self._batchers = {}
+        self._methods = {}
+        self._methods_info = None
 
     def register_instance(self, instance, allow_dotted_names=False):
         """
@@ -47,14 +65,22 @@ class EPCDispatcher:
             They are resolved using `getattr` for each part of the
             name as long as it does not start with '_'.
 
+        Public methods of the instance are listed in the reply to a
+        ``methods`` request.  The instance can define `_listMethods`
+        method returning a list of names to list other methods.
+
         Unlike :meth:`register_function`, only one instance can
         be registered.
 
+        Methods resolved from the instance are cached.  Call
+        :meth:`invalidate_methods` when its attributes are changed.
+
         """
         self.instance = instance
         self.allow_dotted_names = allow_dotted_names
+        self.invalidate_methods()
 
-    def register_function(self, function, name=None):
+    def register_function(self, function=None, name=None, **options):
         """
         Register function to be called from EPC client.
 
@@ -62,28 +88,176 @@ class EPCDispatcher:
         :arg   function: Function to publish.
         :type      name: str
         :arg       name: Name by which function is published.
+        :type  executor: 'process' or :class:`concurrent.futures.Executor`
+        :arg   executor: Run the function in this executor instead of
+                         the thread handling the connection, so that
+                         other requests are handled meanwhile.
+                         'process' means a process pool shared by the
+                         functions of this object (see
+                         :attr:`EPCCore.process_workers`).  The
+                         function, its arguments and its result must
+                         be picklable to run in a process.
+        :type     batch: bool
+        :arg      batch: If true, calls arriving at around the same
+                         time are run at once by calling the function
+                         with a list of argument tuples.  It must
+                         return a list of results in the same order.
+                         Each caller still gets its own reply.  See
+                         :class:`epc.utils.MicroBatcher`.
+        :type max_batch: int
+        :arg  max_batch: Maximum number of calls in a batch.
+                         Default is 100.
+        :type max_wait_ms: float
+        :arg  max_wait_ms: Milliseconds to wait for more calls after
+                           the first one of a batch.  Default is 1.
+        :type single_flight: bool
+        :arg  single_flight: If true, a call with the same arguments
+                             as a running call waits for and replies
+                             the result of the running one instead of
+                             calling the function again.  Calls must
+                             run concurrently (e.g., a threading
+                             server or the `executor` option) to be
+                             merged.
+        :type     cache: :class:`epc.cache.LRU`,
+                         :class:`epc.cache.PersistentCache` or
+                         compatible object
+        :arg      cache: Store results in this cache and reply cached
+                         results to calls with the same arguments.
+                         See also :meth:`EPCCore.invalidate`.
+
+        The function may return a :class:`concurrent.futures.Future`
+        to send the reply when the future is done.
 
         This method returns the given `function` as-is, so that you
-        can use it as a decorator.
+        can use it as a decorator.  If `function` is omitted, it
+        returns a decorator taking the other arguments into account::
+
+            @server.register_function(executor='process')
+            def parse(source):
+                ...
 
         """
+        if function is None:
+            return lambda function: self.register_function(
+                function, name, **options)
+        unknown = set(options) - self.function_options
+        if unknown:
+            raise TypeError('Unknown options: {0}'.format(
+                ', '.join(sorted(unknown))))
+        if options.get('executor') == 'process':
+            require_futures("executor='process'")
+        if options.get('single_flight'):
+            require_futures('single_flight')
         if name is None:
             name = function.__name__
         self.funcs[name] = function
+        self.func_options[name] = options
+        batcher = self._batchers.pop(name, None)
+        if batcher is not None:
+            batcher.close()
+        self.invalidate_methods()
         return function
 
     def get_method(self, name):
         """
         Get registered method callend `name`.
+
+        :raise AttributeError: when there is no such method.
+
         """
+        method = self.funcs.get(name)
+        if method is None:
+            method = self._methods.get(name)
+        if method is None:
+            method = self._methods[name] = self._resolve_method(name)
+        return method
+
+    def _resolve_method(self, name):
         try:
-            return self.funcs[name]
-        except KeyError:
-            try:
-                return self.instance._get_method(name)
-            except AttributeError:
-                return SimpleXMLRPCServer.resolve_dotted_attribute(
-                    self.instance, name, self.allow_dotted_names)
+            return self.instance._get_method(name)
+        except AttributeError:
+            return SimpleXMLRPCServer.resolve_dotted_attribute(
+                self.instance, name, self.allow_dotted_names)
+
+    def invalidate_methods(self):
+        """
+        Forget methods resolved from the registered instance.
+
+        They are resolved again when they are called next time.  The
+        cached reply of :meth:`get_methods_info` is discarded too.
+
+        """
+        self._methods = {}
+        self._methods_info = None
+
+    def list_methods(self):
+        """
+        Return a list of names of callable methods.
+
+        Functions registered by :meth:`register_function` come first.
+
+        """
+        names = list(self.funcs)
+        instance = self.instance
+        if instance is None:
+            return names
+        if hasattr(instance, '_listMethods'):
+            extra = instance._listMethods()
+        elif hasattr(instance, '_get_method'):
+            extra = []  # not enough information to list methods
+        else:
+            extra = SimpleXMLRPCServer.list_public_methods(instance)
+        return names + sorted(set(extra) - set(names))
+
+    def get_methods_info(self):
+        """
+        Return the result of ``methods`` request as encoded S-expression.
+
+        It is a list of ``(name arg-specs docstring)`` for each
+        method in :meth:`list_methods`.  The arg-specs is a string
+        such as ``"(a, b=1, *args)"``, or nil if unknown.  The result
+        is computed once and reused until :meth:`invalidate_methods`
+        is called (e.g., by :meth:`register_function`).
+
+        """
+        info = self._methods_info
+        if info is None:
+            info = []
+            for name in self.list_methods():
+                try:
+                    func = self.get_method(name)
+                except AttributeError:
+                    continue
+                info.append((Symbol(name), _arg_spec(func),
+                             String(func.__doc__ or "")))
+            info = self._methods_info = encode_sexp(info)
+        return info
+
+
+def _arg_spec(func):
+    try:
+        if hasattr(inspect, 'signature'):
+            return str(inspect.signature(func))
+        return inspect.formatargspec(*inspect.getargspec(func))
+    except (TypeError, ValueError):
+        return []
+
+
+def _copy_future(source, target):
+    if target.done():
+        return
+    if source.cancelled():
+        target.set_exception(futures.CancelledError())
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def _chain_future(source):
+    future = futures.Future()
+    source.add_done_callback(lambda source: _copy_future(source, future))
+    return future
 
 
 class EPCCore(EPCDispatcher):
@@ -94,10 +268,202 @@ class EPCCore(EPCDispatcher):
 
     logger = _logger
 
+    worker_pool = None
+    """
+    :class:`epc.utils.ThreadPool` used by :class:`ThreadingEPCHandler`
+    to run requests.  None means to start a thread for each request.
+    """
+
+    process_workers = None
+    """
+    Number of processes for functions registered with
+    ``executor='process'``.  None means the number of CPUs.
+    """
+
+    collect_metrics = True
+    """
+    Record per-method metrics in :attr:`metrics`.
+    """
+
+    stats_method = 'epc-stats'
+    """
+    Reserved method name returning :meth:`Metrics.snapshot
+    <epc.metrics.Metrics.snapshot>` of :attr:`metrics`.
+    """
+
     def __init__(self, debugger, log_traceback):
         EPCDispatcher.__init__(self)
         self.set_debugger(debugger)
         self.log_traceback = log_traceback
+        self.metrics = Metrics() if self.collect_metrics else None
+        """
+        :class:`epc.metrics.Metrics` of the called functions, or None
+        if :attr:`collect_metrics` is false.
+        """
+        self.hooks = Hooks()
+        """
+        :class:`epc.hooks.Hooks` called by the handlers of this object.
+        """
+        self._process_pool = None
+        self._process_pool_lock = threading.Lock()
+        self._batchers_lock = threading.Lock()
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    def get_executor(self, executor):
+        """
+        Resolve `executor` option of :meth:`register_function`.
+
+        The process pool for 'process' is started on the first use.
+
+        """
+        if executor != 'process':
+            return executor
+        with self._process_pool_lock:
+            if self._process_pool is None:
+                self._process_pool = futures.ProcessPoolExecutor(
+                    self.process_workers)
+            return self._process_pool
+
+    def call_function(self, name, function, args):
+        """
+        Call `function` registered as `name` with `args`.
+
+        Options given to :meth:`register_function` are applied.
+        Return the result, or a :class:`concurrent.futures.Future` of
+        it if the function is not run in the current thread.
+
+        """
+        options = self.func_options.get(name)
+        if not options:
+            return function(*args)
+        cache = options.get('cache')
+        if cache is None:
+            return self._call_uncached(name, function, args, options)
+        key = encode_sexp(args)
+        value = cache.get(name, key)
+        if value is not None:
+            return value
+        result = self._call_uncached(name, function, args, options)
+        if futures is not None and isinstance(result, futures.Future):
+            result.add_done_callback(
+                lambda result: self._cache_future(cache, name, key, result))
+            return result
+        return self._cache_result(cache, name, key, result)
+
+    def _call_uncached(self, name, function, args, options):
+        if options.get('single_flight'):
+            return self._call_single_flight(name, function, args, options)
+        return self._call_with_options(name, function, args, options)
+
+    def _cache_result(self, cache, name, key, result):
+        try:
+            value = encode_sexp(result)
+        except Exception:
+            # Let the handler report the error.
+            return result
+        cache.set(name, key, value)
+        return value
+
+    def _cache_future(self, cache, name, key, future):
+        if not future.cancelled() and future.exception() is None:
+            self._cache_result(cache, name, key, future.result())
+
+    def invalidate(self, name, args=None):
+        """
+        Remove cached results of function `name`.
+
+        :type name: str
+        :arg  name: Name of a function registered with `cache` option.
+        :type args: list or None
+        :arg  args: Remove only the result for these arguments.
+                    None means all results of the function.
+        :rtype: int
+        :return: Number of removed results.
+
+        This method can be published so that the peer can invalidate
+        caches::
+
+            server.register_function(server.invalidate)
+
+        """
+        if isinstance(name, Symbol):
+            name = name.value()
+        cache = (self.func_options.get(name) or {}).get('cache')
+        if cache is None:
+            return 0
+        key = None if args is None else encode_sexp(list(args))
+        return cache.invalidate(name, key)
+
+    def _call_with_options(self, name, function, args, options):
+        if options.get('batch'):
+            return self._get_batcher(name, function, options).submit(args)
+        executor = self.get_executor(options.get('executor'))
+        if executor is not None:
+            return executor.submit(function, *args)
+        return function(*args)
+
+    def _call_single_flight(self, name, function, args, options):
+        key = (name, freeze(args))
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return _chain_future(flight)
+            flight = self._flights[key] = futures.Future()
+        try:
+            result = self._call_with_options(name, function, args, options)
+        except Exception as err:
+            self._land(key).set_exception(err)
+            raise
+        if isinstance(result, futures.Future):
+            # Each caller gets its own future, so that cancelling one
+            # does not cancel the others.
+            result.add_done_callback(
+                lambda result: _copy_future(result, self._land(key)))
+            return _chain_future(flight)
+        self._land(key).set_result(result)
+        return result
+
+    def _land(self, key):
+        with self._flights_lock:
+            return self._flights.pop(key)
+
+    def _get_batcher(self, name, function, options):
+        try:
+            return self._batchers[name]
+        except KeyError:
+            pass
+        executor = self.get_executor(options.get('executor'))
+        with self._batchers_lock:
+            batcher = self._batchers.get(name)
+            if batcher is None:
+                batcher = self._batchers[name] = MicroBatcher(
+                    function,
+                    max_batch=options.get('max_batch', 100),
+                    max_wait=options.get('max_wait_ms', 1) / 1000.0,
+                    executor=executor)
+        return batcher
+
+    def _resolve_method(self, name):
+        if name == self.stats_method and self.metrics is not None:
+            return self.metrics.snapshot
+        return EPCDispatcher._resolve_method(self, name)
+
+    def shutdown_executors(self):
+        """
+        Shut down the process pool started by :meth:`get_executor`
+        and the threads batching calls.
+        """
+        with self._batchers_lock:
+            batchers = list(self._batchers.values())
+            self._batchers.clear()
+        for batcher in batchers:
+            batcher.close()
+        with self._process_pool_lock:
+            pool = self._process_pool
+            self._process_pool = None
+        if pool is not None:
+            pool.shutdown()
 
     def set_debugger(self, debugger):
         """
@@ -15,13 +15,21 @@
 
 
 import sys
+import errno
+import socket
+import logging
 import itertools
 import threading
+import time
 
-from sexpdata import loads, dumps, Symbol, String
+from sexpdata import loads, dumps, Symbol
 
-from .py3compat import SocketServer, Queue
-from .utils import autolog, LockingDict, newthread, callwith
+from .py3compat import SocketServer, Queue, futures, require_futures
+from .codec import IncrementalDecoder, encode_frame, encode_frame_buffers
+from .metrics import clock
+from .hooks import TimedDecoder
+from .utils import autolog, short_repr, LockingDict, newthread, callwith, \
+    sendmsg_all, FrameWriter
 
 
 class BaseRemoteError(Exception):
@@ -66,6 +74,33 @@ class EPCClosed(Exception):
     """
 
 
+class EPCTimeout(Queue.Empty):
+    """
+    No reply arrived in time.  The call is cancelled.
+
+    This is a subclass of `Empty`, which was raised on timeout in
+    older versions.
+    """
+
+
+_call_state = threading.local()
+
+
+def call_cancelled():
+    """
+    Return True if the call handled in the current thread is cancelled.
+
+    A peer with :attr:`EPCHandler.send_cancel` enabled cancels a call
+    when it gives up waiting for the reply.  Threads can not be
+    interrupted, so a long running function registered to a server
+    using :class:`ThreadingEPCHandler` may poll this function and
+    return early.  It always returns False outside of such functions.
+
+    """
+    event = getattr(_call_state, 'cancelled', None)
+    return event is not None and event.is_set()
+
+
 def encode_string(string):
     data = string.encode('utf-8')
     datalen = '{0:06x}'.format(len(data) + 1).encode()
@@ -75,15 +110,45 @@ _NEWLINE_BYTE = '\n'.encode()
 
 
 def encode_object(obj, **kwds):
-    return encode_string(dumps(obj, **kwds))
+    if kwds:
+        return encode_string(dumps(obj, **kwds))
+    return encode_frame(obj)
+
+
+_MESSAGE_SYMBOLS = dict(
+    (name, Symbol(name)) for name in
+    ['call', 'return', 'return-error', 'epc-error', 'methods', 'cancel'])
+
+
+_REPLY_NAMES = frozenset(['return', 'return-error', 'epc-error'])
+
+
+def message_symbol(name):
+    """
+    Return :class:`sexpdata.Symbol` for message `name`.
+
+    Symbols of the messages defined by EPC are created only once.
+
+    """
+    return _MESSAGE_SYMBOLS.get(name) or Symbol(name)
 
 
 def encode_message(name, *args, **kwds):
-    return encode_object([Symbol(name)] + list(args), **kwds)
+    return encode_object([message_symbol(name)] + list(args), **kwds)
+
+
+def unpack_message(data):
+    """
+    Unpack a message into a ``(name, uid, args)`` tuple.
 
+    `data` is either the raw bytes of a message or an
+    :class:`IncrementalDecoder` which has been fed a message.
 
-def unpack_message(bytes):
-    data = loads(bytes.decode('utf-8'))
+    """
+    if isinstance(data, IncrementalDecoder):
+        data = data.close()
+    else:
+        data = loads(data.decode('utf-8'))
     return (data[0].value(), data[1], data[2:])
 
 
@@ -100,6 +165,81 @@ def itermessage(read):
         yield data
 
 
+def iterdecode(read, chunksize=1 << 16, new_decoder=IncrementalDecoder):
+    """
+    Like :func:`itermessage`, but decode messages while reading them.
+
+    Each message is read in chunks of at most `chunksize` bytes and
+    fed to an :class:`IncrementalDecoder` (made by calling
+    `new_decoder`), which is yielded when the whole message is read.
+    Pass it to :func:`unpack_message` to get the message.
+
+    """
+    while True:
+        head = read(6)
+        if not head:
+            return
+        length = rest = int(head, 16)
+        decoder = new_decoder()
+        while rest > 0:
+            data = read(min(rest, chunksize))
+            if not data:
+                raise ValueError('need {0}-length data; got {1}'
+                                 .format(length, length - rest))
+            decoder.feed(data)
+            rest -= len(data)
+        yield decoder
+
+
+def iterrecv(recv_into, bufsize=1 << 16, new_decoder=IncrementalDecoder):
+    """
+    Like :func:`iterdecode`, but read with a `socket.recv_into`-like
+    function into one reusable buffer.
+
+    One call of `recv_into` can receive several messages; all of them
+    are decoded before the next call.  Decoders are fed with
+    :class:`memoryview` slices of the buffer, so received bytes are
+    not copied before decoding.
+
+    """
+    buf = bytearray(bufsize)
+    view = memoryview(buf)
+    start = end = 0  # received but not yet decoded: buf[start:end]
+    decoder = None
+    rest = 0
+    while True:
+        while True:
+            if decoder is None:
+                if end - start < 6:
+                    break
+                rest = int(bytes(view[start:start + 6]), 16)
+                decoder = new_decoder()
+                start += 6
+            size = min(rest, end - start)
+            if size:
+                decoder.feed(view[start:start + size])
+                start += size
+                rest -= size
+            if rest:
+                break
+            yield decoder
+            decoder = None
+        if start == end:
+            start = end = 0
+        elif start:
+            # Move an incomplete header to the beginning of the buffer.
+            end -= start
+            buf[:end] = view[start:start + end]
+            start = 0
+        received = recv_into(view[end:])
+        if not received:
+            if decoder is not None or end:
+                raise ValueError('connection closed in the middle of '
+                                 'a message')
+            return
+        end += received
+
+
 class BlockingCallback(object):
 
     def __init__(self):
@@ -116,6 +256,69 @@ class BlockingCallback(object):
             raise reply
 
 
+_Future = futures.Future if futures else ()
+
+
+def future_callbacks(future):
+    """
+    Return keyword arguments for :meth:`EPCHandler.call` to resolve
+    `future`.
+
+    `future` can be a :class:`concurrent.futures.Future` or an
+    :class:`asyncio.Future`.  A future which is already done (e.g.,
+    cancelled) is left untouched.
+
+    """
+    def callback(reply):
+        if not future.done():
+            future.set_result(reply)
+
+    def errback(error):
+        if not future.done():
+            future.set_exception(error)
+    return {'callback': callback, 'errback': errback}
+
+
+def gather(fs, timeout=None, return_exceptions=False):
+    """
+    Wait for futures `fs` and return their results in the same order.
+
+    :type               fs: list of :class:`concurrent.futures.Future`
+    :arg                fs: Futures, e.g., returned by
+                            :meth:`EPCHandler.call_future`.
+    :type          timeout: float or None
+    :arg           timeout: Timeout in second for all futures.
+    :type return_exceptions: bool
+    :arg  return_exceptions: If true, an error of a future is put in
+                             the result list instead of being raised.
+
+    :exc:`concurrent.futures.TimeoutError` is raised if some futures
+    are not done in `timeout` seconds.
+
+    """
+    require_futures('gather')
+    fs = list(fs)
+    (_, not_done) = futures.wait(fs, timeout)
+    if not_done:
+        raise futures.TimeoutError(
+            '{0} (of {1}) futures unfinished'.format(len(not_done), len(fs)))
+    if not return_exceptions:
+        return [f.result() for f in fs]
+    return [f.exception() or f.result() for f in fs]
+
+
+def as_completed(fs, timeout=None):
+    """
+    Alias of :func:`concurrent.futures.as_completed`.
+
+    Iterate over futures `fs` (e.g., returned by
+    :meth:`EPCHandler.call_future`) as they complete.
+
+    """
+    require_futures('as_completed')
+    return futures.as_completed(fs, timeout)
+
+
 class EPCCallManager:
 
     Dict = LockingDict  # FIXME: make it configurable from server class.
@@ -126,7 +329,10 @@ class EPCCallManager:
     def __init__(self):
         self.callbacks = self.Dict()
         counter = itertools.count(1)
-        self.get_uid = callwith(threading.Lock())(lambda: next(counter))
+        uid_lock = threading.Lock()
+        self.get_uid = callwith(uid_lock)(lambda: next(counter))
+        self.get_uids = callwith(uid_lock)(
+            lambda n: list(itertools.islice(counter, n)))
         # Wrapping by threading.Lock is useless for non-threading
         # handler.  Probably it is better to make it optional.
 
@@ -134,11 +340,37 @@ class EPCCallManager:
         uid = self.get_uid()
         self.callbacks[uid] = (callback, errback)
         handler._send('call', uid, Symbol(name), args)
+        return uid
+
+    def call_many(self, handler, calls, cbs):
+        """
+        Send ``call`` messages for `calls` (a list of ``(name, args)``)
+        at once.  `cbs` is a list of ``(callback, errback)`` pairs.
+        """
+        uids = self.get_uids(len(calls))
+        for (uid, pair) in zip(uids, cbs):
+            self.callbacks[uid] = pair
+        try:
+            handler._send_many([
+                ('call', uid, Symbol(name), args)
+                for (uid, (name, args)) in zip(uids, calls)])
+        except Exception:
+            for uid in uids:
+                self.callbacks.pop(uid, None)
+            raise
+        return uids
 
     def methods(self, handler, callback=None, errback=None):
         uid = self.get_uid()
         self.callbacks[uid] = (callback, errback)
         handler._send('methods', uid)
+        return uid
+
+    def cancel(self, uid):
+        """
+        Forget callbacks for `uid`.  Return False if it is not waiting.
+        """
+        return self.callbacks.pop(uid, None) is not None
 
     def handle_return(self, uid, reply):
         try:
@@ -180,19 +412,65 @@ class EPCHandler(SocketServer.StreamRequestHandler):
     # self.rfile      : stream from client
     # self.wfile      : stream to client
 
+    recv_bufsize = 1 << 16
+    """
+    Size of the buffer to receive messages from a socket.
+    """
+
+    sendmsg_threshold = 1 << 16
+    """
+    Strings in a message which are at least this many bytes long (in
+    UTF-8) are not copied into the frame.  Instead, the frame is
+    written as separate buffers by `socket.sendmsg`.  Set it to None
+    to always write one buffer.  It has no effect on platforms or
+    connections without `sendmsg`.
+    """
+
+    send_cancel = False
+    """
+    Send a ``cancel`` message to the peer when a call times out or its
+    future is cancelled, so that the peer can skip or stop the work.
+    This is an extension to the EPC protocol understood by
+    Python-EPC; enable it only when the peer is Python-EPC.
+    """
+
     @property
     def logger(self):
         return self.server.logger
 
+    threaded_writer = False
+    """
+    Whether to write frames in a dedicated thread.
+    See :class:`epc.utils.FrameWriter`.
+    """
+
+    tcp_nodelay = True
+    """
+    Set ``TCP_NODELAY`` on TCP connections.  Frames are already
+    coalesced by :attr:`writer`, so there is no need to delay them
+    further.
+    """
+
     @autolog('debug')
     def setup(self):
         SocketServer.StreamRequestHandler.setup(self)
+        if self.tcp_nodelay:
+            try:
+                self.connection.setsockopt(
+                    socket.IPPROTO_TCP, socket.TCP_NODELAY, True)
+            except (AttributeError, OSError, socket.error):
+                pass  # not a TCP socket
+        self.writer = FrameWriter(self._write_buffers,
+                                  threaded=self.threaded_writer)
         self.callmanager = EPCCallManager()
+        self._deferred = {}
+        self._measured = {}
         self.server.add_client(self)
 
     @autolog('debug')
     def finish(self):
         try:
+            self.writer.close()
             SocketServer.StreamRequestHandler.finish(self)
         finally:
             self.server.remove_client(self)
@@ -209,22 +487,113 @@ class EPCHandler(SocketServer.StreamRequestHandler):
             else:
                 raise  # if not, just re-raise it.
 
+    def _recv_into_safely(self, buffer):
+        try:
+            return self.connection.recv_into(buffer)
+        except (OSError, socket.error) as err:
+            if self.connection.fileno() == -1:
+                return 0  # closed in another thread
+            if getattr(err, 'errno', None) == errno.ECONNRESET:
+                return 0  # peer is gone (e.g., killed)
+            raise
+
     def _recv(self):
-        self.logger.debug('receiving...')
-        for data in itermessage(self._rfile_read_safely):
-            self.logger.debug(
-                'received: length = %r; data = %r', len(data), data)
-            yield data
-            self.logger.debug('receiving...')
+        logger = self.logger
+        logger.debug('receiving...')
+        if hasattr(self.connection, 'recv_into'):
+            messages = iterrecv(self._recv_into_safely, self.recv_bufsize,
+                                self._new_decoder)
+        else:
+            messages = iterdecode(self._rfile_read_safely,
+                                  new_decoder=self._new_decoder)
+        for decoder in messages:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('received: length = %r', decoder.nbytes)
+            yield decoder
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('receiving...')
+
+    def _new_decoder(self):
+        if self.server.hooks.frame_received:
+            return TimedDecoder()
+        return IncrementalDecoder()
 
     @autolog('debug')
     def _send(self, *args):
-        string = encode_message(*args)
+        self._put_buffers(self._encode_buffers(args))
+
+    def _send_many(self, messages):
+        """
+        Send `messages` (a list of argument tuples for :meth:`_send`)
+        by one write.
+        """
+        buffers = []
+        for args in messages:
+            buffers.extend(self._encode_buffers(args))
+        self._put_buffers(buffers)
+
+    def _encode_buffers(self, args):
+        hooks = self.server.hooks
+        if not (hooks.frame_encoded or self._measured):
+            return self._encode_buffers_nohook(args)
+        started = clock()
+        try:
+            buffers = self._encode_buffers_nohook(args)
+        except Exception:
+            self._finish_reply(args, error=True)
+            raise
+        nbytes = sum(map(len, buffers))
+        self._finish_reply(args, nbytes=nbytes)
+        hooks.fire('frame_encoded', self, args[0], args[1], nbytes,
+                   clock() - started)
+        return buffers
+
+    def _finish_reply(self, args, error=False, nbytes=0):
+        # Record the end of the call replied by the message `args`.
+        # `nbytes` is the size of the whole frame.  See `_handle_call`.
+        if args[0] in _REPLY_NAMES:
+            self._finish_call(args[1], error or args[0] != 'return', nbytes)
+
+    def _finish_call(self, uid, error=False, nbytes=0):
+        measured = self._measured.pop(uid, None)
+        if measured is not None:
+            (metrics, name, started) = measured
+            metrics.finish(name, started, error=error, nbytes=nbytes)
+
+    def _encode_buffers_nohook(self, args):
+        threshold = self.sendmsg_threshold
+        if threshold is not None and hasattr(self.connection, 'sendmsg'):
+            return encode_frame_buffers(
+                [message_symbol(args[0])] + list(args[1:]), threshold)
+        else:
+            return [encode_message(*args)]
+
+    def _put_buffers(self, buffers):
         try:
-            self.wfile.write(string)
+            self.writer.put(buffers)
         except (AttributeError, ValueError):
             # See also: :meth:`_rfile_read_safely`
             raise EPCClosed
+        except (OSError, socket.error):
+            if self.connection.fileno() == -1:
+                raise EPCClosed
+            raise
+
+    def _write_buffers(self, buffers):
+        hooks = self.server.hooks
+        if hooks.frame_written:
+            self._write_buffers_nohook(buffers)
+            hooks.fire('frame_written', self, sum(map(len, buffers)))
+        else:
+            self._write_buffers_nohook(buffers)
+
+    def _write_buffers_nohook(self, buffers):
+        if len(buffers) == 1:
+            self.wfile.write(buffers[0])
+        elif hasattr(self.connection, 'sendmsg'):
+            sendmsg_all(self.connection, buffers)
+        else:
+            self.wfile.write(_JOIN_BYTES(buffers))
 
     @autolog('debug')
     def handle(self):
@@ -236,31 +605,129 @@ class EPCHandler(SocketServer.StreamRequestHandler):
         uid = undefined = []  # default: nil
         try:
             (name, uid, args) = unpack_message(sexp)
-            pyname = name.replace('-', '_')
-            getattr(self, '_validate_{0}'.format(pyname))(uid, args)
-            handler = getattr(self, '_handle_{0}'.format(pyname))
-            reply = handler(uid, *args)
-            if reply is not None:
-                self._send(*reply)
         except Exception as err:
-            if self.handle_error(err):
-                self.logger.debug(
-                    'Error in handler for UID=%s (marked as handled)',
-                    uid,
-                    exc_info=1,
-                )
+            self._handle_exception(err, undefined, 'epc-error')
+            return
+        if isinstance(sexp, TimedDecoder):
+            self.server.hooks.fire(
+                'frame_received', self, sexp.nbytes, sexp.elapsed)
+        if name != 'call' or self.server.metrics is None:
+            self._handle_message(name, uid, args)
+            return
+        # Remember when and how large the request was for metrics.
+        # See `_handle_call`.
+        nbytes = sexp.nbytes if isinstance(sexp, IncrementalDecoder) \
+            else len(sexp)
+        _call_state.received = (clock(), nbytes)
+        try:
+            self._handle_message(name, uid, args)
+        finally:
+            _call_state.received = None
+
+    @classmethod
+    def _dispatch_table(cls):
+        """
+        Return a dictionary which maps message names to pairs of
+        ``_validate_<name>`` and ``_handle_<name>`` functions.
+
+        The table is made once for each class from its methods, so a
+        subclass can handle a new message by defining these methods.
+
+        """
+        table = cls.__dict__.get('_dispatch')
+        if table is None:
+            table = {}
+            for attr in dir(cls):
+                if not attr.startswith('_validate_'):
+                    continue
+                pyname = attr[len('_validate_'):]
+                handler = getattr(cls, '_handle_' + pyname, None)
+                if handler is not None:
+                    table[pyname.replace('_', '-')] = (
+                        getattr(cls, attr), handler)
+            cls._dispatch = table
+        return table
+
+    def _handle_message(self, name, uid, args):
+        hooks = self.server.hooks
+        if not (hooks.dispatch_start or hooks.dispatch_end):
+            self._dispatch_message(name, uid, args)
+            return
+        hooks.fire('dispatch_start', self, name, uid, args)
+        started = clock()
+        error = self._dispatch_message(name, uid, args)
+        hooks.fire('dispatch_end', self, name, uid, error, clock() - started)
+
+    def _dispatch_message(self, name, uid, args):
+        # Return the exception handled here, if any.
+        try:
+            try:
+                (validate, handler) = self._dispatch_table()[name]
+            except KeyError:
+                message = 'Unknown message: {0}'.format(name)
+                self._send('epc-error', uid, message)
+                raise EPCError(message)
+            validate(self, uid, args)
+            reply = handler(self, uid, *args)
+            if reply is None:
+                return
+            if call_cancelled():
+                self._finish_call(uid)
                 return
-            if self.server.log_traceback or self.server.debugger:
-                self.logger.exception('Unexpected error for UID=%s', uid)
+            if reply[0] == 'return' and isinstance(reply[2], _Future):
+                self._reply_later(uid, reply[2])
             else:
-                self.logger.error(
-                    'Unexpected error for UID=%s: %s', uid, repr(err),
-                )
-            if self.server.debugger:
-                exc_info = sys.exc_info()
+                self._send(*reply)
+        except Exception as err:
+            self._handle_exception(err, uid)
+            return err
+
+    def _reply_later(self, uid, future):
+        # Send the result of `future` when it is done.  A registered
+        # function may return a `concurrent.futures.Future` to defer
+        # its reply like this.
+        self._deferred[uid] = future
+
+        def done(future):
+            self._deferred.pop(uid, None)
+            if future.cancelled():
+                self._finish_call(uid)
+                return
+            try:
+                try:
+                    result = future.result()
+                except Exception as err:
+                    self._finish_call(uid, error=True)
+                    self._handle_exception(err, uid)
+                else:
+                    self._send('return', uid, result)
+            except EPCClosed:
+                pass
+        future.add_done_callback(done)
+
+    def _handle_exception(self, err, uid, name='return-error'):
+        if call_cancelled():
+            self.logger.debug('Error in cancelled call UID=%s', uid,
+                              exc_info=1)
+            return
+        if self.handle_error(err):
+            self.logger.debug(
+                'Error in handler for UID=%s (marked as handled)',
+                uid,
+                exc_info=1,
+            )
+            return
+        if self.server.log_traceback or self.server.debugger:
+            self.logger.exception('Unexpected error for UID=%s', uid)
+        else:
+            self.logger.error(
+                'Unexpected error for UID=%s: %s', uid, repr(err),
+            )
+        if self.server.debugger:
+            exc_info = sys.exc_info()
+            if exc_info[2] is not None:
                 self.server.debugger.post_mortem(exc_info[2])
-            name = 'epc-error' if uid is undefined else 'return-error'
-            self._send(name, uid, repr(err))
+        self._send(name, uid, repr(err))
 
     @autolog('debug')
     def _handle_call(self, uid, meth, args):
@@ -271,17 +738,42 @@ class EPCHandler(SocketServer.StreamRequestHandler):
         except AttributeError:
             return ['epc-error', uid,
                     "EPC-ERROR: No such method : {0}".format(name)]
-        self.logger.debug('EPC handler %s: args=%s', func, args)
-        result = func(*args)
-        self.logger.debug('EPC handler %s: result=%s', func, result)
+        metrics = self.server.metrics
+        if metrics is None:
+            return ['return', uid, self._call_function(name, func, args)]
+        (received, nbytes) = \
+            getattr(_call_state, 'received', None) or (None, 0)
+        started = metrics.start(name, received, nbytes)
+        try:
+            result = self._call_function(name, func, args)
+        except Exception:
+            metrics.finish(name, started, error=True)
+            raise
+        # The call is finished when its reply is encoded, so that the
+        # size of the written frame is recorded.  See `_finish_reply`.
+        self._measured[uid] = (metrics, name, started)
         return ['return', uid, result]
 
+    def _call_function(self, name, func, args):
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            self.logger.debug('EPC handler %s: args=%s', func,
+                              short_repr(args))
+        result = self.server.call_function(name, func, args)
+        if debug:
+            self.logger.debug('EPC handler %s: result=%s', func,
+                              short_repr(result))
+        return result
+
     def _handle_methods(self, uid):
-        return ['return', uid, [
-            (Symbol(name), [], String(func.__doc__ or ""))
-            # FIXNE: implement arg-specs
-            for (name, func)
-            in self.server.funcs.items()]]
+        return ['return', uid, self.server.get_methods_info()]
+
+    def _handle_cancel(self, uid):
+        # Calls are handled one by one in the reading thread, so only
+        # a deferred reply (see `_reply_later`) can be cancelled.
+        future = self._deferred.get(uid)
+        if future is not None:
+            future.cancel()
 
     def _handle_return(self, uid, reply):
         self.callmanager.handle_return(uid, reply)
@@ -309,6 +801,9 @@ class EPCHandler(SocketServer.StreamRequestHandler):
     def _validate_methods(self, uid, args):
         self._validate_call(uid, args, 0, 'methods')
 
+    def _validate_cancel(self, uid, args):
+        self._validate_call(uid, args, 0, 'cancel')
+
     def _validate_return(self, uid, args):
         len_args = len(args)
         error = lambda x: self._epc_error_template % ('return', uid, x, args)
@@ -375,8 +870,11 @@ class EPCHandler(SocketServer.StreamRequestHandler):
                         in the remote method.  It is either an instance
                         of :class:`ReturnError` or :class:`EPCError`.
 
+        Return the UID of the call, which can be passed to
+        :meth:`cancel`.
+
         """
-        self.callmanager.call(self, name, *args, **kwds)
+        return self.callmanager.call(self, name, *args, **kwds)
 
     def methods(self, *args, **kwds):
         """
@@ -386,13 +884,37 @@ class EPCHandler(SocketServer.StreamRequestHandler):
         this function too.
 
         """
-        self.callmanager.methods(self, *args, **kwds)
+        return self.callmanager.methods(self, *args, **kwds)
+
+    def cancel(self, uid):
+        """
+        Stop waiting for the reply to the call `uid`.
+
+        Its callback and errback are discarded and never called.  If
+        :attr:`send_cancel` is true, the peer is asked to stop the
+        call.  Return False if the reply has already arrived.
 
-    @staticmethod
-    def _blocking_request(call, timeout, *args):
+        """
+        if not self.callmanager.cancel(uid):
+            return False
+        if self.send_cancel:
+            try:
+                self._send('cancel', uid)
+            except EPCClosed:
+                pass
+        return True
+
+    def _blocking_request(self, call, timeout, *args):
         bc = BlockingCallback()
-        call(*args, **bc.cbs)
-        return bc.result(timeout=timeout)
+        uid = call(*args, **bc.cbs)
+        try:
+            return bc.result(timeout=timeout)
+        except Queue.Empty:
+            if not self.cancel(uid):
+                # The reply arrived just after the timeout.
+                return bc.result(timeout=None)
+            raise EPCTimeout('No reply for UID={0} in {1} sec'
+                             .format(uid, timeout))
 
     def call_sync(self, name, args, timeout=None):
         """
@@ -407,7 +929,8 @@ class EPCHandler(SocketServer.StreamRequestHandler):
 
         If the called remote function raise an exception, this method
         raise an exception.  If you give `timeout`, this method may
-        raise an `Empty` exception.
+        raise an :class:`EPCTimeout` exception (a subclass of `Empty`)
+        after cancelling the call (see :meth:`cancel`).
 
         """
         return self._blocking_request(self.call, timeout, name, args)
@@ -418,8 +941,161 @@ class EPCHandler(SocketServer.StreamRequestHandler):
         """
         return self._blocking_request(self.methods, timeout)
 
+    def call_many(self, calls, timeout=None):
+        """
+        Call many remote methods at once and wait for their results.
+
+        :type    calls: list of ``(name, args)``
+        :arg     calls: Remote function names and their arguments.
+        :type  timeout: int or None
+        :arg   timeout: Timeout in second for all calls.
+        :rtype: list
+
+        Messages for all `calls` are written to the socket at once,
+        so that the remote functions do not wait for each other's
+        round trip.  The results are returned in the order of
+        `calls`.  If a remote function raises an exception, the
+        :class:`ReturnError` or :class:`EPCError` is put in the
+        list in place of its result.  Like :meth:`call_sync`, an
+        :class:`EPCTimeout` exception is raised and unfinished calls
+        are cancelled if some results do not arrive in `timeout`
+        seconds.
+
+        """
+        calls = [(name, args) for (name, args) in calls]
+        queue = Queue.Queue()
+
+        def pair(i):
+            put = lambda x: queue.put((i, x))
+            return (put, put)
+        uids = self.callmanager.call_many(
+            self, calls, [pair(i) for i in range(len(calls))])
+
+        results = [None] * len(calls)
+        waiting = set(range(len(calls)))
+        deadline = None if timeout is None else time.time() + timeout
+        while waiting:
+            if deadline is not None:
+                timeout = max(0, deadline - time.time())
+            try:
+                (i, reply) = queue.get(timeout=timeout)
+            except Queue.Empty:
+                for i in sorted(waiting):
+                    self.cancel(uids[i])
+                while not queue.empty():  # arrived while cancelling
+                    waiting.discard(queue.get()[0])
+                raise EPCTimeout('{0} (of {1}) calls unfinished'
+                                 .format(len(waiting), len(calls)))
+            results[i] = reply
+            waiting.discard(i)
+        return results
+
+    def call_future(self, name, args=[]):
+        """
+        Call remote method and return a future of its result.
+
+        :type name: str
+        :arg  name: Remote function name to call.
+        :type args: list
+        :arg  args: Arguments passed to the remote function.
+        :rtype: :class:`concurrent.futures.Future`
+
+        Unlike :meth:`call_sync`, this method does not block, so that
+        one thread can keep many calls in flight.  Use :func:`gather`
+        or :func:`as_completed` to wait for them::
+
+            fs = [handler.call_future('echo', [i]) for i in range(100)]
+            results = gather(fs, timeout=10)
+
+        If the remote function raises an exception, the future is
+        resolved with :class:`ReturnError` or :class:`EPCError`.
+        Cancelling the future cancels the call (see :meth:`cancel`).
+        In Python 2, the "futures" package is needed.
+
+        """
+        require_futures('call_future')
+        future = futures.Future()
+        uid = self.call(name, args, **future_callbacks(future))
+        self._cancel_with(future, uid)
+        return future
+
+    def _cancel_with(self, future, uid):
+        def done(future):
+            if future.cancelled():
+                self.cancel(uid)
+        future.add_done_callback(done)
+
+    def methods_future(self):
+        """
+        Future version of :meth:`methods`.  See also :meth:`call_future`.
+        """
+        require_futures('methods_future')
+        future = futures.Future()
+        uid = self.methods(**future_callbacks(future))
+        self._cancel_with(future, uid)
+        return future
+
 
 class ThreadingEPCHandler(EPCHandler):
 
-    def _handle(self, sexp):
-        newthread(self, target=EPCHandler._handle, args=(self, sexp)).start()
+    """
+    Handler which runs requests from the peer in worker threads.
+
+    Requests (``call`` and ``methods``) are executed by the worker
+    pool of the server (see :class:`epc.utils.ThreadPool`) or, if the
+    server has no pool, in a new thread for each request.  Replies
+    (``return``, ``return-error`` and ``epc-error``) only fire
+    callbacks and are handled in the thread reading the connection,
+    so that a worker blocked in :meth:`call_sync` does not need
+    another worker to receive its reply.
+
+    Messages to the peer are queued to :attr:`writer`, whose thread
+    writes all queued frames at once.
+
+    """
+
+    _inline_messages = frozenset(
+        ['return', 'return-error', 'epc-error', 'cancel'])
+
+    threaded_writer = True
+
+    def setup(self):
+        self._cancel_events = {}
+        EPCHandler.setup(self)
+
+    def _handle_message(self, name, uid, args):
+        if name in self._inline_messages:
+            EPCHandler._handle_message(self, name, uid, args)
+            return
+        cancelled = received = None
+        if name == 'call':
+            cancelled = self._cancel_events[uid] = threading.Event()
+            received = getattr(_call_state, 'received', None)
+        pool = self.server.worker_pool
+        if pool is None:
+            newthread(self, target=self._run_message,
+                      args=(name, uid, args, cancelled, received)).start()
+        else:
+            pool.submit(self._run_message, name, uid, args, cancelled,
+                        received)
+
+    def _run_message(self, name, uid, args, cancelled, received=None):
+        if cancelled is None:
+            EPCHandler._handle_message(self, name, uid, args)
+            return
+        try:
+            if cancelled.is_set():
+                self.logger.debug('Skip cancelled call UID=%s', uid)
+                return
+            _call_state.cancelled = cancelled
+            _call_state.received = received
+            EPCHandler._handle_message(self, name, uid, args)
+        finally:
+            _call_state.cancelled = _call_state.received = None
+            self._cancel_events.pop(uid, None)
+
+    def _handle_cancel(self, uid):
+        event = self._cancel_events.get(uid)
+        if event is not None:
+            event.set()
+        EPCHandler._handle_cancel(self, uid)
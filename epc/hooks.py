@@ -0,0 +1,149 @@
+# Copyright (C) 2012-  Takafumi Arakaki
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Instrumentation hooks around receiving, dispatching and sending.
+
+Every :class:`epc.core.EPCCore` (servers and clients) has a
+:class:`Hooks` object as :attr:`hooks <epc.core.EPCCore.hooks>`.
+Callbacks added to it are called by the handlers of its connections::
+
+    def on_dispatch_end(handler, name, uid, error, elapsed):
+        print(name, uid, elapsed)
+
+    server.hooks.add('dispatch_end', on_dispatch_end)
+
+Events and the arguments of their callbacks are:
+
+``frame_received(handler, nbytes, decode_time)``
+    A frame of `nbytes` bytes (without the 6-byte header) is received
+    and decoded.  `decode_time` is the seconds spent in decoding it.
+``dispatch_start(handler, name, uid, args)``
+    Message `name` (``'call'``, ``'return'``, etc.) is to be handled.
+``dispatch_end(handler, name, uid, error, elapsed)``
+    The message is handled.  `error` is the raised exception or None.
+    For a call whose reply is deferred (the function returned a
+    future or, in :mod:`epc.aio`, an awaitable) this is when the
+    function returns, not when the reply is sent.
+``frame_encoded(handler, name, uid, nbytes, encode_time)``
+    Outgoing message `name` is encoded into `nbytes` bytes.
+``frame_written(handler, nbytes)``
+    `nbytes` bytes are written to the connection.  One write may
+    contain several frames.
+
+Callbacks run in the thread doing the work, so they should be quick.
+An exception from a callback is logged and ignored.  When no callback
+is added for an event, the handlers do not even read the clock for it.
+
+"""
+
+import logging
+
+from .codec import IncrementalDecoder
+from .metrics import clock
+
+_logger = logging.getLogger(__name__)
+
+EVENTS = ('frame_received', 'dispatch_start', 'dispatch_end',
+          'frame_encoded', 'frame_written')
+
+
+class Hooks(object):
+
+    """
+    Callbacks for the instrumentation events.
+
+    Each event is an attribute holding a tuple of callbacks, so that
+    checking for callbacks is an attribute access.
+
+    >>> hooks = Hooks()
+    >>> bool(hooks.frame_written)
+    False
+    >>> calls = []
+    >>> callback = hooks.add('frame_written', lambda *a: calls.append(a))
+    >>> hooks.fire('frame_written', 'handler', 10)
+    >>> calls
+    [('handler', 10)]
+    >>> hooks.remove('frame_written', callback)
+    >>> bool(hooks.frame_written)
+    False
+
+    """
+
+    logger = _logger
+
+    def __init__(self):
+        for event in EVENTS:
+            setattr(self, event, ())
+
+    def _check(self, event):
+        if event not in EVENTS:
+            raise ValueError('Unknown event: {0}'.format(event))
+
+    def add(self, event, callback):
+        """
+        Call `callback` on `event` and return `callback`.
+        """
+        self._check(event)
+        setattr(self, event, getattr(self, event) + (callback,))
+        return callback
+
+    def remove(self, event, callback):
+        """
+        Stop calling `callback` on `event`.
+        """
+        self._check(event)
+        callbacks = list(getattr(self, event))
+        callbacks.remove(callback)
+        setattr(self, event, tuple(callbacks))
+
+    def fire(self, event, *args):
+        """
+        Call the callbacks of `event` with `args`.
+        """
+        for callback in getattr(self, event):
+            try:
+                callback(*args)
+            except Exception:
+                self.logger.exception('Error in %s hook %r',
+                                      event, callback)
+
+
+class TimedDecoder(IncrementalDecoder):
+
+    """
+    :class:`IncrementalDecoder` which sums the seconds spent in
+    decoding as :attr:`elapsed`.
+
+    Handlers use it instead of :class:`IncrementalDecoder` while
+    ``frame_received`` has callbacks.
+
+    """
+
+    def __init__(self):
+        IncrementalDecoder.__init__(self)
+        self.elapsed = 0.0
+
+    def feed(self, data):
+        started = clock()
+        IncrementalDecoder.feed(self, data)
+        self.elapsed += clock() - started
+
+    def close(self):
+        started = clock()
+        try:
+            return IncrementalDecoder.close(self)
+        finally:
+            self.elapsed += clock() - started
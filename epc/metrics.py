@@ -0,0 +1,282 @@
+# Copyright (C) 2012-  Takafumi Arakaki
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Per-method metrics of called functions.
+
+:class:`epc.core.EPCCore` records calls to the functions it serves in
+:attr:`metrics <epc.core.EPCCore.metrics>`, a :class:`Metrics`
+object.  They can be read by
+
+- the Python API, :meth:`Metrics.snapshot`,
+- the reserved EPC method ``epc-stats``, which returns the snapshot,
+- the Prometheus text format, :meth:`Metrics.prometheus_text`, which
+  :func:`start_http_server` serves over HTTP.
+
+For each method, the following are recorded:
+
+``calls``, ``errors``
+    Number of calls and of calls which raised an error.
+``in_flight``
+    Number of calls running now.
+``queue_wait``, ``exec_time``
+    Histograms of seconds from receiving the request to starting the
+    function and of seconds the function took.
+``request_bytes``, ``response_bytes``
+    Total size of the requests and of the reply frames.
+
+Metrics are of the current process.  Each worker of
+:class:`epc.server.PreforkEPCServer` has its own.
+
+"""
+
+import bisect
+import threading
+import time
+
+from .py3compat import BaseHTTPServer
+
+clock = getattr(time, 'monotonic', time.time)
+
+
+class Histogram(object):
+
+    """
+    Histogram of durations in seconds.
+
+    >>> h = Histogram(bounds=[0.1, 1])
+    >>> for value in [0.05, 0.5, 0.7, 3]:
+    ...     h.observe(value)
+    >>> h.snapshot() == {'bounds': [0.1, 1], 'counts': [1, 2, 1],
+    ...                  'count': 4, 'sum': 4.25}
+    True
+
+    ``counts[i]`` is the number of values which are at most
+    ``bounds[i]`` and larger than the previous bound.  The last count
+    is of the values larger than all bounds.
+
+    """
+
+    default_bounds = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05,
+                      0.1, 0.5, 1, 5, 10)
+
+    def __init__(self, bounds=None):
+        self.bounds = list(self.default_bounds if bounds is None else bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def snapshot(self):
+        return dict(bounds=list(self.bounds), counts=list(self.counts),
+                    count=sum(self.counts), sum=self.sum)
+
+
+class MethodMetrics(object):
+
+    """
+    Metrics of one method.  See the module documentation.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.queue_wait = Histogram()
+        self.exec_time = Histogram()
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+    def snapshot(self):
+        return dict(
+            calls=self.calls,
+            errors=self.errors,
+            in_flight=self.in_flight,
+            queue_wait=self.queue_wait.snapshot(),
+            exec_time=self.exec_time.snapshot(),
+            request_bytes=self.request_bytes,
+            response_bytes=self.response_bytes,
+        )
+
+
+class Metrics(object):
+
+    """
+    Metrics of all methods called through an :class:`EPCCore`.
+
+    The handler calls :meth:`start` before and :meth:`finish` after
+    running a function.  Both only update a few numbers under a lock.
+
+    >>> metrics = Metrics()
+    >>> started = metrics.start('f', nbytes=20)
+    >>> metrics.finish('f', started, nbytes=10)
+    >>> stats = metrics.snapshot()['f']
+    >>> (stats['calls'], stats['errors'], stats['in_flight'],
+    ...  stats['request_bytes'], stats['response_bytes'])
+    (1, 0, 0, 20, 10)
+
+    """
+
+    clock = staticmethod(clock)
+
+    def __init__(self):
+        self._methods = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name):
+        try:
+            return self._methods[name]
+        except KeyError:
+            return self._methods.setdefault(name, MethodMetrics())
+
+    def start(self, name, received=None, nbytes=0):
+        """
+        Record the start of a call to `name` and return the time.
+
+        :type  received: float or None
+        :arg   received: When the request was received (by
+                         :meth:`clock`).  None means no queue wait.
+        :type    nbytes: int
+        :arg     nbytes: Size of the request.
+
+        """
+        now = clock()
+        method = self._get(name)
+        with self._lock:
+            method.calls += 1
+            method.in_flight += 1
+            method.request_bytes += nbytes
+            if received is not None:
+                method.queue_wait.observe(now - received)
+        return now
+
+    def finish(self, name, started, error=False, nbytes=0):
+        """
+        Record the end of the call to `name` started at `started`.
+
+        :type    error: bool
+        :arg     error: True if the call raised an error.
+        :type   nbytes: int
+        :arg    nbytes: Size of the reply frame.
+
+        """
+        elapsed = clock() - started
+        method = self._get(name)
+        with self._lock:
+            method.in_flight -= 1
+            method.exec_time.observe(elapsed)
+            method.response_bytes += nbytes
+            if error:
+                method.errors += 1
+
+    def snapshot(self):
+        """
+        Return metrics as a dictionary keyed by method names.
+        """
+        with self._lock:
+            return dict((name, method.snapshot())
+                        for (name, method) in self._methods.items())
+
+    def reset(self):
+        """
+        Forget all recorded metrics.
+        """
+        with self._lock:
+            self._methods = {}
+
+    def prometheus_text(self, prefix='epc'):
+        """
+        Return metrics in the Prometheus text exposition format.
+
+        >>> metrics = Metrics()
+        >>> metrics.finish('f', metrics.start('f'))
+        >>> print(metrics.prometheus_text())  # doctest: +ELLIPSIS
+        # TYPE epc_calls_total counter
+        epc_calls_total{method="f"} 1
+        ...
+        # TYPE epc_exec_time_seconds histogram
+        epc_exec_time_seconds_bucket{method="f",le="0.0001"} ...
+        ...
+        epc_exec_time_seconds_bucket{method="f",le="+Inf"} 1
+        epc_exec_time_seconds_sum{method="f"} ...
+        epc_exec_time_seconds_count{method="f"} 1
+        ...
+
+        """
+        snapshot = sorted(self.snapshot().items())
+        lines = []
+
+        def label(name):
+            return 'method="{0}"'.format(
+                name.replace('\\', '\\\\').replace('"', '\\"'))
+
+        for (key, kind) in [('calls', 'counter'),
+                            ('errors', 'counter'),
+                            ('in_flight', 'gauge'),
+                            ('request_bytes', 'counter'),
+                            ('response_bytes', 'counter')]:
+            metric = '{0}_{1}{2}'.format(
+                prefix, key, '_total' if kind == 'counter' else '')
+            lines.append('# TYPE {0} {1}'.format(metric, kind))
+            for (name, stats) in snapshot:
+                lines.append('{0}{{{1}}} {2}'.format(
+                    metric, label(name), stats[key]))
+        for key in ['queue_wait', 'exec_time']:
+            metric = '{0}_{1}_seconds'.format(prefix, key)
+            lines.append('# TYPE {0} histogram'.format(metric))
+            for (name, stats) in snapshot:
+                hist = stats[key]
+                cumulative = 0
+                les = [repr(float(b)) for b in hist['bounds']] + ['+Inf']
+                for (le, count) in zip(les, hist['counts']):
+                    cumulative += count
+                    lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(
+                        metric, label(name), le, cumulative))
+                lines.append('{0}_sum{{{1}}} {2!r}'.format(
+                    metric, label(name), hist['sum']))
+                lines.append('{0}_count{{{1}}} {2}'.format(
+                    metric, label(name), hist['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def start_http_server(metrics, address=('localhost', 0)):
+    """
+    Serve :meth:`Metrics.prometheus_text` over HTTP in a thread.
+
+    Return the HTTP server.  Its ``server_address`` is the actual
+    address and ``shutdown`` stops it.
+
+    """
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            body = metrics.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer(address, Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -32,6 +32,31 @@ try:
 except:
     import queue as Queue
 
+try:
+    import BaseHTTPServer
+except ImportError:
+    import http.server as BaseHTTPServer
+
+try:
+    import reprlib
+except ImportError:
+    import repr as reprlib
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None  # Python 2 without the "futures" backport
+
+
+def require_futures(feature):
+    """
+    Raise :exc:`RuntimeError` if :mod:`concurrent.futures` is missing.
+    """
+    if futures is None:
+        raise RuntimeError(
+            '{0} needs concurrent.futures; install the "futures" package'
+            ' to use it in Python 2'.format(feature))
+
 
 try:
     from contextlib import nested
@@ -48,6 +73,12 @@ except ImportError:
             yield ()
 
 
+if PY3:
+    string_types = (str,)
+else:
+    string_types = (basestring,)
+
+
 if PY3:
     utf8 = lambda s: s
 else:
@@ -14,11 +14,16 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
 import sys
+import time
+import signal
+import socket
 import logging
+import threading
 
 from .py3compat import SocketServer
-from .utils import autolog, deprecated
+from .utils import autolog, deprecated, ThreadPool, PipeConnection
 from .core import EPCCore
 from .handler import EPCHandler, ThreadingEPCHandler
 
@@ -126,6 +131,15 @@ class EPCServer(SocketServer.TCPServer, EPCClientManager,
             "EPCServer is initialized: server_address = %r",
             self.server_address)
 
+    def server_close(self):
+        SocketServer.TCPServer.server_close(self)
+        self.shutdown_executors()
+        if self.address_family == getattr(socket, 'AF_UNIX', None):
+            try:
+                os.unlink(self.server_address)
+            except OSError:
+                pass
+
     @autolog('debug')
     def handle_error(self, request, client_address):
         self.logger.error('handle_error: trying to get traceback.format_exc')
@@ -146,8 +160,13 @@ class EPCServer(SocketServer.TCPServer, EPCClientManager,
         :arg  stream: A stream object to write port on.
                       Default is :data:`sys.stdout`.
 
+        For :class:`UnixEPCServer`, the path to the socket is printed.
+
         """
-        stream.write(str(self.server_address[1]))
+        if self.address_family == getattr(socket, 'AF_UNIX', None):
+            stream.write(self.server_address)
+        else:
+            stream.write(str(self.server_address[1]))
         stream.write("\n")
         stream.flush()
 
@@ -164,12 +183,321 @@ class ThreadingEPCServer(SocketServer.ThreadingMixIn, EPCServer):
     .. _examples/gtk/server.py:
        https://github.com/tkf/python-epc/blob/master/examples/gtk/server.py
 
+    Requests from clients are executed by a pool of worker threads
+    shared by all connections.  The pool can be configured by the
+    following keyword arguments:
+
+    :type  max_workers: int or None
+    :arg   max_workers: Maximum number of worker threads.  Default
+                        is 64.  None starts a new worker whenever all
+                        workers are busy, so that the number of
+                        threads is not bounded.
+    :type    max_queue: int
+    :arg     max_queue: Maximum number of requests waiting for a
+                        worker.  When the queue is full, the server
+                        stops reading from the connection until a
+                        worker becomes free.  0 means no limit.
+    :type  min_workers: int
+    :arg   min_workers: Number of workers kept alive while idle.
+
+    Note that a request calling the peer with
+    :meth:`EPCHandler.call_sync` occupies a worker until the reply
+    arrives.  If `max_workers` is smaller than the depth of such
+    nested calls, the server and client can block each other.
+
+    Use :meth:`ThreadPool.stats() <epc.utils.ThreadPool.stats>` of
+    :attr:`worker_pool` to see how saturated the pool is.
+
+    >>> server = ThreadingEPCServer(('localhost', 0), max_workers=8)
+    >>> server.worker_pool.stats()['workers']
+    0
+    >>> server.server_close()
+
     """
 
     def __init__(self, *args, **kwds):
         kwds.update(RequestHandlerClass=ThreadingEPCHandler)
+        self.worker_pool = ThreadPool(**dict(
+            (key, kwds.pop(key)) for key in
+            ['max_workers', 'max_queue', 'min_workers'] if key in kwds))
         EPCServer.__init__(self, *args, **kwds)
 
+    def server_close(self):
+        self.worker_pool.shutdown()
+        # `ThreadingMixIn.server_close` is defined only in Python >= 3.7
+        server_close = getattr(SocketServer.ThreadingMixIn, 'server_close',
+                               EPCServer.server_close)
+        server_close(self)
+
+
+class UnixEPCServer(EPCServer):
+
+    """
+    :class:`EPCServer` listening on a Unix domain socket.
+
+    Use this class when the client runs on the same machine.  It
+    avoids the overhead of the loopback TCP stack and does not need a
+    free port.  `server_address` is a path to the socket file, which
+    must not exist.  It is removed by :meth:`server_close`.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'epc.sock')
+    >>> server = UnixEPCServer(path)
+    >>> server.server_address == path
+    True
+    >>> server.server_close()
+    >>> os.path.exists(path)
+    False
+
+    Use :meth:`EPCClient.connect <epc.client.EPCClient.connect>` with
+    the path to connect to this server.
+
+    """
+
+    address_family = getattr(socket, 'AF_UNIX', None)
+
+
+class ThreadingUnixEPCServer(ThreadingEPCServer):
+
+    """
+    :class:`ThreadingEPCServer` listening on a Unix domain socket.
+
+    See :class:`UnixEPCServer` and :class:`ThreadingEPCServer`.
+
+    """
+
+    address_family = getattr(socket, 'AF_UNIX', None)
+
+
+class PreforkEPCServer(SocketServer.ThreadingMixIn, EPCServer):
+
+    """
+    :class:`EPCServer` running requests in pre-forked worker processes.
+
+    Registered functions are run in separated processes, so that
+    CPU-bound functions of different connections do not compete for
+    one GIL.  The listening socket is created in the supervising
+    process and :meth:`serve_forever` forks `workers` processes
+    accepting connections from it.  Each worker serves its connections
+    in threads, so that a long-lived connection does not keep other
+    connections waiting.  Workers which exit are restarted by the
+    supervisor.
+
+    >>> server = PreforkEPCServer(('localhost', 0), workers=4)
+    >>> server.register_function(abs)                #doctest: +ELLIPSIS
+    <built-in function abs>
+    >>> server.print_port()                                #doctest: +SKIP
+    9999
+    >>> server.serve_forever()                             #doctest: +SKIP
+
+    Everything done before :meth:`serve_forever` (e.g., function
+    registration) is inherited by the workers.  As workers are forked
+    from the supervisor, do not start threads before calling it.
+
+    :type    workers: int or None
+    :arg     workers: Number of worker processes.  Default is the
+                      number of CPUs.
+    :type reuse_port: bool
+    :arg  reuse_port: If true, each worker listens on its own socket
+                      bound to the same address with ``SO_REUSEPORT``,
+                      so that the kernel distributes connections
+                      evenly.  Otherwise, workers accept connections
+                      from the socket shared with the supervisor.
+
+    Other arguments are the same as :class:`EPCServer`.  This class
+    requires :func:`os.fork`.
+
+    """
+
+    daemon_threads = True
+
+    worker_shutdown_timeout = 5
+    """
+    Seconds to wait for workers to exit on :meth:`shutdown` before
+    they are killed.
+    """
+
+    def __init__(self, server_address, *args, **kwds):
+        workers = kwds.pop('workers', None)
+        if workers is None:
+            import multiprocessing
+            workers = multiprocessing.cpu_count()
+        self.workers = workers
+        self.reuse_port = kwds.pop('reuse_port', False)
+        self.worker_pids = set()
+        """
+        A set of process IDs of running workers.
+        """
+        self._shutdown_request = threading.Event()
+        self._is_shut_down = threading.Event()
+        self._is_shut_down.set()
+        EPCServer.__init__(self, server_address, *args, **kwds)
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        EPCServer.server_bind(self)
+
+    def server_activate(self):
+        # With `reuse_port`, the supervisor only reserves the address.
+        # A listening socket of the supervisor would take connections
+        # nobody accepts.
+        if not self.reuse_port:
+            EPCServer.server_activate(self)
+
+    def serve_forever(self, poll_interval=0.5):
+        """
+        Start workers and restart them when they exit, until
+        :meth:`shutdown` is called.
+        """
+        self._is_shut_down.clear()
+        try:
+            while not self._shutdown_request.is_set():
+                self._reap_workers()
+                while len(self.worker_pids) < self.workers:
+                    self._spawn_worker()
+                self._shutdown_request.wait(poll_interval)
+        finally:
+            self._stop_workers()
+            self._shutdown_request.clear()
+            self._is_shut_down.set()
+
+    def shutdown(self):
+        """
+        Stop :meth:`serve_forever` and all workers, and wait for them.
+        """
+        self._shutdown_request.set()
+        self._is_shut_down.wait()
+
+    def _spawn_worker(self):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self._serve_worker()
+                status = 0
+            except BaseException:
+                self.logger.exception('Worker %d crashed', os.getpid())
+            finally:
+                os._exit(status)
+        self.worker_pids.add(pid)
+        self.logger.debug('Worker %d is started', pid)
+
+    def _serve_worker(self):
+        self.worker_pids = set()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # supervisor stops us
+        if self.reuse_port:
+            sock = socket.socket(self.address_family, self.socket_type)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(self.server_address)
+            sock.listen(self.request_queue_size)
+            self.socket.close()
+            self.socket = sock
+        # Other workers may accept the connection first.
+        self.socket.setblocking(False)
+        EPCServer.serve_forever(self)
+
+    def _reap_workers(self):
+        for pid in list(self.worker_pids):
+            (done, status) = os.waitpid(pid, os.WNOHANG)
+            if done:
+                self.worker_pids.discard(pid)
+                if not self._shutdown_request.is_set():
+                    self.logger.warning(
+                        'Worker %d exited with status %d; restarting',
+                        pid, status)
+
+    def _stop_workers(self):
+        for pid in self.worker_pids:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.time() + self.worker_shutdown_timeout
+        while self.worker_pids and time.time() < deadline:
+            self._reap_workers()
+            time.sleep(0.01)
+        for pid in self.worker_pids:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.worker_pids.clear()
+
+
+class StdioEPCServer(EPCClientManager, EPCCore):
+
+    """
+    EPC server talking to its parent process through stdin and stdout.
+
+    There is no socket to bind and no port to print, so the server is
+    ready as soon as the process is started.  The parent process
+    writes messages to stdin of this process and reads messages from
+    its stdout.  :meth:`serve_forever` returns when stdin is closed.
+
+    ::
+
+        server = StdioEPCServer()
+
+        @server.register_function
+        def echo(*a):
+            return a
+
+        server.serve_forever()
+
+    :type     connection: :class:`epc.utils.PipeConnection`
+    :arg      connection: Pipes to talk through.  Default is to use
+                          stdin and stdout.  In that case, file
+                          descriptors 0 and 1 are redirected to
+                          ``/dev/null`` and stderr, so that output
+                          of registered functions (e.g., `print`)
+                          does not corrupt the messages.
+
+    Other arguments are the same as :class:`EPCServer`.  Use
+    :class:`ThreadingEPCHandler` as `RequestHandlerClass` to run
+    calls in a pool of worker threads.  See
+    :class:`ThreadingEPCServer` for the meaning of `max_workers`,
+    `max_queue` and `min_workers`.
+
+    """
+
+    def __init__(self, connection=None,
+                 RequestHandlerClass=EPCHandler,
+                 debugger=None, log_traceback=False,
+                 max_workers=64, max_queue=0, min_workers=0):
+        self.worker_pool = ThreadPool(max_workers=max_workers,
+                                      max_queue=max_queue,
+                                      min_workers=min_workers)
+        EPCClientManager.__init__(self)
+        EPCCore.__init__(self, debugger, log_traceback)
+        if connection is None:
+            connection = self._take_stdio()
+        self.connection = connection
+        self.RequestHandlerClass = RequestHandlerClass
+
+    @staticmethod
+    def _take_stdio():
+        sys.stdout.flush()
+        connection = PipeConnection(os.dup(0), os.dup(1))
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.close(devnull)
+        os.dup2(2, 1)
+        return connection
+
+    def serve_forever(self):
+        """
+        Handle messages until the input pipe is closed.
+        """
+        self.RequestHandlerClass(self.connection, None, self)
+
+    def server_close(self):
+        self.connection.close()
+        self.worker_pool.shutdown()
+        self.shutdown_executors()
+
+    def print_port(self, stream=sys.stdout):
+        """
+        Do nothing.  Stdio transport has no port to tell.
+        """
+
 
 def main(args=None):
     """
@@ -199,6 +527,25 @@ def main(args=None):
     parser.add_argument(
         '--port', default=0, type=int,
         help='server port. 0 means to pick up random port.')
+    parser.add_argument(
+        '--unix-socket', metavar='PATH',
+        help='listen on a Unix domain socket at PATH instead of TCP. '
+        'PATH is printed instead of the port.')
+    parser.add_argument(
+        '--workers', type=int, metavar='N',
+        help='serve in N pre-forked worker processes.')
+    parser.add_argument(
+        '--reuse-port', default=False, action='store_true',
+        help='let each worker listen with SO_REUSEPORT.  '
+        'Used with --workers.')
+    parser.add_argument(
+        '--stdio', default=False, action='store_true',
+        help='talk through stdin and stdout instead of listening on '
+        'a socket.  Nothing is printed on startup.')
+    parser.add_argument(
+        '--metrics-port', type=int, metavar='PORT',
+        help='serve per-method metrics in the Prometheus text format '
+        'over HTTP at PORT of --address.')
     parser.add_argument(
         '--allow-dotted-names', default=False, action='store_true')
     parser.add_argument(
@@ -210,15 +557,44 @@ def main(args=None):
     parser.add_argument(
         '--log-traceback', action='store_true', default=False)
     ns = parser.parse_args(args)
-
-    server = EPCServer((ns.address, ns.port),
-                       debugger=ns.debugger,
-                       log_traceback=ns.log_traceback)
+    if ns.metrics_port is not None and ns.workers:
+        parser.error('--metrics-port cannot be used with --workers')
+    if ns.stdio and (ns.workers or ns.unix_socket):
+        parser.error('--stdio cannot be used with --workers or '
+                     '--unix-socket')
+    if ns.workers and ns.unix_socket:
+        parser.error('--workers cannot be used with --unix-socket')
+    if ns.reuse_port and not ns.workers:
+        parser.error('--reuse-port must be used with --workers')
+
+    if ns.stdio:
+        server = StdioEPCServer(debugger=ns.debugger,
+                                log_traceback=ns.log_traceback)
+    elif ns.workers:
+        server = PreforkEPCServer((ns.address, ns.port),
+                                  workers=ns.workers,
+                                  reuse_port=ns.reuse_port,
+                                  debugger=ns.debugger,
+                                  log_traceback=ns.log_traceback)
+    elif ns.unix_socket:
+        server = UnixEPCServer(ns.unix_socket,
+                               debugger=ns.debugger,
+                               log_traceback=ns.log_traceback)
+    else:
+        server = EPCServer((ns.address, ns.port),
+                           debugger=ns.debugger,
+                           log_traceback=ns.log_traceback)
     server.register_instance(
         __import__(ns.module),
         allow_dotted_names=ns.allow_dotted_names)
+    if ns.metrics_port is not None:
+        from .metrics import start_http_server
+        start_http_server(server.metrics, (ns.address, ns.metrics_port))
     server.print_port()
-    server.serve_forever()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,171 @@
+# Copyright (C) 2012-  Takafumi Arakaki
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import sys
+import threading
+import unittest
+
+if sys.version_info < (3, 7):
+    raise unittest.SkipTest('epc.aio requires Python 3.7 or later')
+
+import asyncio
+from ..aio import AsyncEPCServer, AsyncEPCClient
+
+from ..client import EPCClient
+from ..handler import ReturnError, encode_message
+from ..hooks import EVENTS
+from ..utils import newthread
+from .utils import BaseTestCase, logging_to_stdout
+
+
+class BaseAsyncTestCase(BaseTestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = newthread(self, target=self.loop.run_forever)
+        self.loop_thread.daemon = True
+        self.loop_thread.start()
+
+        self.server = AsyncEPCServer(('localhost', 0))
+        self.run_async(self.server.start())
+
+        @self.server.register_function
+        def echo(*a):
+            """Return argument unchanged."""
+            return a
+
+        @self.server.register_function
+        def echo_later(*a):
+            return asyncio.sleep(0.01, result=a)
+
+        @self.server.register_function
+        def bad_method(*_):
+            raise ValueError("This is a bad method!")
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join(self.timeout)
+        self.loop.close()
+
+    def run_async(self, coro):
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return future.result(self.timeout)
+
+
+class TestAsyncPy2Py(BaseAsyncTestCase):
+
+    def setUp(self):
+        super(TestAsyncPy2Py, self).setUp()
+        self.client = AsyncEPCClient()
+        self.run_async(self.client.connect(self.server.server_address))
+
+        @self.client.register_function
+        def pong(x):
+            return ['pong', x]
+
+    def tearDown(self):
+        self.run_async(self.client.close())
+        super(TestAsyncPy2Py, self).tearDown()
+
+    def test_echo(self):
+        self.assertEqual(self.run_async(self.client.call('echo', [55])),
+                         [55])
+
+    def test_awaitable_method(self):
+        self.assertEqual(
+            self.run_async(self.client.call('echo_later', [1, 2])), [1, 2])
+
+    def test_metrics_of_awaitable_method(self):
+        self.run_async(self.client.call('echo_later', [1]))
+        stats = self.server.metrics.snapshot()['echo_later']
+        self.assertEqual((stats['calls'], stats['in_flight']), (1, 0))
+        self.assertGreaterEqual(stats['exec_time']['sum'], 0.005)
+        self.assertEqual(stats['response_bytes'],
+                         len(encode_message('return', 1, [1])))
+
+    def test_hooks(self):
+        events = []
+
+        def recorder(event):
+            return lambda *_: events.append(event)
+
+        for event in EVENTS:
+            self.server.hooks.add(event, recorder(event))
+        self.run_async(self.client.call('echo', [1]))
+        self.assertEqual(sorted(events), sorted(EVENTS))
+
+    def test_concurrent_calls(self):
+        futures = [
+            asyncio.run_coroutine_threadsafe(
+                self.client.call('echo_later', [i]), self.loop)
+            for i in range(50)]
+        got = [f.result(self.timeout) for f in futures]
+        self.assertEqual(got, [[i] for i in range(50)])
+
+    def test_bad_method(self):
+        with logging_to_stdout(self.server.logger):
+            self.assertRaises(ReturnError, self.run_async,
+                              self.client.call('bad_method', []))
+
+    def test_methods(self):
+        methods = self.run_async(self.client.methods())
+        self.assertEqual(set(m[0].value() for m in methods),
+                         set(['echo', 'echo_later', 'bad_method']))
+
+    def test_cancel_on_timeout(self):
+        # No coroutine syntax in this module: it must compile on
+        # Python versions where it is skipped.
+        stopped = threading.Event()
+
+        @self.server.register_function
+        def sleep_long():
+            task = asyncio.ensure_future(asyncio.sleep(self.timeout))
+            task.add_done_callback(
+                lambda task: task.cancelled() and stopped.set())
+            return task
+
+        self.client.handler.send_cancel = True
+        self.assertRaises(
+            asyncio.TimeoutError, self.run_async,
+            asyncio.wait_for(self.client.call('sleep_long', []), 0.05))
+        self.assertTrue(stopped.wait(self.timeout))
+        self.assertEqual(len(self.client.handler.callmanager.callbacks), 0)
+
+    def test_server_calls_client(self):
+        handler = self.server.clients[0]
+        self.assertEqual(self.run_async(handler.call('pong', [1])),
+                         ['pong', 1])
+
+
+class TestAsyncServerThreadingClient(BaseAsyncTestCase):
+
+    def setUp(self):
+        super(TestAsyncServerThreadingClient, self).setUp()
+        self.client = EPCClient(self.server.server_address)
+
+    def tearDown(self):
+        self.client.close()
+        super(TestAsyncServerThreadingClient, self).tearDown()
+
+    def test_echo(self):
+        self.assertEqual(
+            self.client.call_sync('echo', [55], timeout=self.timeout), [55])
+
+    def test_awaitable_method(self):
+        self.assertEqual(
+            self.client.call_sync('echo_later', [55], timeout=self.timeout),
+            [55])
@@ -0,0 +1,83 @@
+# Copyright (C) 2012-  Takafumi Arakaki
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+
+from .. import bench
+from .utils import BaseTestCase, CaptureStdIO, unittest
+
+
+class TestBench(BaseTestCase):
+
+    def check_measure(self, server_name):
+        result = bench.measure(server_name, 'ints', 10, 2, 0.05)
+        self.assertEqual(bench.result_key(result),
+                         (server_name, 'ints', 10, 2))
+        self.assertGreater(result['calls'], 0)
+        self.assertLessEqual(result['p50_us'], result['p99_us'])
+
+    def test_measure_epc_server(self):
+        # Two threads share one connection.
+        self.check_measure('EPCServer')
+
+    def test_measure_threading_epc_server(self):
+        self.check_measure('ThreadingEPCServer')
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'needs AF_UNIX')
+    def test_measure_unix_epc_server(self):
+        self.check_measure('UnixEPCServer')
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'needs Python 3.7')
+    def test_measure_async_epc_server(self):
+        self.check_measure('AsyncEPCServer')
+
+    def test_percentile(self):
+        self.assertEqual(bench.percentile([1, 2, 3, 4], 50), 2)
+        self.assertEqual(bench.percentile([1, 2, 3, 4], 75), 3)
+        self.assertEqual(bench.percentile([1, 2, 3, 4], 0), 1)
+        self.assertEqual(bench.percentile([1, 2, 3, 4], 100), 4)
+
+    def test_payloads(self):
+        for shape in bench.PAYLOADS:
+            self.assertTrue(bench.make_payload(shape, 100))
+        self.assertRaises(ValueError, bench.make_payload, 'no-such', 1)
+
+    def test_main_json_and_baseline(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        path = os.path.join(tempdir, 'result.json')
+        args = ['--servers', 'ThreadingEPCServer', '--payloads', 'string',
+                '--sizes', '10', '--concurrency', '1', '--duration', '0.05']
+        with CaptureStdIO():
+            bench.main(args + ['--json', path])
+        with open(path) as file:
+            results = json.load(file)['results']
+        self.assertEqual([bench.result_key(r) for r in results],
+                         [('ThreadingEPCServer', 'string', 10, 1)])
+
+        # Pretend that the baseline was much faster.
+        for result in results:
+            result['throughput'] *= 100
+        with open(path, 'w') as file:
+            json.dump(dict(results=results), file)
+        with CaptureStdIO() as stdio:
+            self.assertRaises(SystemExit, bench.main,
+                              args + ['--baseline', path])
+        self.assertIn('REGRESSION', stdio.read_stdout())
@@ -0,0 +1,179 @@
+# Copyright (C) 2012-  Takafumi Arakaki
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import tempfile
+
+from ..cache import LRU, PersistentCache
+from ..core import EPCCore
+from .utils import BaseTestCase, mockedattr
+from .. import cache as cachemodule
+from .. import core as coremodule
+
+
+class TestLRU(BaseTestCase):
+
+    def test_lru_order(self):
+        cache = LRU(maxsize=2)
+        cache.set('f', b'1', b'a')
+        cache.set('f', b'2', b'b')
+        self.assertEqual(cache.get('f', b'1'), b'a')  # 1 is recent now
+        cache.set('f', b'3', b'c')
+        self.assertIsNone(cache.get('f', b'2'))
+        self.assertEqual(cache.get('f', b'1'), b'a')
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_ttl(self):
+        now = [100.0]
+        with mockedattr(cachemodule, '_clock', lambda: now[0]):
+            cache = LRU(ttl=10)
+            cache.set('f', b'1', b'a')
+            now[0] += 5
+            self.assertEqual(cache.get('f', b'1'), b'a')
+            now[0] += 5
+            self.assertIsNone(cache.get('f', b'1'))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['expired'],
+                          stats['size']), (1, 1, 1, 0))
+
+    def test_names_are_separated(self):
+        cache = LRU()
+        cache.set('f', b'1', b'a')
+        cache.set('g', b'1', b'b')
+        self.assertEqual(cache.get('f', b'1'), b'a')
+        self.assertEqual(cache.get('g', b'1'), b'b')
+
+    def test_invalidate(self):
+        cache = LRU()
+        for name in 'fg':
+            for key in [b'1', b'2']:
+                cache.set(name, key, b'x')
+        self.assertEqual(cache.invalidate('f', b'1'), 1)
+        self.assertEqual(cache.invalidate('f', b'1'), 0)
+        self.assertEqual(cache.invalidate('f'), 1)
+        self.assertEqual(cache.invalidate(), 2)
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_cached_function_without_futures(self):
+        core = EPCCore(debugger=None, log_traceback=False)
+        core.register_function(abs, cache=LRU())
+        with mockedattr(coremodule, 'futures', None):
+            for _ in range(2):
+                self.assertEqual(
+                    bytes(core.call_function('abs', abs, [-1])), b'1')
+
+    def test_unlimited(self):
+        cache = LRU(maxsize=None)
+        for i in range(1000):
+            cache.set('f', str(i).encode(), b'x')
+        self.assertEqual(cache.stats()['size'], 1000)
+
+
+class TestPersistentCache(BaseTestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'cache.sqlite')
+        self.now = [1000.0]
+        self.clock = mockedattr(cachemodule, '_wallclock',
+                                lambda: self.now[0])
+        self.clock.__enter__()
+
+    def tearDown(self):
+        self.clock.__exit__(None, None, None)
+        shutil.rmtree(self.tempdir)
+
+    def open(self, **kwds):
+        cache = PersistentCache(self.path, **kwds)
+        self.addCleanup(cache.close)
+        return cache
+
+    def tick(self):
+        self.now[0] += 1
+
+    def test_survives_reopen(self):
+        cache = self.open(version='1')
+        cache.set('f', b'(1)', b'a')
+        cache.close()
+        self.assertEqual(self.open(version='1').get('f', b'(1)'), b'a')
+
+    def test_version_change_drops_entries(self):
+        cache = self.open(version='1')
+        cache.set('f', b'(1)', b'a')
+        cache.close()
+        cache = self.open(version='2')
+        self.assertIsNone(cache.get('f', b'(1)'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_lru_order(self):
+        cache = self.open(maxsize=2)
+        cache.set('f', b'1', b'a')
+        self.tick()
+        cache.set('f', b'2', b'b')
+        self.tick()
+        self.assertEqual(cache.get('f', b'1'), b'a')  # 1 is recent now
+        self.tick()
+        cache.set('f', b'3', b'c')
+        self.assertIsNone(cache.get('f', b'2'))
+        self.assertEqual(cache.get('f', b'1'), b'a')
+        stats = cache.stats()
+        self.assertEqual((stats['evictions'], stats['size']), (1, 2))
+
+    def test_evict_batch(self):
+        cache = self.open(maxsize=10)
+        for i in range(11):
+            self.tick()
+            cache.set('f', str(i).encode(), b'x')
+        stats = cache.stats()
+        self.assertEqual((stats['evictions'], stats['size']), (2, 9))
+        self.assertIsNone(cache.get('f', b'1'))
+        self.assertEqual(cache.get('f', b'2'), b'x')
+
+    def test_set_does_not_count_entries_until_full(self):
+        cache = self.open(maxsize=10)
+        cache.set('f', b'0', b'x')
+        if not hasattr(cache._db, 'set_trace_callback'):
+            self.skipTest('needs sqlite3 trace callback (Python 3.3)')
+        statements = []
+        cache._db.set_trace_callback(lambda sql: statements.append(sql))
+        for i in range(1, 10):
+            cache.set('f', str(i).encode(), b'x')
+        self.assertFalse([sql for sql in statements if 'COUNT' in sql])
+        cache.set('f', b'10', b'x')
+        self.assertTrue([sql for sql in statements if 'COUNT' in sql])
+
+    def test_ttl(self):
+        cache = self.open(ttl=10)
+        cache.set('f', b'1', b'a')
+        self.now[0] += 5
+        self.assertEqual(cache.get('f', b'1'), b'a')
+        self.now[0] += 5
+        self.assertIsNone(cache.get('f', b'1'))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['expired'],
+                          stats['size']), (1, 1, 1, 0))
+
+    def test_invalidate(self):
+        cache = self.open()
+        for name in 'fg':
+            for key in [b'1', b'2']:
+                cache.set(name, key, b'x')
+        self.assertEqual(cache.invalidate('f', b'1'), 1)
+        self.assertEqual(cache.invalidate('f', b'1'), 0)
+        self.assertEqual(cache.invalidate('f'), 1)
+        self.assertEqual(cache.invalidate(), 2)
+        self.assertEqual(cache.stats()['size'], 0)
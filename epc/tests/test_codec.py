@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012-  Takafumi Arakaki
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from collections import namedtuple
+
+from sexpdata import loads, dumps, Symbol, String, Quoted, \
+    ExpectClosingBracket
+
+from ..codec import IncrementalDecoder, encode_frame, encode_frame_buffers
+from ..handler import encode_string, encode_message, iterrecv, \
+    unpack_message
+from ..py3compat import utf8
+from .utils import BaseTestCase
+
+
+class TestIncrementalDecoder(BaseTestCase):
+
+    def decode(self, data, chunksize):
+        decoder = IncrementalDecoder()
+        for i in range(0, len(data), chunksize):
+            decoder.feed(memoryview(bytearray(data[i:i + chunksize])))
+        return decoder.close()
+
+    def check_same_as_loads(self, string):
+        desired = repr(loads(string))
+        data = string.encode('utf-8')
+        for chunksize in range(1, len(data) + 1):
+            self.assertEqual(repr(self.decode(data, chunksize)), desired)
+
+    def test_message(self):
+        self.check_same_as_loads('(call 1 echo ("abc" 2 -3.5 nil t))')
+
+    def test_string_escape(self):
+        self.check_same_as_loads(r'("x\"y\\z\n\q" "")')
+
+    def test_unicode(self):
+        self.check_same_as_loads(utf8('("日本語能力!!ソﾊﾝｶｸ" 日本)'))
+
+    def test_symbol_escape(self):
+        self.check_same_as_loads(r'(a\ b c\(d)')
+
+    def test_quote_and_brackets(self):
+        self.check_same_as_loads("(a 'b '(c [1 2]) ''e)")
+
+    def test_comment(self):
+        self.check_same_as_loads('(a ; comment\n b)')
+
+    def test_atom(self):
+        self.check_same_as_loads('"just a string"')
+        self.check_same_as_loads(' symbol ')
+
+    def test_not_enough_closing_brackets(self):
+        self.assertRaises(ExpectClosingBracket,
+                          self.decode, b'(((invalid sexp!', 3)
+
+    def test_more_than_one_sexp(self):
+        self.assertRaises(ValueError, self.decode, b'(a) (b)', 3)
+
+
+class TestEncodeFrame(BaseTestCase):
+
+    def check_same_as_dumps(self, obj):
+        self.assertEqual(bytes(encode_frame(obj)),
+                         encode_string(dumps(obj)))
+
+    def test_atoms(self):
+        for obj in [1, -5, 2 ** 70, 1.5, 0.1 + 0.2, float('inf'), True, False,
+                    None]:
+            self.check_same_as_dumps(obj)
+
+    def test_strings(self):
+        self.check_same_as_dumps('abc')
+        self.check_same_as_dumps('a"b\\c\nd\te\b\f\r')
+        self.check_same_as_dumps(utf8('日本語能力!!ソﾊﾝｶｸ'))
+        self.check_same_as_dumps(String('s"'))
+
+    def test_symbols(self):
+        self.check_same_as_dumps(Symbol('return'))
+        self.check_same_as_dumps(Symbol('a b(c)'))
+
+    def test_containers(self):
+        self.check_same_as_dumps([])
+        self.check_same_as_dumps(())
+        self.check_same_as_dumps({})
+        self.check_same_as_dumps([1, [2, (3, 'x')], None])
+        self.check_same_as_dumps({'a': 1, 'b c': [None, {'d': 'e'}]})
+
+    def test_fallback_to_sexpdata(self):
+        self.check_same_as_dumps([Quoted(Symbol('a'))])
+        self.check_same_as_dumps([namedtuple('P', 'x y')(1, 2)])
+
+    def test_bytes(self):
+        self.assertEqual(bytes(encode_frame([utf8('日本').encode('utf-8')])),
+                         encode_string(utf8('("日本")')))
+
+
+class TestEncodeFrameBuffers(BaseTestCase):
+
+    def check_same_as_encode_frame(self, obj, threshold):
+        buffers = encode_frame_buffers(obj, threshold)
+        self.assertEqual(b''.join(bytes(b) for b in buffers),
+                         bytes(encode_frame(obj)))
+        return buffers
+
+    def test_no_large_string(self):
+        buffers = self.check_same_as_encode_frame(['abc', 1], 100)
+        self.assertEqual(len(buffers), 1)
+
+    def test_large_strings(self):
+        obj = ['x' * 100, ['y' * 100, 'z'], utf8('日本').encode('utf-8') * 50]
+        buffers = self.check_same_as_encode_frame(obj, 100)
+        self.assertEqual(len(buffers), 7)
+
+    def test_large_string_needs_quote(self):
+        self.check_same_as_encode_frame(['"' * 100], 10)
+
+
+class TestIterRecv(BaseTestCase):
+
+    def make_recv_into(self, data, sizes):
+        chunks = []
+        for size in sizes:
+            (chunk, data) = (data[:size], data[size:])
+            chunks.append(chunk)
+        chunks.append(data)
+
+        def recv_into(buffer):
+            chunk = chunks.pop(0) if chunks else b''
+            (chunk, rest) = (chunk[:len(buffer)], chunk[len(buffer):])
+            if rest:
+                chunks.insert(0, rest)
+            buffer[:len(chunk)] = chunk
+            return len(chunk)
+        return recv_into
+
+    def check_messages(self, messages, sizes, bufsize=16):
+        data = b''.join(encode_message(*m) for m in messages)
+        got = [unpack_message(decoder) for decoder in
+               iterrecv(self.make_recv_into(data, sizes), bufsize)]
+        self.assertEqual(
+            [(name, uid, args) for (name, uid, args) in got],
+            [(m[0], m[1], list(m[2:])) for m in messages])
+
+    def test_many_messages_in_one_read(self):
+        self.check_messages([('return', i, i) for i in range(5)], [1000],
+                            bufsize=1000)
+
+    def test_split_header(self):
+        self.check_messages([('return', 1, 'a'), ('return', 2, 'b')],
+                            [3, 12, 4, 2])
+
+    def test_message_larger_than_buffer(self):
+        self.check_messages([('return', 1, 'x' * 100), ('return', 2, [])],
+                            [16] * 20)
+
+    def test_truncated_message(self):
+        data = bytes(encode_message('return', 1, 'abc'))[:-2]
+        recv_into = self.make_recv_into(data, [])
+        self.assertRaises(ValueError, list, iterrecv(recv_into))
@@ -14,8 +14,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from sexpdata import loads
+
+from .. import py3compat
 from ..core import EPCDispatcher
-from .utils import BaseTestCase
+from .utils import BaseTestCase, mockedattr
 
 
 class Dummy(object):
@@ -56,3 +59,87 @@ class TestEPCDispatcher(BaseTestCase):
         self.dispatcher.register_instance(obj)
         self.assertIs(self.dispatcher.get_method('x'), always_me)
         self.assertIs(self.dispatcher.get_method('y'), always_me)
+
+    def test_resolved_method_is_cached(self):
+        obj = Dummy()
+        obj.sub = Dummy()
+        obj.sub.f = lambda: 1
+        self.dispatcher.register_instance(obj, allow_dotted_names=True)
+        f = self.dispatcher.get_method('sub.f')
+        obj.sub.f = lambda: 2
+        self.assertIs(self.dispatcher.get_method('sub.f'), f)
+        self.dispatcher.invalidate_methods()
+        self.assertIs(self.dispatcher.get_method('sub.f'), obj.sub.f)
+
+    def test_register_function_invalidates_methods(self):
+        obj = Dummy()
+        obj.f = lambda: 1
+        self.dispatcher.register_instance(obj)
+        self.dispatcher.get_method('f')
+        obj.f = lambda: 2
+        self.dispatcher.register_function(len, 'g')
+        self.assertIs(self.dispatcher.get_method('f'), obj.f)
+
+    def test_missing_method_is_not_cached(self):
+        obj = Dummy()
+        self.dispatcher.register_instance(obj)
+        self.assertRaises(AttributeError, self.dispatcher.get_method, 'f')
+        obj.f = lambda: None
+        self.assertIs(self.dispatcher.get_method('f'), obj.f)
+
+    def test_register_function_with_options(self):
+        @self.dispatcher.register_function(name='g', executor='process')
+        def f():
+            pass
+        self.assertIs(self.dispatcher.get_method('g'), f)
+        self.assertEqual(self.dispatcher.func_options['g'],
+                         {'executor': 'process'})
+
+    def test_register_function_unknown_option(self):
+        self.assertRaises(TypeError, self.dispatcher.register_function,
+                          len, no_such_option=True)
+
+    def test_process_executor_without_futures(self):
+        with mockedattr(py3compat, 'futures', None):
+            self.assertRaises(RuntimeError, self.dispatcher.register_function,
+                              len, executor='process')
+
+    def test_single_flight_without_futures(self):
+        with mockedattr(py3compat, 'futures', None):
+            self.assertRaises(RuntimeError, self.dispatcher.register_function,
+                              len, single_flight=True)
+
+    def methods_info(self):
+        info = loads(self.dispatcher.get_methods_info().decode('utf-8'))
+        return dict((m[0].value(), tuple(m[1:])) for m in info)
+
+    def test_methods_info(self):
+        def f(a, b=1, *args):
+            """Doc of f."""
+        self.dispatcher.register_function(f)
+        self.dispatcher.register_function(len, 'g')
+        info = self.methods_info()
+        self.assertEqual(info['f'], ('(a, b=1, *args)', 'Doc of f.'))
+        self.assertEqual(info['g'][1], len.__doc__)
+
+    def test_methods_info_of_instance(self):
+        obj = Dummy()
+        obj.f = lambda x: None
+        obj._private = lambda: None
+        self.dispatcher.register_instance(obj)
+        self.assertEqual(self.methods_info(), {'f': ('(x)', '')})
+
+    def test_methods_info_of_instance_with_list_methods(self):
+        obj = Dummy()
+        obj.f = lambda: None
+        obj._listMethods = lambda: ['f', 'no_such_method']
+        obj._get_method = lambda name: getattr(obj, name)
+        self.dispatcher.register_instance(obj)
+        self.assertEqual(list(self.methods_info()), ['f'])
+
+    def test_methods_info_is_cached(self):
+        self.dispatcher.register_function(len)
+        info = self.dispatcher.get_methods_info()
+        self.assertIs(self.dispatcher.get_methods_info(), info)
+        self.dispatcher.register_function(abs)
+        self.assertEqual(set(self.methods_info()), set(['len', 'abs']))
@@ -0,0 +1,58 @@
+# Copyright (C) 2012-  Takafumi Arakaki
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from ..hooks import Hooks, TimedDecoder
+from .utils import BaseTestCase, logging_to_stdout
+
+
+class TestHooks(BaseTestCase):
+
+    def test_add_and_remove(self):
+        hooks = Hooks()
+        calls = []
+        first = hooks.add('dispatch_start', lambda *a: calls.append(1))
+        hooks.add('dispatch_start', lambda *a: calls.append(2))
+        hooks.fire('dispatch_start', 'handler', 'call', 1, [])
+        hooks.remove('dispatch_start', first)
+        hooks.fire('dispatch_start', 'handler', 'call', 1, [])
+        self.assertEqual(calls, [1, 2, 2])
+
+    def test_unknown_event(self):
+        hooks = Hooks()
+        self.assertRaises(ValueError, hooks.add, 'no_such_event', len)
+
+    def test_error_in_callback_is_ignored(self):
+        hooks = Hooks()
+        calls = []
+
+        def bad(*_):
+            raise ValueError
+
+        hooks.add('frame_written', bad)
+        hooks.add('frame_written', lambda *a: calls.append(a))
+        with logging_to_stdout(hooks.logger):
+            hooks.fire('frame_written', 'handler', 1)
+        self.assertEqual(calls, [('handler', 1)])
+
+
+class TestTimedDecoder(BaseTestCase):
+
+    def test_decode(self):
+        decoder = TimedDecoder()
+        decoder.feed(b'(return 1 ')
+        decoder.feed(b'"a")')
+        self.assertEqual(decoder.close()[2], 'a')
+        self.assertEqual(decoder.nbytes, 14)
+        self.assertGreater(decoder.elapsed, 0)
@@ -0,0 +1,91 @@
+# Copyright (C) 2012-  Takafumi Arakaki
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from ..metrics import Histogram, Metrics, start_http_server
+from ..py3compat import PY3
+from .utils import BaseTestCase, mockedattr
+from .. import metrics as metricsmodule
+
+if PY3:
+    from urllib.request import urlopen
+else:
+    from urllib2 import urlopen
+
+
+class TestHistogram(BaseTestCase):
+
+    def test_bounds_are_inclusive(self):
+        h = Histogram(bounds=[1, 2])
+        for value in [1, 2, 2.5]:
+            h.observe(value)
+        self.assertEqual(h.snapshot()['counts'], [1, 1, 1])
+
+
+class TestMetrics(BaseTestCase):
+
+    def setUp(self):
+        self.now = [10.0]
+        self.clock = mockedattr(metricsmodule, 'clock', lambda: self.now[0])
+        self.clock.__enter__()
+        self.metrics = Metrics()
+
+    def tearDown(self):
+        self.clock.__exit__(None, None, None)
+
+    def test_call(self):
+        started = self.metrics.start('f', received=9.0, nbytes=30)
+        self.assertEqual(self.metrics.snapshot()['f']['in_flight'], 1)
+        self.now[0] += 0.25
+        self.metrics.finish('f', started, nbytes=12)
+        stats = self.metrics.snapshot()['f']
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(stats['queue_wait']['sum'], 1.0)
+        self.assertEqual(stats['exec_time']['sum'], 0.25)
+        self.assertEqual((stats['request_bytes'], stats['response_bytes']),
+                         (30, 12))
+
+    def test_error(self):
+        self.metrics.finish('f', self.metrics.start('f'), error=True)
+        self.metrics.finish('f', self.metrics.start('f'))
+        stats = self.metrics.snapshot()['f']
+        self.assertEqual((stats['calls'], stats['errors']), (2, 1))
+        self.assertEqual(stats['queue_wait']['count'], 0)
+
+    def test_reset(self):
+        self.metrics.finish('f', self.metrics.start('f'))
+        self.metrics.reset()
+        self.assertEqual(self.metrics.snapshot(), {})
+
+    def test_prometheus_text(self):
+        self.metrics.finish('say "hi"', self.metrics.start('say "hi"'))
+        text = self.metrics.prometheus_text()
+        self.assertIn('epc_calls_total{method="say \\"hi\\""} 1\n', text)
+        self.assertIn('epc_exec_time_seconds_bucket'
+                      '{method="say \\"hi\\"",le="0.0001"} 1\n', text)
+
+    def test_http_server(self):
+        self.metrics.finish('f', self.metrics.start('f'))
+        server = start_http_server(self.metrics)
+        try:
+            url = 'http://{0}:{1}/metrics'.format(*server.server_address)
+            response = urlopen(url, timeout=self.timeout)
+            try:
+                body = response.read().decode('utf-8')
+            finally:
+                response.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(body, self.metrics.prometheus_text())
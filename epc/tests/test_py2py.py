@@ -15,14 +15,27 @@
 
 
 import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
 import nose
 
 from ..client import EPCClient
-from ..server import ThreadingEPCServer
-from ..handler import ReturnError
-from ..utils import newthread, callwith
-from ..py3compat import Queue
-from .utils import BaseTestCase, logging_to_stdout
+from ..server import ThreadingEPCServer, ThreadingUnixEPCServer, \
+    StdioEPCServer
+from .. import handler as handlermodule
+from .. import py3compat
+from ..handler import ThreadingEPCHandler
+from ..handler import ReturnError, EPCTimeout, call_cancelled, \
+    gather, as_completed, encode_message
+from ..utils import newthread, callwith, PipeConnection
+from ..cache import LRU, PersistentCache
+from ..hooks import EVENTS
+from ..py3compat import Queue, futures
+from .utils import BaseTestCase, logging_to_stdout, mockedattr, unittest, \
+    needs_futures
 
 
 def next_fib(x, fib):
@@ -35,6 +48,14 @@ def fib(x):
     return next_fib(x, fib)
 
 
+def bad_method(*_):
+    raise ValueError("This is a bad method!")
+
+
+def fib_batch(batch):
+    return [fib(x) for (x,) in batch]
+
+
 class ThreadingPy2Py(object):
 
     """
@@ -203,3 +224,483 @@ class TestEPCPy2Py(ThreadingPy2Py, BaseTestCase):
 
     def test_server_fib(self):
         self.check_fib(self.assert_server_return, 'fib_client')
+
+    @needs_futures
+    def test_client_call_future(self):
+        fs = [self.client.call_future('echo', [i]) for i in range(50)]
+        self.assertEqual(gather(fs, timeout=self.timeout),
+                         [[i] for i in range(50)])
+
+    @needs_futures
+    def test_server_call_future(self):
+        self.wait_until_client_is_connected()
+        handler = self.server.clients[0]
+        fs = [handler.call_future('echo', [i]) for i in range(50)]
+        self.assertEqual(
+            sorted(f.result() for f in as_completed(fs, self.timeout)),
+            [[i] for i in range(50)])
+
+    @needs_futures
+    def test_call_future_error(self):
+        cm = logging_to_stdout(self.server.logger)
+        fs = [self.client.call_future('echo', [1]),
+              self.client.call_future('bad_method', [2])]
+        with cm:
+            results = gather(fs, self.timeout, return_exceptions=True)
+        self.assertEqual(results[0], [1])
+        self.assertIsInstance(results[1], ReturnError)
+        self.assertRaises(ReturnError, gather, fs, self.timeout)
+
+    def test_call_future_without_futures(self):
+        with mockedattr(py3compat, 'futures', None):
+            self.assertRaises(RuntimeError, self.client.call_future,
+                              'echo', [1])
+            self.assertRaises(RuntimeError, gather, [])
+
+    def test_client_call_many(self):
+        calls = [('echo', [i]) for i in range(500)]
+        self.assertEqual(self.client.call_many(calls, self.timeout),
+                         [[i] for i in range(500)])
+
+    def test_server_call_many(self):
+        self.wait_until_client_is_connected()
+        calls = [('echo', [i]) for i in range(500)]
+        self.assertEqual(
+            self.server.clients[0].call_many(calls, self.timeout),
+            [[i] for i in range(500)])
+
+    def test_call_many_error(self):
+        cm = logging_to_stdout(self.server.logger)
+        calls = [('echo', [1]), ('bad_method', [2]), ('echo', [3])]
+        with cm:
+            results = self.client.call_many(calls, self.timeout)
+        self.assertEqual(results[0], [1])
+        self.assertIsInstance(results[1], ReturnError)
+        self.assertEqual(results[2], [3])
+
+    def test_call_many_empty(self):
+        self.assertEqual(self.client.call_many([]), [])
+
+    @needs_futures
+    def test_methods_future(self):
+        methods = self.client.methods_future().result(self.timeout)
+        self.assertIn('echo', [m[0].value() for m in methods])
+
+    def test_hooks(self):
+        events = Queue.Queue()
+
+        def recorder(core, event):
+            return lambda handler, *args: events.put((core, event, args))
+
+        for core in [self.server, self.client]:
+            for event in EVENTS:
+                core.hooks.add(event, recorder(core, event))
+        self.client.call_sync('echo', [1], timeout=self.timeout)
+        got = []
+        while len(got) < 10:
+            got.append(events.get(timeout=self.timeout))
+        server = [(e, a) for (c, e, a) in got if c is self.server]
+        client = [(e, a) for (c, e, a) in got if c is self.client]
+        self.assertEqual(
+            sorted(e for (e, _) in server),
+            ['dispatch_end', 'dispatch_start', 'frame_encoded',
+             'frame_received', 'frame_written'])
+        self.assertEqual(
+            sorted(e for (e, _) in client),
+            ['dispatch_end', 'dispatch_start', 'frame_encoded',
+             'frame_received', 'frame_written'])
+        server = dict(server)
+        self.assertEqual(server['dispatch_start'][0], 'call')
+        self.assertIsNone(server['dispatch_end'][2])
+        self.assertEqual(server['frame_encoded'][0], 'return')
+        self.assertEqual(server['frame_encoded'][2],
+                         server['frame_written'][0])
+
+    def test_epc_stats(self):
+        self.client.call_sync('echo', ['x' * 100], timeout=self.timeout)
+        with logging_to_stdout(self.server.logger):
+            self.assertRaises(ReturnError, self.client.call_sync,
+                              'bad_method', [], timeout=self.timeout)
+        stats = self.client.call_sync('epc-stats', [], timeout=self.timeout)
+        stats = dict((k.value(), v) for (k, v) in zip(*[iter(stats)] * 2))
+        self.assertEqual(set(stats),
+                         set([':echo', ':bad_method', ':epc-stats']))
+        echo = dict((k.value(), v)
+                    for (k, v) in zip(*[iter(stats[':echo'])] * 2))
+        self.assertEqual((echo[':calls'], echo[':errors']), (1, 0))
+        self.assertGreater(echo[':request_bytes'], 100)
+        self.assertGreater(echo[':response_bytes'], 100)
+        self.assertEqual(
+            self.server.metrics.snapshot()['bad_method']['errors'], 1)
+
+    def test_metrics_keep_large_reply_zero_copy(self):
+        self.wait_until_client_is_connected()
+        if not hasattr(self.server.clients[0].connection, 'sendmsg'):
+            self.skipTest('needs sendmsg')
+        written = []
+        original = handlermodule.sendmsg_all
+
+        def sendmsg_all(sock, buffers):
+            written.append(sum(map(len, buffers)))
+            return original(sock, buffers)
+
+        data = 'x' * (1 << 20)
+        with mockedattr(handlermodule, 'sendmsg_all', sendmsg_all):
+            self.assert_client_return('echo', [data], [data])
+        stats = self.server.metrics.snapshot()['echo']
+        self.assertIn(stats['response_bytes'], written)
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'AF_UNIX is not available')
+class TestEPCPy2PyUnix(TestEPCPy2Py):
+
+    def setup_connection(self, **kwds):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        path = os.path.join(self.tempdir, 'epc.sock')
+        self.server = ThreadingUnixEPCServer(path, **kwds)
+        self.server.daemon_threads = True
+        self.server_thread = newthread(self, target=self.server.serve_forever)
+        self.server_thread.start()
+
+        self.client_queue = q = Queue.Queue()
+        self.server.handle_client_connect = q.put
+
+        self.client = EPCClient(path, **kwds)
+
+    def test_socket_file_is_removed(self):
+        path = self.server.server_address
+        self.assertTrue(os.path.exists(path))
+        self.teardown_connection()
+        self.assertFalse(os.path.exists(path))
+        self.teardown_connection = lambda: None
+
+
+class TestEPCPy2PyPipe(TestEPCPy2Py):
+
+    def setup_connection(self, **kwds):
+        (server_read, client_write) = os.pipe()
+        (client_read, server_write) = os.pipe()
+        self.server = StdioEPCServer(
+            PipeConnection(server_read, server_write),
+            RequestHandlerClass=ThreadingEPCHandler, **kwds)
+        self.server_thread = newthread(self, target=self.server.serve_forever)
+        self.server_thread.daemon = True
+
+        self.client_queue = q = Queue.Queue()
+        self.server.handle_client_connect = q.put
+        self.server_thread.start()
+
+        self.client_connection = PipeConnection(client_read, client_write)
+        self.client = EPCClient(self.client_connection, **kwds)
+
+    def teardown_connection(self):
+        self.client.close()
+        self.client_connection.shutdown(socket.SHUT_WR)
+        self.server_thread.join(self.timeout)
+        self.server.server_close()
+        # Wait for EOF so that no thread reads a reused fd.
+        self.client.handler_thread.join(self.timeout)
+        self.client.handler._recv_iter.thread.join(self.timeout)
+        self.client_connection.close()
+
+    def test_calls_run_in_worker_pool(self):
+        self.assert_client_return('echo', [1], [1])
+        self.assertEqual(self.server.worker_pool.stats()['peak_workers'], 1)
+
+    def test_server_stops_on_eof(self):
+        self.teardown_connection()
+        self.assertFalse(self.server_thread.is_alive())
+        self.teardown_connection = lambda: None
+
+
+class TestEPCPy2PyBoundedPool(TestEPCPy2Py):
+
+    def setup_connection(self, **kwds):
+        kwds.update(max_workers=16, max_queue=4)
+        super(TestEPCPy2PyBoundedPool, self).setup_connection(**kwds)
+
+    def test_worker_pool_is_bounded(self):
+        self.assert_client_return('fib_server', [8], fib(8))
+        for pool in [self.server.worker_pool, self.client.worker_pool]:
+            self.assertLessEqual(pool.stats()['peak_workers'], 16)
+
+
+@needs_futures
+class TestEPCPy2PyExecutor(ThreadingPy2Py, BaseTestCase):
+
+    fibonacci = TestEPCPy2Py.fibonacci
+
+    def setUp(self):
+        self.setup_connection()
+        self.server.register_function(fib, executor='process')
+        self.server.register_function(os.getpid, executor='process')
+        self.executor = futures.ThreadPoolExecutor(1)
+        self.release = threading.Event()
+        self.server.register_function(
+            self.release.wait, name='wait', executor=self.executor)
+
+        @self.server.register_function
+        def defer(x):
+            future = futures.Future()
+            newthread(target=future.set_result, args=([x],)).start()
+            return future
+
+        @self.server.register_function
+        def defer_error():
+            future = futures.Future()
+            future.set_exception(ValueError('deferred error'))
+            return future
+
+    def tearDown(self):
+        self.release.set()
+        self.teardown_connection()
+        self.executor.shutdown()
+
+    def test_batch(self):
+        batches = []
+
+        @self.server.register_function(batch=True, max_wait_ms=10)
+        def square(batch):
+            batches.append(len(batch))
+            return [x * x for (x,) in batch]
+
+        calls = [('square', [i]) for i in range(20)]
+        self.assertEqual(self.client.call_many(calls, self.timeout),
+                         [i * i for i in range(20)])
+        self.assertEqual(sum(batches), 20)
+        self.assertLess(len(batches), 20)
+
+    def test_reregistration_stops_batcher_thread(self):
+        def square(batch):
+            return [x * x for (x,) in batch]
+        self.server.register_function(square, batch=True)
+        self.assertEqual(
+            self.client.call_sync('square', [3], timeout=self.timeout), 9)
+        thread = self.server._batchers['square']._thread
+        self.server.register_function(square, batch=True)
+        thread.join(self.timeout)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(
+            self.client.call_sync('square', [4], timeout=self.timeout), 16)
+
+    def test_single_flight(self):
+        started = Queue.Queue()
+
+        @self.server.register_function(single_flight=True)
+        def lookup(key):
+            started.put(key)
+            self.release.wait(self.timeout)
+            return [key, 'value']
+
+        first = self.client.call_future('lookup', ['a'])
+        self.assertEqual(started.get(timeout=self.timeout), 'a')
+        dups = [self.client.call_future('lookup', ['a']) for _ in range(4)]
+        other = self.client.call_future('lookup', ['b'])
+        self.assertEqual(started.get(timeout=self.timeout), 'b')
+        dups[0].cancel()
+        self.release.set()
+        self.assertEqual(gather([first] + dups[1:] + [other], self.timeout),
+                         [['a', 'value']] * 4 + [['b', 'value']])
+        self.assertTrue(started.empty())
+        self.assertEqual(
+            self.client.call_sync('lookup', ['a'], timeout=self.timeout),
+            ['a', 'value'])
+        self.assertEqual(started.get(timeout=self.timeout), 'a')
+
+    def test_single_flight_error(self):
+        self.server.register_function(
+            self.release.wait, name='wait_dedup', executor=self.executor,
+            single_flight=True)
+        self.server.register_function(
+            bad_method, executor=self.executor, single_flight=True)
+        blocker = self.client.call_future('wait_dedup', [self.timeout])
+        fs = [self.client.call_future('bad_method', [1]) for _ in range(3)]
+        self.release.set()
+        self.assertIs(blocker.result(self.timeout), True)
+        with logging_to_stdout(self.server.logger):
+            for f in fs:
+                self.assertIsInstance(f.exception(self.timeout), ReturnError)
+
+    def test_cache(self):
+        called = []
+        cache = LRU()
+
+        @self.server.register_function(cache=cache)
+        def square(x):
+            called.append(x)
+            if x < 0:
+                raise ValueError(x)
+            return [x * x, 'squared']
+
+        self.server.register_function(self.server.invalidate)
+        call = lambda *args: self.client.call_sync(args[0], list(args[1:]),
+                                                   timeout=self.timeout)
+        self.assertEqual(call('square', 3), [9, 'squared'])
+        self.assertEqual(call('square', 3), [9, 'squared'])
+        self.assertEqual(call('square', 4), [16, 'squared'])
+        self.assertEqual(called, [3, 4])
+        self.assertEqual(call('invalidate', 'square', [3]), 1)
+        self.assertEqual(call('square', 3), [9, 'squared'])
+        self.assertEqual(called, [3, 4, 3])
+        with logging_to_stdout(self.server.logger):
+            for _ in range(2):
+                self.assertRaises(ReturnError, call, 'square', -1)
+        self.assertEqual(called, [3, 4, 3, -1, -1])
+        self.assertEqual(call('invalidate', 'square'), 2)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 5))
+
+    def test_cache_deferred_result(self):
+        cache = LRU()
+        self.server.register_function(
+            os.getpid, executor=self.executor, cache=cache)
+        pid = self.client.call_sync('getpid', [], timeout=self.timeout)
+        deadline = time.time() + self.timeout
+        while not cache.stats()['size']:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.001)
+        self.assertEqual(
+            self.client.call_sync('getpid', [], timeout=self.timeout), pid)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_metrics_of_deferred_calls(self):
+        call = lambda name, args: self.client.call_sync(
+            name, args, timeout=self.timeout)
+        self.assertEqual(call('defer', [1]), [1])
+        with logging_to_stdout(self.server.logger):
+            self.assertRaises(ReturnError, call, 'defer_error', [])
+        stats = self.server.metrics.snapshot()
+        self.assertEqual(
+            [(stats[n]['calls'], stats[n]['errors'], stats[n]['in_flight'])
+             for n in ['defer', 'defer_error']],
+            [(1, 0, 0), (1, 1, 0)])
+        self.assertEqual(stats['defer']['response_bytes'],
+                         len(encode_message('return', 1, [1])))
+
+    def test_persistent_cache(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        path = os.path.join(tempdir, 'cache.sqlite')
+        called = []
+
+        def square(x):
+            called.append(x)
+            return x * x
+
+        cache = PersistentCache(path, version='1')
+        self.server.register_function(square, cache=cache)
+        self.assertEqual(
+            self.client.call_sync('square', [3], timeout=self.timeout), 9)
+        cache.close()
+        # A new cache on the same file replies without calling `square`.
+        cache = PersistentCache(path, version='1')
+        self.addCleanup(cache.close)
+        self.server.register_function(square, cache=cache)
+        self.assertEqual(
+            self.client.call_sync('square', [3], timeout=self.timeout), 9)
+        self.assertEqual(called, [3])
+
+    def test_batch_in_process(self):
+        self.server.register_function(
+            fib_batch, batch=True, executor='process')
+        calls = [('fib_batch', [i]) for i in range(10)]
+        self.assertEqual(self.client.call_many(calls, self.timeout * 10),
+                         self.fibonacci[:10])
+
+    def test_process_executor(self):
+        timeout = self.timeout * 10  # process startup
+        self.assertEqual(self.client.call_sync('fib', [10], timeout), fib(10))
+        self.assertNotEqual(self.client.call_sync('getpid', [], timeout),
+                            os.getpid())
+
+    def test_executor_does_not_block_other_calls(self):
+        future = self.client.call_future('wait', [self.timeout])
+        self.assertEqual(
+            self.client.call_sync('defer', [1], timeout=self.timeout), [1])
+        self.assertFalse(future.done())
+        self.release.set()
+        self.assertIs(future.result(self.timeout), True)
+
+    def test_deferred_error(self):
+        with logging_to_stdout(self.server.logger):
+            self.assertRaises(ReturnError, self.client.call_sync,
+                              'defer_error', [], self.timeout)
+
+
+class TestEPCPy2PyCancel(ThreadingPy2Py, BaseTestCase):
+
+    def setUp(self):
+        self.setup_connection(max_workers=1)
+        self.client.handler.send_cancel = True
+        self.release = threading.Event()
+        self.called = Queue.Queue()
+        self.stopped = Queue.Queue()
+
+        @self.server.register_function
+        def block():
+            self.release.wait(self.timeout)
+
+        @self.server.register_function
+        def record(x):
+            self.called.put(x)
+            return x
+
+        @self.server.register_function
+        def poll_cancel():
+            deadline = time.time() + self.timeout
+            while time.time() < deadline:
+                if call_cancelled():
+                    self.stopped.put(True)
+                    return
+                time.sleep(0.001)
+            self.stopped.put(False)
+
+    def tearDown(self):
+        self.release.set()
+        self.teardown_connection()
+
+    def test_timeout_removes_callback(self):
+        callbacks = self.client.handler.callmanager.callbacks
+        self.assertRaises(EPCTimeout, self.client.call_sync,
+                          'block', [], timeout=0.05)
+        self.assertEqual(len(callbacks), 0)
+        self.release.set()
+        self.assertEqual(
+            self.client.call_sync('record', [1], timeout=self.timeout), 1)
+
+    def test_timeout_is_empty(self):
+        self.assertRaises(Queue.Empty, self.client.call_sync,
+                          'block', [], timeout=0.05)
+
+    def test_call_many_timeout_removes_callbacks(self):
+        callbacks = self.client.handler.callmanager.callbacks
+        self.assertRaises(EPCTimeout, self.client.call_many,
+                          [('block', []), ('record', [1])], timeout=0.05)
+        self.assertEqual(len(callbacks), 0)
+
+    @needs_futures
+    def test_cancel_not_started(self):
+        self.client.call_future('block', [])
+        future = self.client.call_future('record', [1])
+        self.assertTrue(future.cancel())
+        self.assertEqual(len(self.client.handler.callmanager.callbacks), 1)
+        self.release.set()
+        self.assertEqual(
+            self.client.call_sync('record', [2], timeout=self.timeout), 2)
+        self.assertEqual(self.called.get(timeout=self.timeout), 2)
+        self.assertTrue(self.called.empty())
+
+    def test_cancel_in_progress(self):
+        self.assertRaises(EPCTimeout, self.client.call_sync,
+                          'poll_cancel', [], timeout=0.05)
+        self.assertIs(self.stopped.get(timeout=self.timeout), True)
+
+    def test_cancel_returns_false_after_reply(self):
+        uid = self.client.call('record', [1])
+        self.assertEqual(self.called.get(timeout=self.timeout), 1)
+        deadline = time.time() + self.timeout
+        while self.client.handler.callmanager.callbacks:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.001)
+        self.assertFalse(self.client.cancel(uid))
@@ -16,18 +16,27 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
+import sys
+import time
+import signal
+import shutil
 import socket
+import tempfile
+import subprocess
 
 from sexpdata import Symbol, loads
 
-from ..server import ThreadingEPCServer
-from ..utils import newthread
+from ..server import ThreadingEPCServer, UnixEPCServer, PreforkEPCServer, \
+    main
+from ..client import EPCClient
+from ..utils import newthread, PipeConnection
 from ..handler import encode_string, encode_object, BlockingCallback, \
     ReturnError, EPCError, ReturnErrorCallerUnknown, EPCErrorCallerUnknown, \
     CallerUnknown
 from ..py3compat import utf8, Queue, nested
 from .utils import mockedattr, logging_to_stdout, CaptureStdIO, BaseTestCase, \
-    streamio
+    streamio, unittest
 
 
 class TestEPCServerMisc(BaseTestCase):
@@ -54,6 +63,186 @@ class TestEPCServerMisc(BaseTestCase):
                          '{0}\n'.format(self.server.server_address[1]))
 
 
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'AF_UNIX is not available')
+class TestUnixEPCServerMisc(BaseTestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.path = os.path.join(self.tempdir, 'epc.sock')
+
+    def test_print_port(self):
+        server = UnixEPCServer(self.path)
+        try:
+            stream = streamio()
+            server.print_port(stream)
+            self.assertEqual(stream.getvalue(), self.path + '\n')
+        finally:
+            server.server_close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_main_unix_socket(self):
+        served = []
+
+        def serve_forever(server):
+            served.append((server.server_address,
+                           os.path.exists(server.server_address)))
+        stream = streamio()
+        print_port = UnixEPCServer.print_port
+        with nested(mockedattr(UnixEPCServer, 'serve_forever', serve_forever),
+                    mockedattr(UnixEPCServer, 'print_port',
+                               lambda server: print_port(server, stream))):
+            main(['--unix-socket', self.path, 'os'])
+        self.assertEqual(served, [(self.path, True)])
+        self.assertEqual(stream.getvalue(), self.path + '\n')
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_main_rejects_conflicting_options(self):
+        for options in [['--workers', '2', '--unix-socket', self.path],
+                        ['--stdio', '--workers', '2'],
+                        ['--stdio', '--unix-socket', self.path]]:
+            with CaptureStdIO():
+                self.assertRaises(SystemExit, main, options + ['os'])
+        self.assertFalse(os.path.exists(self.path))
+
+
+class TestStdioEPCServerProcess(BaseTestCase):
+
+    def setUp(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.dirname(os.path.dirname(os.path.dirname(
+                os.path.abspath(__file__))))] +
+            env.get('PYTHONPATH', '').split(os.pathsep))
+        self.proc = subprocess.Popen(
+            [sys.executable, '-m', 'epc.server', '--stdio', 'os'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, env=env)
+        self.connection = PipeConnection(self.proc.stdout.fileno(),
+                                         self.proc.stdin.fileno())
+
+    def tearDown(self):
+        self.proc.stdin.close()
+        self.proc.stdout.close()
+        self.proc.stderr.close()
+        self.proc.wait()
+
+    def receive_message(self):
+        buf = bytearray(1024)
+        size = self.connection.recv_into(buf)
+        self.assertEqual(int(buf[:6], 16), size - 6)
+        return loads(bytes(buf[6:size]).decode())
+
+    def test_call(self):
+        self.connection.sendall(encode_string('(call 1 getpid ())'))
+        self.assertEqual(self.receive_message(),
+                         [Symbol('return'), 1, self.proc.pid])
+
+    def test_output_of_function_goes_to_stderr(self):
+        self.connection.sendall(encode_string('(call 1 system ("echo hi"))'))
+        self.assertEqual(self.receive_message(), [Symbol('return'), 1, 0])
+        self.connection.sendall(encode_string('(call 2 getpid ())'))
+        self.assertEqual(self.receive_message(),
+                         [Symbol('return'), 2, self.proc.pid])
+        self.proc.stdin.close()
+        self.assertEqual(self.proc.wait(), 0)
+        self.assertIn(b'hi', self.proc.stderr.read())
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'os.fork is not available')
+class TestPreforkEPCServer(BaseTestCase):
+
+    reuse_port = False
+
+    def setUp(self):
+        self.server = PreforkEPCServer(('localhost', 0), workers=2,
+                                       reuse_port=self.reuse_port)
+        self.server.register_function(os.getpid)
+        self.server_thread = newthread(
+            self, target=self.server.serve_forever, args=(0.01,))
+        self.server_thread.start()
+        self.wait_workers()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join(self.timeout)
+        for client in self.clients:
+            client.socket.close()
+
+    def wait_workers(self, exclude=()):
+        deadline = time.time() + self.timeout
+        while (len(self.server.worker_pids) < 2 or
+               set(exclude) & self.server.worker_pids):
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        return set(self.server.worker_pids)
+
+    def connect(self):
+        # With `reuse_port`, workers may not be listening yet.
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                client = EPCClient(self.server.server_address)
+                break
+            except socket.error:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.01)
+        self.clients.append(client)
+        return client
+
+    def test_connections_are_served_by_different_workers(self):
+        # The kernel picks the worker of each connection, so use
+        # enough connections that all of them landing on one worker
+        # is practically impossible.
+        clients = [self.connect() for _ in range(16)]
+        pids = set()
+        for client in clients:
+            pid = client.call_sync('getpid', [], self.timeout * 5)
+            self.assertEqual(
+                client.call_sync('getpid', [], self.timeout * 5), pid)
+            pids.add(pid)
+        self.assertEqual(pids, self.server.worker_pids)
+
+    def test_dead_worker_is_restarted(self):
+        pid = self.connect().call_sync('getpid', [], self.timeout * 5)
+        os.kill(pid, signal.SIGKILL)
+        pids = self.wait_workers(exclude=[pid])
+        self.assertNotIn(pid, pids)
+        self.assertIn(self.connect().call_sync('getpid', [],
+                                               self.timeout * 5),
+                      pids)
+
+    def test_handler_class_is_second_positional_argument(self):
+        handler_class = type('Handler', (self.server.RequestHandlerClass,),
+                             {})
+        server = PreforkEPCServer(('localhost', 0), handler_class,
+                                  workers=1)
+        try:
+            self.assertIs(server.RequestHandlerClass, handler_class)
+            self.assertEqual(server.workers, 1)
+        finally:
+            server.server_close()
+
+    def test_shutdown_stops_workers(self):
+        pids = set(self.server.worker_pids)
+        self.server.shutdown()
+        self.assertEqual(self.server.worker_pids, set())
+        for pid in pids:
+            self.assertRaises(OSError, os.kill, pid, 0)
+
+
+@unittest.skipUnless(hasattr(socket, 'SO_REUSEPORT'),
+                     'SO_REUSEPORT is not available')
+class TestPreforkEPCServerReusePort(TestPreforkEPCServer):
+
+    reuse_port = True
+
+
 class BaseEPCServerTestCase(BaseTestCase):
 
     def setUp(self):
@@ -152,6 +341,15 @@ class TestEPCServerRequestHandling(BaseEPCServerTestCase):
         self.assertEqual(reply[1], [])  # uid
         assert 'Not enough closing brackets.' in reply[2]
 
+    def test_unknown_message(self):
+        with logging_to_stdout(self.server.logger):
+            self.client_send('(no-such-message 1)')
+            reply = self.receive_message()
+        self.assertEqual(reply[0].value(), Symbol('epc-error').value())
+        self.assertEqual(reply[1], 1)
+        assert 'Unknown message: no-such-message' in reply[2]
+        self.check_echo()
+
     def check_caller_unkown(self, message, eclass, eargs):
         self.check_echo()  # to establish connection to client
         called_with = Queue.Queue()
@@ -14,9 +14,56 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from ..utils import ThreadedIterator, LockingDict
+import time
+import socket
+import logging
+import threading
 
-from .utils import BaseTestCase
+from ..utils import ThreadedIterator, LockingDict, ThreadPool, \
+    FrameWriter, MicroBatcher, sendmsg_all, autolog
+from .. import py3compat
+from ..py3compat import Queue, futures
+
+from .utils import BaseTestCase, unittest, temporary_logger_handler, \
+    streamio, mockedattr, needs_futures
+
+
+class TestAutolog(BaseTestCase):
+
+    class Logged(object):
+        logger = logging.getLogger('epc.tests.autolog')
+
+        @autolog('debug')
+        def echo(self, x):
+            return x
+
+    class Payload(object):
+        def __init__(self):
+            self.formatted = 0
+
+        def __repr__(self):
+            self.formatted += 1
+            return 'x' * 1000
+
+    def test_disabled_level_formats_nothing(self):
+        self.Logged.logger.setLevel(logging.INFO)
+        self.addCleanup(self.Logged.logger.setLevel, logging.NOTSET)
+        payload = self.Payload()
+        self.assertIs(self.Logged().echo(payload), payload)
+        self.assertEqual(payload.formatted, 0)
+
+    def test_enabled_level_truncates(self):
+        logger = self.Logged.logger
+        logger.setLevel(logging.DEBUG)
+        self.addCleanup(logger.setLevel, logging.NOTSET)
+        stream = streamio()
+        with temporary_logger_handler(logger, logging.StreamHandler(stream)):
+            self.Logged().echo(self.Payload())
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('(AutoLog) Called: Logged.echo('))
+        for line in lines:
+            self.assertLess(len(line), 300)
 
 
 class TestThreadedIterator(BaseTestCase):
@@ -61,3 +108,283 @@ class TestLockingDict(BaseTestCase):
         self.assertEqual(ld.pop('a'), 1)
         self.assertEqual(ld.pop('b'), 2)
         self.assertEqual(dict(**self.ld), dict(c=3))
+
+
+class TestThreadPool(BaseTestCase):
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_reuse_idle_worker(self):
+        self.pool = ThreadPool()
+        results = Queue.Queue()
+        for i in range(5):
+            self.pool.submit(results.put, i)
+            self.assertEqual(results.get(timeout=self.timeout), i)
+        self.assertEqual(self.pool.stats()['started'], 1)
+
+    def test_max_workers(self):
+        self.pool = ThreadPool(max_workers=2)
+        release = threading.Event()
+        results = Queue.Queue()
+
+        def task(i):
+            release.wait()
+            results.put(i)
+
+        for i in range(10):
+            self.pool.submit(task, i)
+        stats = self.pool.stats()
+        self.assertEqual(stats['workers'], 2)
+        self.assertEqual(stats['saturated'], 8)
+        self.assertEqual(stats['peak_workers'], 2)
+        release.set()
+        got = [results.get(timeout=self.timeout) for _ in range(10)]
+        self.assertEqual(sorted(got), list(range(10)))
+
+    def test_idle_worker_exits(self):
+        self.pool = ThreadPool(idle_timeout=0.01)
+        done = threading.Event()
+        self.pool.submit(done.set)
+        done.wait(self.timeout)
+        for _ in range(100):
+            if self.pool.stats()['workers'] == 0:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(self.pool.stats()['workers'], 0)
+
+    def test_max_workers_is_bounded_by_default(self):
+        self.pool = ThreadPool()
+        release = threading.Event()
+        for _ in range(100):
+            self.pool.submit(release.wait)
+        stats = self.pool.stats()
+        release.set()
+        self.assertEqual(stats['workers'], 64)
+        self.assertEqual(stats['saturated'], 36)
+
+    def test_max_queue_blocks_submit(self):
+        self.pool = ThreadPool(max_workers=1, max_queue=1)
+        release = threading.Event()
+        submitted = threading.Event()
+        self.pool.submit(release.wait)
+        for _ in range(100):
+            if self.pool.stats()['queued'] == 0:
+                break
+            threading.Event().wait(0.01)
+        self.pool.submit(release.wait)  # fills the queue
+
+        def submit():
+            self.pool.submit(submitted.set)
+        thread = threading.Thread(target=submit)
+        thread.daemon = True
+        thread.start()
+        self.assertFalse(submitted.wait(0.05))
+        self.assertEqual(self.pool.stats()['blocked'], 1)
+        release.set()
+        self.assertTrue(submitted.wait(self.timeout))
+        thread.join(self.timeout)
+
+    def test_shutdown_drops_queued_tasks(self):
+        self.pool = ThreadPool(max_workers=1)
+        release = threading.Event()
+        ran = threading.Event()
+        self.pool.submit(release.wait)
+        self.pool.submit(ran.set)
+        self.pool.shutdown()
+        release.set()
+        for _ in range(100):
+            if self.pool.stats()['workers'] == 0:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(self.pool.stats()['workers'], 0)
+        self.assertFalse(ran.is_set())
+        self.assertRaises(RuntimeError, self.pool.submit, ran.set)
+
+    def test_task_submitted_while_idle_worker_exits(self):
+        self.pool = ThreadPool(idle_timeout=0.2)
+        # A reentrant lock lets this thread submit while holding it.
+        self.pool._lock = threading.RLock()
+        done = threading.Event()
+        self.pool.submit(lambda: None)
+        for _ in range(100):
+            stats = self.pool.stats()
+            if (stats['completed'], stats['idle']) == (1, 1):
+                break
+            threading.Event().wait(0.001)
+        # Let the idle worker time out and wait for the lock while it
+        # is still counted as idle, then submit a task.
+        with self.pool._lock:
+            threading.Event().wait(0.3)
+            self.pool.submit(done.set)
+        self.assertTrue(done.wait(self.timeout))
+
+
+class TestFrameWriter(BaseTestCase):
+
+    def setUp(self):
+        self.written = []
+        self.release = threading.Event()
+        self.writer = FrameWriter(self.write)
+
+    def tearDown(self):
+        self.release.set()
+        self.writer.close()
+
+    def write(self, buffers):
+        self.release.wait()
+        self.written.append(b''.join(buffers))
+
+    def test_coalesce_frames(self):
+        self.writer.put([b'first'])
+        for _ in range(100):  # wait until the writer takes the first one
+            if self.writer.qsize() == 0:
+                break
+            threading.Event().wait(0.01)
+        for i in range(10):
+            self.writer.put([b'<', str(i).encode(), b'>'])
+        self.assertEqual(self.writer.qsize(), 10)
+        self.release.set()
+        self.writer.close()
+        self.assertEqual(self.written, [
+            b'first', b''.join(b'<' + str(i).encode() + b'>'
+                               for i in range(10))])
+        stats = self.writer.stats()
+        self.assertEqual(stats['frames'], 11)
+        self.assertEqual(stats['writes'], 2)
+        self.assertEqual(stats['peak_frames'], 10)
+
+    def test_put_after_close(self):
+        self.writer.close()
+        self.assertRaises(ValueError, self.writer.put, [b'x'])
+
+    def test_error_in_writer_thread(self):
+        def write(buffers):
+            raise IOError('closed')
+        self.writer.close()
+        self.writer = FrameWriter(write)
+        self.writer.put([b'x'])
+        self.writer.thread.join(self.timeout)
+        self.assertIsInstance(self.writer.error, IOError)
+        self.assertRaises(ValueError, self.writer.put, [b'y'])
+
+
+@unittest.skipUnless(hasattr(socket.socket, 'sendmsg'), 'needs sendmsg')
+class TestSendmsgAll(BaseTestCase):
+
+    def test_send_large_buffers(self):
+        (sender, receiver) = socket.socketpair()
+        buffers = [b'head', b'x' * (1 << 20), b'', b'y' * 100, b'tail']
+        data = b''.join(buffers)
+        received = []
+
+        def receive():
+            size = 0
+            while size < len(data):
+                chunk = receiver.recv(1 << 16)
+                received.append(chunk)
+                size += len(chunk)
+        thread = threading.Thread(target=receive)
+        thread.start()
+        try:
+            sendmsg_all(sender, buffers, iov_max=2)
+            thread.join(self.timeout)
+        finally:
+            sender.close()
+            receiver.close()
+        self.assertEqual(b''.join(received), data)
+
+
+@needs_futures
+class TestMicroBatcher(BaseTestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def wait_batches(self, batcher, n):
+        deadline = time.time() + self.timeout
+        while batcher.stats()['batches'] < n:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.001)
+
+    def add(self, batch):
+        self.release.wait(self.timeout)
+        self.batches.append(len(batch))
+        return [a + b for (a, b) in batch]
+
+    def test_concurrent_calls_are_batched(self):
+        self.release.clear()
+        batcher = MicroBatcher(self.add, max_batch=100, max_wait=0)
+        first = batcher.submit((0, 0))
+        self.wait_batches(batcher, 1)
+        fs = [batcher.submit((i, 1)) for i in range(10)]
+        self.release.set()
+        self.assertEqual(first.result(self.timeout), 0)
+        self.assertEqual([f.result(self.timeout) for f in fs],
+                         list(range(1, 11)))
+        self.assertEqual(self.batches, [1, 10])
+        stats = batcher.stats()
+        self.assertEqual((stats['batches'], stats['calls'],
+                          stats['peak_batch'], stats['pending']),
+                         (2, 11, 10, 0))
+
+    def test_max_batch(self):
+        batcher = MicroBatcher(self.add, max_batch=3, max_wait=0.05)
+        fs = [batcher.submit((i, 0)) for i in range(7)]
+        self.assertEqual([f.result(self.timeout) for f in fs],
+                         list(range(7)))
+        self.assertTrue(all(n <= 3 for n in self.batches))
+
+    def test_error(self):
+        def fail(batch):
+            raise ValueError('failed')
+        batcher = MicroBatcher(fail, max_wait=0.01)
+        fs = [batcher.submit((i,)) for i in range(3)]
+        for f in fs:
+            self.assertIsInstance(f.exception(self.timeout), ValueError)
+
+    def test_wrong_number_of_results(self):
+        batcher = MicroBatcher(lambda batch: [], max_wait=0)
+        future = batcher.submit((1,))
+        self.assertIsInstance(future.exception(self.timeout), ValueError)
+
+    def test_cancelled_call_is_skipped(self):
+        self.release.clear()
+        batcher = MicroBatcher(self.add, max_wait=0)
+        batcher.submit((0, 0))
+        self.wait_batches(batcher, 1)
+        cancelled = batcher.submit((1, 1))
+        self.assertTrue(cancelled.cancel())
+        future = batcher.submit((2, 2))
+        self.release.set()
+        self.assertEqual(future.result(self.timeout), 4)
+        self.assertEqual(self.batches, [1, 1])
+
+    def test_close(self):
+        self.release.clear()
+        batcher = MicroBatcher(self.add, max_wait=1)
+        future = batcher.submit((1, 2))
+        thread = batcher._thread
+        batcher.close()
+        self.assertRaises(RuntimeError, batcher.submit, (3, 4))
+        self.release.set()
+        self.assertEqual(future.result(self.timeout), 3)
+        thread.join(self.timeout)
+        self.assertFalse(thread.is_alive())
+
+    def test_executor(self):
+        executor = futures.ThreadPoolExecutor(2)
+        self.addCleanup(executor.shutdown)
+        batcher = MicroBatcher(self.add, max_wait=0.01, executor=executor)
+        fs = [batcher.submit((i, i)) for i in range(5)]
+        self.assertEqual([f.result(self.timeout) for f in fs],
+                         [0, 2, 4, 6, 8])
+
+
+class TestMicroBatcherWithoutFutures(BaseTestCase):
+
+    def test_init_fails(self):
+        with mockedattr(py3compat, 'futures', None):
+            self.assertRaises(RuntimeError, MicroBatcher, sum)
@@ -21,7 +21,7 @@ import os
 import sys
 from contextlib import contextmanager
 
-from ..py3compat import PY3, Queue
+from ..py3compat import PY3, Queue, futures
 from ..utils import newthread
 
 try:
@@ -107,6 +107,10 @@ class BaseTestCase(unittest.TestCase):
         timeout = 1
 
 
+needs_futures = unittest.skipIf(
+    futures is None, 'concurrent.futures is not available')
+
+
 def skip(reason):
     from nose import SkipTest
 
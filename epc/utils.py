@@ -14,13 +14,22 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import io
+import os
+import time
+import errno
+import socket
 import logging
 import itertools
 import functools
 import threading
 import warnings
 
-from .py3compat import Queue
+import sexpdata
+
+from .py3compat import Queue, futures, reprlib, require_futures
+
+_logger = logging.getLogger(__name__)
 
 
 def func_call_as_str(name, *args, **kwds):
@@ -31,26 +40,64 @@ def func_call_as_str(name, *args, **kwds):
     'f(1, 2, a=1)'
 
     """
+    return _format_call(name, args, kwds, repr)
+
+
+def _format_call(name, args, kwds, repr):
     return '{0}({1})'.format(
         name,
         ', '.join(itertools.chain(
-            map('{0!r}'.format, args),
-            map('{0[0]!s}={0[1]!r}'.format, sorted(kwds.items())))))
+            map(repr, args),
+            ('{0!s}={1}'.format(k, repr(v))
+             for (k, v) in sorted(kwds.items())))))
+
+
+_short_repr = reprlib.Repr()
+_short_repr.maxstring = _short_repr.maxother = 200
+_short_repr.maxlist = _short_repr.maxtuple = _short_repr.maxdict = 20
+
+
+def short_repr(obj):
+    """
+    Return :func:`repr` of `obj` with large parts abbreviated.
+
+    It is meant for log messages, so that logging a message with a
+    long payload does not format all of it.
+
+    >>> r = short_repr('a' * 1000)
+    >>> (len(r), r[95:103])
+    (200, 'aaa...aa')
+    >>> short_repr(list(range(100)))[-10:]
+    ', 19, ...]'
+
+    """
+    return _short_repr.repr(obj)
 
 
 def autolog(level):
+    """
+    Decorator to log calls of a method and its return values.
+
+    Nothing is formatted unless `level` is enabled for the logger of
+    the object.  Arguments and return values are formatted by
+    :func:`short_repr`.
+
+    """
     if isinstance(level, str):
         level = getattr(logging, level.upper())
 
     def wrapper(method):
         @functools.wraps(method)
         def new_method(self, *args, **kwds):
+            logger = self.logger
+            if not logger.isEnabledFor(level):
+                return method(self, *args, **kwds)
             funcname = ".".join([self.__class__.__name__, method.__name__])
-            self.logger.log(level, "(AutoLog) Called: %s",
-                            func_call_as_str(funcname, *args, **kwds))
+            logger.log(level, "(AutoLog) Called: %s",
+                       _format_call(funcname, args, kwds, short_repr))
             ret = method(self, *args, **kwds)
-            self.logger.log(level, "(AutoLog) Returns: %s(...) = %r",
-                            funcname, ret)
+            logger.log(level, "(AutoLog) Returns: %s(...) = %s",
+                       funcname, short_repr(ret))
             return ret
         return new_method
     return wrapper
@@ -118,6 +165,262 @@ class ThreadedIterator(object):
     next = __next__  # for PY2
 
 
+def sendmsg_all(sock, buffers, iov_max=1024):
+    """
+    Send all `buffers` using `sock.sendmsg`, like `sock.sendall`.
+
+    At most `iov_max` buffers are passed to each `sendmsg` call.
+
+    """
+    buffers = [memoryview(b) for b in buffers]
+    while buffers:
+        sent = sock.sendmsg(buffers[:iov_max])
+        while sent:
+            size = len(buffers[0])
+            if sent < size:
+                buffers[0] = buffers[0][sent:]
+                break
+            sent -= size
+            buffers.pop(0)
+        while buffers and not len(buffers[0]):
+            buffers.pop(0)
+
+
+class PipeConnection(object):
+
+    """
+    Socket-like object made of a pair of file descriptors.
+
+    It implements the part of the socket interface used by
+    :class:`epc.handler.EPCHandler`, so that EPC messages can be
+    exchanged through pipes, e.g., stdin and stdout of a subprocess.
+
+    :type  rfd: int
+    :arg   rfd: File descriptor to read messages from.
+    :type  wfd: int
+    :arg   wfd: File descriptor to write messages to.
+
+    The file descriptors are closed by :meth:`close`.
+
+    >>> (r, w) = os.pipe()
+    >>> conn = PipeConnection(r, w)
+    >>> conn.sendall(b'hello')
+    >>> buf = bytearray(16)
+    >>> conn.recv_into(buf)
+    5
+    >>> conn.close()
+
+    """
+
+    def __init__(self, rfd, wfd):
+        self.rfd = rfd
+        self.wfd = wfd
+        self._raw = io.FileIO(rfd, 'rb', closefd=False)
+        self._open_fds = set([rfd, wfd])
+        self.closed = False
+
+    def fileno(self):
+        return -1 if self.closed else self.rfd
+
+    def recv_into(self, buffer, nbytes=0):
+        if nbytes:
+            buffer = memoryview(buffer)[:nbytes]
+        try:
+            return self._raw.readinto(buffer)
+        except ValueError:
+            raise OSError(errno.EBADF, 'connection is closed')
+
+    def sendall(self, data):
+        data = memoryview(data)
+        while len(data):
+            data = data[os.write(self.wfd, data):]
+
+    def makefile(self, mode='r', bufsize=-1):
+        if 'r' in mode:
+            return io.open(self.rfd, mode, bufsize, closefd=False)
+        return _PipeWriter(self)
+
+    def settimeout(self, timeout):
+        pass  # pipes are always blocking
+
+    def shutdown(self, how):
+        """
+        Close the writing end if `how` is not `socket.SHUT_RD`, so
+        that the peer sees EOF.
+        """
+        if how != socket.SHUT_RD and self.wfd != self.rfd:
+            self._close_fd(self.wfd)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._raw.close()
+        for fd in list(self._open_fds):
+            self._close_fd(fd)
+
+    def _close_fd(self, fd):
+        if fd in self._open_fds:
+            self._open_fds.discard(fd)
+            os.close(fd)
+
+
+class _PipeWriter(object):
+
+    # Unbuffered file-like object for `PipeConnection.makefile`.
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.closed = False
+
+    def write(self, data):
+        self.connection.sendall(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FrameWriter(object):
+
+    """
+    Queue of frames to be written to one connection.
+
+    Frames can be put from any thread.  A writer takes all frames in
+    the queue at once and passes their buffers to one call of
+    `write`, so that frames are never interleaved and small frames are
+    coalesced into one system call.
+
+    :type    write: callable
+    :arg     write: A function called with a list of buffers.
+    :type threaded: bool
+    :arg  threaded: If true, a dedicated thread writes the frames and
+                    :meth:`put` returns immediately.  Otherwise the
+                    thread calling :meth:`put` writes all queued
+                    frames, and errors from `write` are raised there.
+
+    """
+
+    def __init__(self, write, threaded=True):
+        self._write = write
+        self._cond = threading.Condition(threading.Lock())
+        self._write_lock = threading.Lock()
+        self._buffers = []
+        self._frames = 0
+        self._nbytes = 0
+        self._closed = False
+        self.error = None
+        """Error raised by `write` in the writer thread."""
+        self._counters = dict.fromkeys(
+            ['frames', 'writes', 'bytes', 'peak_frames', 'peak_bytes'], 0)
+        self.thread = None
+        if threaded:
+            self.thread = newthread(self, target=self._writer)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def put(self, buffers):
+        """
+        Queue a frame given as a list of buffers.
+
+        :exc:`ValueError` is raised if the writer is closed.
+
+        """
+        with self._cond:
+            if self._closed:
+                raise ValueError('write to a closed FrameWriter')
+            self._buffers.extend(buffers)
+            self._frames += 1
+            self._nbytes += sum(len(b) for b in buffers)
+            counters = self._counters
+            if self._frames > counters['peak_frames']:
+                counters['peak_frames'] = self._frames
+            if self._nbytes > counters['peak_bytes']:
+                counters['peak_bytes'] = self._nbytes
+            self._cond.notify()
+        if self.thread is None:
+            with self._write_lock:
+                self._flush()
+
+    def _take(self):
+        # Must be called while holding `self._cond`.
+        buffers = self._buffers
+        counters = self._counters
+        counters['frames'] += self._frames
+        counters['bytes'] += self._nbytes
+        counters['writes'] += 1
+        self._buffers = []
+        self._frames = self._nbytes = 0
+        return buffers
+
+    def _flush(self):
+        with self._cond:
+            if not self._buffers:
+                return
+            buffers = self._take()
+        self._write(buffers)
+
+    def _writer(self):
+        while True:
+            with self._cond:
+                while not (self._buffers or self._closed):
+                    self._cond.wait()
+                if not self._buffers:
+                    return
+                buffers = self._take()
+            try:
+                self._write(buffers)
+            except Exception as err:
+                _logger.debug('FrameWriter: failed to write', exc_info=1)
+                with self._cond:
+                    self.error = err
+                    self._closed = True
+                    self._buffers = []
+                    self._frames = self._nbytes = 0
+                return
+
+    def qsize(self):
+        """Return the number of frames waiting to be written."""
+        return self._frames
+
+    def stats(self):
+        """
+        Return a dictionary of writer statistics.
+
+        ``pending_frames`` and ``pending_bytes`` are the current queue
+        depth.  ``frames``, ``bytes`` and ``writes`` are the totals
+        written so far; ``frames / writes`` is the average number of
+        frames coalesced into one write.  ``peak_frames`` and
+        ``peak_bytes`` are high-water marks of the queue.
+
+        """
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update(pending_frames=self._frames,
+                         pending_bytes=self._nbytes)
+        return stats
+
+    def close(self, timeout=1):
+        """
+        Stop accepting frames.
+
+        Frames already queued are still written.  When the writer has
+        its own thread, wait at most `timeout` seconds for them.
+
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self.thread is None:
+            with self._write_lock:
+                self._flush()
+        elif self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+
 def callwith(context_manager):
     """
     A decorator to wrap execution of function with a context manager.
@@ -146,6 +449,33 @@ def _define_thread_safe_methods(methodnames, lockname):
     return decorator
 
 
+def freeze(obj):
+    """
+    Return a hashable key of `obj`, a value decoded from S-expression.
+
+    Keys of values with the same S-expression are equal.  Values of
+    different types are distinguished, even if they compare equal in
+    Python.
+
+    >>> freeze([1, 'a', [2.5]]) == freeze([1, 'a', [2.5]])
+    True
+    >>> freeze([1]) == freeze([True])
+    False
+
+    """
+    cls = obj.__class__
+    if cls is list or cls is tuple:
+        return (list, tuple(map(freeze, obj)))
+    if cls is dict:
+        return (dict, frozenset((freeze(k), freeze(v))
+                                for (k, v) in obj.items()))
+    try:
+        hash(obj)
+    except TypeError:
+        return (cls, sexpdata.dumps(obj))
+    return (cls, obj)
+
+
 @_define_thread_safe_methods(
     ['__getitem__', '__setitem__', '__delitem__', 'pop'], '_lock')
 class LockingDict(dict):
@@ -153,3 +483,324 @@ class LockingDict(dict):
     def __init__(self, *args, **kwds):
         super(LockingDict, self).__init__(*args, **kwds)
         self._lock = threading.Lock()
+
+
+class ThreadPool(object):
+
+    """
+    A pool of worker threads with an optionally bounded task queue.
+
+    Workers are started on demand and an idle worker above
+    `min_workers` exits after `idle_timeout` seconds, so that the
+    number of threads follows the load instead of the request rate.
+
+    :type  max_workers: int or None
+    :arg   max_workers: Maximum number of worker threads.  None means
+                        that there is no limit; idle workers are still
+                        reused but a burst of slow tasks starts as
+                        many threads.
+    :type    max_queue: int
+    :arg     max_queue: Maximum number of tasks waiting for a worker.
+                        0 means no limit.  When the queue is full,
+                        :meth:`submit` blocks until a worker picks up
+                        a task.
+    :type  min_workers: int
+    :arg   min_workers: Number of workers kept alive while idle.
+    :type idle_timeout: float
+    :arg  idle_timeout: Seconds an extra idle worker waits for a task.
+
+    >>> pool = ThreadPool(max_workers=2)
+    >>> results = Queue.Queue()
+    >>> pool.submit(results.put, 1)
+    >>> results.get(timeout=1)
+    1
+    >>> pool.stats()['submitted']
+    1
+    >>> pool.shutdown()
+
+    """
+
+    def __init__(self, max_workers=64, max_queue=0, min_workers=0,
+                 idle_timeout=60):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.min_workers = min_workers
+        self.idle_timeout = idle_timeout
+        self._queue = Queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._workers = 0
+        self._idle = 0
+        self._pending = 0  # submitted but not taken by a worker yet
+        self._counters = dict.fromkeys(
+            ['submitted', 'completed', 'failed', 'started',
+             'saturated', 'blocked', 'peak_workers', 'peak_queued'], 0)
+
+    def submit(self, func, *args, **kwds):
+        """
+        Run ``func(*args, **kwds)`` in one of the worker threads.
+        """
+        counters = self._counters
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('cannot submit to a closed pool')
+            counters['submitted'] += 1
+            self._pending += 1
+            queued = self._pending
+            if queued > self._idle:
+                if (self.max_workers is None or
+                        self._workers < self.max_workers):
+                    self._start_worker()
+                else:
+                    counters['saturated'] += 1
+            if queued > counters['peak_queued']:
+                counters['peak_queued'] = queued
+            if self._queue.full():
+                counters['blocked'] += 1
+        self._queue.put((func, args, kwds))
+
+    def _start_worker(self):
+        # Must be called while holding `self._lock`.
+        self._workers += 1
+        self._counters['started'] += 1
+        if self._workers > self._counters['peak_workers']:
+            self._counters['peak_workers'] = self._workers
+        thread = newthread(self, target=self._worker)
+        thread.daemon = True
+        thread.start()
+
+    def _worker(self):
+        get = self._queue.get
+        counters = self._counters
+        while True:
+            with self._lock:
+                if self._shutdown:
+                    self._workers -= 1
+                    return
+                self._idle += 1
+                extra = self._workers > self.min_workers
+            try:
+                task = get(timeout=self.idle_timeout if extra else None)
+            except Queue.Empty:
+                with self._lock:
+                    self._idle -= 1
+                    # A task submitted while this worker was still
+                    # counted as idle has no other worker to run it.
+                    if self._workers > self.min_workers and \
+                            self._pending <= self._idle:
+                        self._workers -= 1
+                        return
+                continue
+            with self._lock:
+                self._idle -= 1
+                if task is None:
+                    self._workers -= 1
+                    return
+                self._pending -= 1
+            (func, args, kwds) = task
+            try:
+                func(*args, **kwds)
+            except Exception:
+                _logger.exception('Unhandled error in %r', func)
+                with self._lock:
+                    counters['failed'] += 1
+            with self._lock:
+                counters['completed'] += 1
+
+    def shutdown(self):
+        """
+        Stop accepting tasks and let the workers exit.
+
+        Each worker exits after its current task, so tasks still
+        waiting in the queue may never run.  This method does not wait
+        for running tasks to finish.
+
+        """
+        with self._lock:
+            self._shutdown = True
+            workers = self._workers
+        for _ in range(workers):
+            try:
+                self._queue.put_nowait(None)
+            except Queue.Full:
+                break  # workers check `_shutdown` after each task
+
+    def stats(self):
+        """
+        Return a dictionary of pool statistics.
+
+        ``workers``, ``idle``, ``busy`` and ``queued`` are the current
+        numbers of threads and waiting tasks.  ``saturated`` counts
+        tasks submitted when every worker was busy and no new worker
+        could be started, and ``blocked`` counts submissions which had
+        to wait for a free slot in the queue.  ``peak_workers`` and
+        ``peak_queued`` are high-water marks.
+
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update(
+                workers=self._workers,
+                idle=self._idle,
+                busy=self._workers - self._idle,
+                queued=self._queue.qsize(),
+                max_workers=self.max_workers,
+                max_queue=self.max_queue,
+            )
+        return stats
+
+
+class MicroBatcher(object):
+
+    """
+    Collect calls made at around the same time and run them at once.
+
+    :type   function: callable
+    :arg    function: Called with a list of argument tuples.  It must
+                      return a list of results in the same order.
+    :type  max_batch: int
+    :arg   max_batch: Maximum number of calls run at once.
+    :type   max_wait: float
+    :arg    max_wait: Seconds to wait for more calls after the first
+                      one arrives.  Calls arriving while a batch runs
+                      are collected anyway.
+    :type   executor: :class:`concurrent.futures.Executor` or None
+    :arg    executor: Run batches in this executor.  Default is to
+                      run them in the thread of this batcher.
+
+    >>> batcher = MicroBatcher(lambda batch: [a + b for (a, b) in batch])
+    ... #doctest: +SKIP
+    >>> fs = [batcher.submit((i, 1)) for i in range(3)]  #doctest: +SKIP
+    >>> [f.result() for f in fs]                          #doctest: +SKIP
+    [1, 2, 3]
+
+    If `function` raises an exception, every call in the batch fails
+    with it.  In Python 2, the "futures" package is needed.
+
+    """
+
+    def __init__(self, function, max_batch=100, max_wait=0.001,
+                 executor=None):
+        require_futures('MicroBatcher')
+        self.function = function
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.executor = executor
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._counters = dict(batches=0, calls=0, peak_batch=0)
+
+    def submit(self, args):
+        """
+        Schedule a call with `args` and return a future of its result.
+        """
+        future = futures.Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('cannot submit to a closed batcher')
+            self._pending.append((tuple(args), future, time.time()))
+            if self._thread is None:
+                self._thread = newthread(self, target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def stats(self):
+        """
+        Return a dictionary of batcher statistics.
+
+        ``calls / batches`` is the average batch size and
+        ``peak_batch`` is the largest one.  ``pending`` is the number
+        of calls waiting for the next batch.
+
+        """
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update(pending=len(self._pending))
+        return stats
+
+    def close(self):
+        """
+        Stop accepting calls and let the thread of this batcher exit.
+
+        Calls already submitted are still run.
+
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not (self._pending or self._closed):
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                deadline = self._pending[0][2] + self.max_wait
+                while len(self._pending) < self.max_batch and \
+                        not self._closed:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            self._call(batch)
+
+    def _call(self, batch):
+        batch = [(args, future) for (args, future, _) in batch
+                 if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        with self._cond:
+            counters = self._counters
+            counters['batches'] += 1
+            counters['calls'] += len(batch)
+            counters['peak_batch'] = max(counters['peak_batch'], len(batch))
+        arglist = [args for (args, _) in batch]
+        fs = [future for (_, future) in batch]
+        if self.executor is None:
+            try:
+                results = self.function(arglist)
+            except Exception as err:
+                _logger.debug('Error in batch of %d calls', len(fs),
+                              exc_info=1)
+                for future in fs:
+                    future.set_exception(err)
+            else:
+                self._resolve(fs, results)
+        else:
+            try:
+                done = self.executor.submit(self.function, arglist)
+            except Exception as err:
+                for future in fs:
+                    future.set_exception(err)
+                return
+            done.add_done_callback(
+                lambda done: self._resolve_future(fs, done))
+
+    def _resolve_future(self, fs, done):
+        try:
+            results = done.result()
+        except Exception as err:
+            for future in fs:
+                future.set_exception(err)
+        else:
+            self._resolve(fs, results)
+
+    @staticmethod
+    def _resolve(fs, results):
+        results = list(results)
+        if len(results) != len(fs):
+            error = ValueError(
+                'Batch function returned {0} results for {1} calls'
+                .format(len(results), len(fs)))
+            for future in fs:
+                future.set_exception(error)
+            return
+        for (future, result) in zip(fs, results):
+            future.set_result(result)
@@ -0,0 +1,71 @@
+"""
+Measure the overhead of :func:`epc.utils.autolog` when DEBUG is off.
+
+Run this script as::
+
+    python examples/bench/autolog.py --sizes 10 1000 100000
+
+For each payload size, it calls a method decorated by ``autolog`` with
+a string of that length while the logger level is WARNING, which is
+the usual production setting.  ``legacy`` is the decorator as it was
+before it checked the level: it formatted the arguments anyway.
+``none`` is the undecorated method.
+
+"""
+
+import functools
+import logging
+import timeit
+
+from epc.utils import autolog, func_call_as_str
+
+
+def legacy_autolog(level):
+    level = getattr(logging, level.upper())
+
+    def wrapper(method):
+        @functools.wraps(method)
+        def new_method(self, *args, **kwds):
+            funcname = ".".join([self.__class__.__name__, method.__name__])
+            self.logger.log(level, "(AutoLog) Called: %s",
+                            func_call_as_str(funcname, *args, **kwds))
+            ret = method(self, *args, **kwds)
+            self.logger.log(level, "(AutoLog) Returns: %s(...) = %r",
+                            funcname, ret)
+            return ret
+        return new_method
+    return wrapper
+
+
+class Handler(object):
+
+    logger = logging.getLogger('epc.bench.autolog')
+
+    def none(self, uid, data):
+        return ['return', uid, data]
+
+    legacy = legacy_autolog('debug')(none)
+    current = autolog('debug')(none)
+
+
+def main(args=None):
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default=[10, 1000, 100000], type=int,
+                        nargs='+')
+    parser.add_argument('--repeat', default=10000, type=int)
+    ns = parser.parse_args(args)
+    Handler.logger.setLevel(logging.WARNING)
+    handler = Handler()
+    for size in ns.sizes:
+        data = 'x' * size
+        for name in ['none', 'legacy', 'current']:
+            method = getattr(handler, name)
+            seconds = min(timeit.repeat(
+                lambda: method(1, data), number=ns.repeat, repeat=3))
+            print('{0:8} bytes  {1:8}  {2:10.3f} us/call'
+                  .format(size, name, seconds / ns.repeat * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Measure the per-message overhead of dispatching and encoding.
+
+Run this script as::
+
+    python examples/bench/dispatch.py --repeat 100000
+
+It feeds ``call`` messages directly to :meth:`_handle_message` of a
+handler which is not connected to anything and prints the time per
+message.  ``cancel`` messages do almost nothing else, so they show
+the cost of the dispatch itself.  ``legacy`` resolves ``_validate_<name>`` and
+``_handle_<name>`` by formatting the names for each message, as
+:class:`EPCHandler` did before it had a dispatch table.  ``encode``
+rows compare encoding a ``return`` message with a new Symbol and with
+the interned one.
+
+"""
+
+import timeit
+
+from sexpdata import Symbol
+
+from epc.core import EPCCore
+from epc.codec import encode_frame
+from epc.handler import EPCHandler, message_symbol, call_cancelled, \
+    _Future
+
+
+class NullHandler(EPCHandler):
+
+    def __init__(self, server):
+        # Do not call `BaseRequestHandler.__init__`; there is no socket.
+        # Set what `setup` would set and `_handle_message` uses.
+        self.server = server
+        self._deferred = {}
+        self._measured = {}
+
+    def _send(self, *args):
+        # Nothing is written, but the call is recorded as finished.
+        self._finish_reply(args)
+
+    def _handle_cancel(self, uid):
+        pass
+
+
+class LegacyHandler(NullHandler):
+
+    def _handle_message(self, name, uid, args):
+        try:
+            pyname = name.replace('-', '_')
+            getattr(self, '_validate_{0}'.format(pyname))(uid, args)
+            handler = getattr(self, '_handle_{0}'.format(pyname))
+            reply = handler(uid, *args)
+            if reply is None or call_cancelled():
+                return
+            if reply[0] == 'return' and isinstance(reply[2], _Future):
+                self._reply_later(uid, reply[2])
+            else:
+                self._send(*reply)
+        except Exception as err:
+            self._handle_exception(err, uid)
+
+
+def echo(*a):
+    return a
+
+
+def measure(stmt, repeat):
+    return min(timeit.repeat(stmt, number=repeat, repeat=3)) / repeat
+
+
+def main(args=None):
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', default=100000, type=int)
+    ns = parser.parse_args(args)
+
+    server = EPCCore(None, False)
+    server.register_function(echo)
+    args = [Symbol('echo'), [1]]
+    rows = []
+    for (name, cls) in [('legacy', LegacyHandler), ('table', NullHandler)]:
+        handler = cls(server)
+        rows.append(('call     ' + name, measure(
+            lambda: handler._handle_message('call', 1, args), ns.repeat)))
+        rows.append(('cancel   ' + name, measure(
+            lambda: handler._handle_message('cancel', 1, []), ns.repeat)))
+    rows.append(('encode   new symbol', measure(
+        lambda: encode_frame([Symbol('return'), 1, [1]]), ns.repeat)))
+    rows.append(('encode   interned', measure(
+        lambda: encode_frame([message_symbol('return'), 1, [1]]),
+        ns.repeat)))
+    for (name, seconds) in rows:
+        print('{0:20}  {1:8.3f} us/message'.format(name, seconds * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Measure how throughput of a CPU-bound method scales with workers.
+
+Run this script as::
+
+    python examples/bench/prefork.py --workers 1 2 4
+
+For each number of workers, it starts a :class:`PreforkEPCServer`,
+opens as many connections as workers and calls ``fib`` from all of
+them for `duration` seconds.  Calls per second and the speedup
+relative to the first row are printed.
+
+"""
+
+import time
+import threading
+
+from epc.client import EPCClient
+from epc.server import PreforkEPCServer
+from epc.utils import newthread
+
+
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+
+def measure(workers, n, duration):
+    server = PreforkEPCServer(('localhost', 0), workers=workers)
+    server.register_function(fib)
+    server_thread = newthread(target=server.serve_forever)
+    server_thread.start()
+    clients = [EPCClient(server.server_address) for _ in range(workers)]
+    counts = [0] * workers
+    stop = threading.Event()
+
+    def run(i):
+        while not stop.is_set():
+            clients[i].call_sync('fib', [n])
+            counts[i] += 1
+
+    try:
+        threads = [newthread(target=run, args=(i,)) for i in range(workers)]
+        for t in threads:
+            t.start()
+        time.sleep(duration)
+        stop.set()
+        for t in threads:
+            t.join()
+    finally:
+        for c in clients:
+            c.close()
+        server.shutdown()
+        server.server_close()
+        for c in clients:
+            c.socket.close()
+    return sum(counts) / float(duration)
+
+
+def main(args=None):
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', default=[1, 2, 4], type=int, nargs='+')
+    parser.add_argument('--n', default=22, type=int,
+                        help='argument to fib')
+    parser.add_argument('--duration', default=3, type=float)
+    ns = parser.parse_args(args)
+    base = None
+    for workers in ns.workers:
+        rate = measure(workers, ns.n, ns.duration)
+        base = base or rate
+        print('{0:3} workers  {1:10.1f} calls/s  x{2:.2f}'
+              .format(workers, rate, rate / base))
+
+
+if __name__ == '__main__':
+    main()
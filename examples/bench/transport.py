@@ -0,0 +1,78 @@
+"""
+Compare round trip latency of loopback TCP and Unix domain socket.
+
+Run this script as::
+
+    python examples/bench/transport.py --repeat 10000
+
+It starts a threading server and a client in this process for each
+transport, calls ``echo`` `repeat` times with :meth:`call_sync` and
+prints the median and the 99th percentile of the round trip time.
+
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+from epc.client import EPCClient
+from epc.server import ThreadingEPCServer, ThreadingUnixEPCServer
+from epc.utils import newthread
+
+
+def echo(*a):
+    return a
+
+
+def measure(server, address, repeat, size):
+    server.register_function(echo)
+    server.daemon_threads = True
+    thread = newthread(target=server.serve_forever)
+    thread.start()
+    client = EPCClient(address)
+    try:
+        args = ['x' * size]
+        client.call_sync('echo', args)  # warm up
+        timings = []
+        for _ in range(repeat):
+            start = time.time()
+            client.call_sync('echo', args)
+            timings.append(time.time() - start)
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+    timings.sort()
+    return (timings[len(timings) // 2], timings[int(len(timings) * 0.99)])
+
+
+def run_tcp(repeat, size):
+    server = ThreadingEPCServer(('localhost', 0))
+    return measure(server, server.server_address, repeat, size)
+
+
+def run_unix(repeat, size):
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, 'epc.sock')
+        return measure(ThreadingUnixEPCServer(path), path, repeat, size)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def main(args=None):
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', default=1000, type=int)
+    parser.add_argument('--size', default=10, type=int,
+                        help='length of the string to echo')
+    ns = parser.parse_args(args)
+    for (name, run) in [('tcp', run_tcp), ('unix', run_unix)]:
+        (median, p99) = run(ns.repeat, ns.size)
+        print('{0:5}  median {1:8.1f} us  p99 {2:8.1f} us'
+              .format(name, median * 1e6, p99 * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,7 @@ import epc
 setup(
     name='epc',
     version=epc.__version__,
-    packages=['epc', 'epc.tests'],
+    packages=['epc', 'epc.bench', 'epc.tests'],
     author=epc.__author__,
     author_email='aka.tkf@gmail.com',
     url='https://github.com/tkf/python-epc',
@@ -26,6 +26,6 @@ setup(
         # see: http://pypi.python.org/pypi?%3Aaction=list_classifiers
     ],
     install_requires=[
-        'sexpdata >= 0.0.3',
+        'sexpdata >= 1.0.0',
     ],
 )